@@ -2,19 +2,80 @@ from flask import Flask
 from flask_cors import CORS
 from dotenv import load_dotenv
 import os
+import logging
 
 def create_app():
-    app = Flask(__name__)
+    app = Flask(__name__, template_folder='../templates', static_folder='../static')
     CORS(app)
-    
+
     # 環境変数の読み込み
     load_dotenv(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config', '.env'))
-    
+
     # 設定
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev')
-    
+    app.config['LOG_LEVEL'] = os.getenv('LOG_LEVEL', 'INFO')
+    app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', '4'))
+    app.config['JOB_MAX_RETAINED'] = int(os.getenv('JOB_MAX_RETAINED', '1000'))
+    # 生成の受け付け制御（同時実行数の既定値は JOB_WORKERS）
+    app.config['GENERATE_MAX_CONCURRENT'] = int(os.getenv('GENERATE_MAX_CONCURRENT') or '0')
+    app.config['GENERATE_MAX_QUEUE'] = int(os.getenv('GENERATE_MAX_QUEUE', '32'))
+    app.config['GENERATE_IDLE_TIMEOUT'] = float(os.getenv('GENERATE_IDLE_TIMEOUT', '30'))
+    app.config['GENERATE_MAX_WAIT'] = float(os.getenv('GENERATE_MAX_WAIT', '240'))
+    app.config['GENERATE_CLIENT_HEADER'] = os.getenv('GENERATE_CLIENT_HEADER', '')
+    app.config['MEMORY_STORE_TTL'] = int(os.getenv('MEMORY_STORE_TTL', '600'))
+    app.config['MEMORY_STORE_MAX_BYTES'] = int(os.getenv('MEMORY_STORE_MAX_BYTES', str(256 * 1024 * 1024)))
+    # ダウンロードの送信方法: 空=ワーカーが送信 / x-accel=nginx（X-Accel-Redirect）/ x-sendfile=Apache・lighttpd（X-Sendfile）
+    app.config['DOWNLOAD_OFFLOAD'] = os.getenv('DOWNLOAD_OFFLOAD', '').lower()
+    app.config['DOWNLOAD_ACCEL_PREFIX'] = os.getenv('DOWNLOAD_ACCEL_PREFIX', '/protected-decks/')
+    app.config['OPENAI_API_KEY'] = os.getenv('OPENAI_API_KEY')
+    app.config['OPENAI_BASE_URL'] = os.getenv('OPENAI_BASE_URL')
+    app.config['LLM_TIMEOUT'] = float(os.getenv('LLM_TIMEOUT', '60'))
+    app.config['LLM_MAX_CONNECTIONS'] = int(os.getenv('LLM_MAX_CONNECTIONS', '20'))
+    app.config['LLM_RPM'] = int(os.getenv('LLM_RPM', '0'))
+    app.config['LLM_TPM'] = int(os.getenv('LLM_TPM', '0'))
+    app.config['LLM_MAX_RETRIES'] = int(os.getenv('LLM_MAX_RETRIES', '5'))
+    app.config['LLM_HEDGE_ENABLED'] = os.getenv('LLM_HEDGE_ENABLED', 'false')
+    app.config['LLM_HEDGE_PERCENTILE'] = float(os.getenv('LLM_HEDGE_PERCENTILE', '95'))
+    app.config['LLM_HEDGE_MODELS'] = os.getenv('LLM_HEDGE_MODELS', '')
+    app.config['LLM_HEDGE_MAX_RATE'] = float(os.getenv('LLM_HEDGE_MAX_RATE', '0.1'))
+
+    # ログ設定（AIレスポンス本文は DEBUG レベルで出力）
+    logging.basicConfig(level=app.config['LOG_LEVEL'], format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    # 処理段階の計測（/metrics でPrometheus形式を出力）
+    from . import metrics
+    metrics.init_app(app)
+
+    # 共有LLMクライアント（接続プールを全リクエストで再利用）
+    from . import llm_client
+    llm_client.init_app(app)
+
+    # OpenAI呼び出しのレート制御・再試行・同一リクエストの集約
+    from . import llm_scheduler
+    llm_scheduler.init_app(app)
+
+    # 応答開始の遅いLLM呼び出しのヘッジ（フォールバックモデルへの並行送信）
+    from . import llm_hedge
+    llm_hedge.init_app(app)
+
+    # 非同期ジョブキュー
+    from . import jobs
+    jobs.init_app(app)
+
+    # /api/generate の同時実行数・待ち行列の制御
+    from . import admission
+    admission.init_app(app)
+
+    # 短時間のメモリ保持ストア（delivery=memory）
+    from . import memory_store
+    memory_store.init_app(app)
+
+    # 生成デッキの保存領域（期限切れ・容量超過分はバックグラウンドで削除）
+    from . import storage
+    storage.init_app(app)
+
     # ルートの登録
     from .main import main as main_blueprint
     app.register_blueprint(main_blueprint)
-    
-    return app 
\ No newline at end of file
+
+    return app
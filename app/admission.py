@@ -0,0 +1,267 @@
+"""
+/api/generate の受け付け制御（同時実行数の上限・待ち行列・クライアントごとの公平な割り当て）
+
+- 同時に実行する生成は max_concurrent 件まで。超過分は待ち行列に入り、枠が空くとクライアント単位のラウンドロビンで開始
+- 待ち行列が満杯なら 503、クライアントが公平な取り分（待ち行列の長さ / 待機中のクライアント数）を超えていれば 429 を即座に返す
+- Retry-After は観測した処理時間（指数移動平均）と待ち件数から算出
+- 開始前に、クライアントが切断した（SSE接続がなく idle_timeout 秒ポーリングもない）・max_wait 秒を超えて待った生成は中止する
+"""
+import math
+import time
+import threading
+from collections import OrderedDict, deque
+from app.metrics import metrics
+
+STATE_WAITING = "waiting"
+STATE_RUNNING = "running"
+STATE_CANCELLED = "cancelled"
+STATE_DONE = "done"
+
+# 処理時間の指数移動平均の重み
+SERVICE_TIME_ALPHA = 0.2
+
+
+class AdmissionRejected(Exception):
+    """
+    受け付けられない生成リクエスト（status は 429 または 503、retry_after は秒）
+    """
+
+    def __init__(self, status: int, retry_after: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """
+    受け付けた1件の生成。start(ticket) は実行枠を確保したときに1回だけ呼ばれる
+    """
+
+    def __init__(self, client: str, start, on_cancel=None, job_id=None):
+        self.client = client
+        self.job_id = job_id
+        self.state = STATE_WAITING
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self.last_seen = self.enqueued_at
+        self.connections = 0
+        self._start = start
+        self._on_cancel = on_cancel
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent=4, max_queue=32, idle_timeout=30.0, max_wait=240.0, default_service_time=60.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.idle_timeout = idle_timeout
+        self.max_wait = max_wait
+        # 処理時間の観測値がない間の見積もり
+        self.service_time = default_service_time
+        self._observed = False
+        self._running = 0
+        # クライアント → 待機中のTicket（先頭のクライアントから順に1件ずつ開始）
+        self._waiting = OrderedDict()
+        self._waiting_count = 0
+        self._tickets = {}
+        self._lock = threading.Lock()
+
+    def submit(self, client: str, start, on_cancel=None, job_id=None) -> Ticket:
+        """
+        実行枠が空いていれば即座に、なければ待ち行列に入れて順番が来たときに start(ticket) を呼ぶ。
+        受け付けられない場合は AdmissionRejected
+        """
+        ticket = Ticket(client, start, on_cancel, job_id)
+        cancelled = []
+        with self._lock:
+            if self._running < self.max_concurrent and not self._waiting_count:
+                self._running += 1
+                ticket.state = STATE_RUNNING
+            else:
+                if self._waiting_count >= self.max_queue:
+                    # 切断済みのクライアントの分を除いてから満杯かを判断する
+                    cancelled = self._reap()
+                self._check_capacity(client)
+                self._waiting.setdefault(client, deque()).append(ticket)
+                self._waiting_count += 1
+            if job_id is not None:
+                self._tickets[job_id] = ticket
+        self._notify_cancelled(cancelled)
+        if ticket.state == STATE_RUNNING:
+            self._start_ticket(ticket)
+        return ticket
+
+    def _check_capacity(self, client: str):
+        if self._waiting_count >= self.max_queue:
+            metrics.inc("admission_rejected_total", status="503")
+            raise AdmissionRejected(503, self.retry_after(), "混み合っているため受け付けできません。しばらくしてから再度お試しください。")
+        queued = self._waiting.get(client)
+        if queued:
+            share = max(1, self.max_queue // len(self._waiting))
+            if len(queued) >= share:
+                metrics.inc("admission_rejected_total", status="429")
+                raise AdmissionRejected(429, self.retry_after(len(queued) * len(self._waiting)), "同時に送信できる生成リクエストの上限に達しました。前の生成の完了をお待ちください。")
+
+    def retry_after(self, ahead=None) -> int:
+        """
+        前に並んでいる件数（省略時は待ち行列の長さ）が同時実行数の枠で処理されるまでの秒数の見積もり
+        """
+        if ahead is None:
+            ahead = self._waiting_count
+        return max(1, math.ceil(self.service_time * (ahead + 1) / self.max_concurrent))
+
+    def release(self, ticket: Ticket):
+        """
+        実行を終えた生成の枠を返し、次の待機中の生成を開始する
+        """
+        with self._lock:
+            if ticket.state != STATE_RUNNING:
+                return
+            ticket.state = STATE_DONE
+            self._tickets.pop(ticket.job_id, None)
+            self._observe(time.monotonic() - ticket.started_at)
+            self._running -= 1
+            started, cancelled = self._dispatch()
+        self._notify_cancelled(cancelled)
+        for next_ticket in started:
+            self._start_ticket(next_ticket)
+
+    def cancel(self, ticket: Ticket, reason="disconnect") -> bool:
+        """
+        開始前の生成を待ち行列から取り除く。既に開始していた場合は False
+        """
+        with self._lock:
+            if ticket.state != STATE_WAITING:
+                return False
+            self._remove(ticket)
+        self._notify_cancelled([(ticket, reason)])
+        return True
+
+    def touch(self, job_id: str):
+        """
+        クライアントがジョブの状況を確認した（接続が続いている）ことを記録する
+        """
+        with self._lock:
+            ticket = self._tickets.get(job_id)
+            if ticket is not None:
+                ticket.last_seen = time.monotonic()
+
+    def attach(self, job_id: str):
+        with self._lock:
+            ticket = self._tickets.get(job_id)
+            if ticket is not None:
+                ticket.connections += 1
+                ticket.last_seen = time.monotonic()
+
+    def detach(self, job_id: str):
+        """
+        SSE接続が閉じられた。接続が残っておらず開始前であれば、待ち行列から取り除く
+        """
+        with self._lock:
+            ticket = self._tickets.get(job_id)
+            if ticket is None:
+                return
+            ticket.connections -= 1
+            ticket.last_seen = time.monotonic()
+            if ticket.connections > 0 or ticket.state != STATE_WAITING:
+                return
+            self._remove(ticket)
+        self._notify_cancelled([(ticket, "disconnect")])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "running": self._running,
+                "waiting": self._waiting_count,
+                "clients": len(self._waiting),
+                "service_time": self.service_time,
+            }
+
+    def _observe(self, seconds: float):
+        if self._observed:
+            self.service_time += SERVICE_TIME_ALPHA * (seconds - self.service_time)
+        else:
+            self.service_time = seconds
+            self._observed = True
+
+    def _dispatch(self):
+        """
+        空いた枠の数だけ、クライアントを順に巡回して待機中の生成を取り出す（中止すべきものは飛ばす）
+        """
+        started = []
+        cancelled = []
+        now = time.monotonic()
+        while self._running < self.max_concurrent and self._waiting:
+            client, queued = next(iter(self._waiting.items()))
+            ticket = queued.popleft()
+            self._waiting_count -= 1
+            if queued:
+                self._waiting.move_to_end(client)
+            else:
+                del self._waiting[client]
+            reason = self._stale(ticket, now)
+            if reason:
+                ticket.state = STATE_CANCELLED
+                self._tickets.pop(ticket.job_id, None)
+                cancelled.append((ticket, reason))
+                continue
+            ticket.state = STATE_RUNNING
+            self._running += 1
+            started.append(ticket)
+        return started, cancelled
+
+    def _stale(self, ticket: Ticket, now: float):
+        if now - ticket.enqueued_at > self.max_wait:
+            return "timeout"
+        if ticket.job_id is not None and ticket.connections <= 0 and now - ticket.last_seen > self.idle_timeout:
+            return "idle"
+        return None
+
+    def _reap(self) -> list:
+        now = time.monotonic()
+        cancelled = []
+        for queued in list(self._waiting.values()):
+            for ticket in list(queued):
+                reason = self._stale(ticket, now)
+                if reason:
+                    self._remove(ticket)
+                    cancelled.append((ticket, reason))
+        return cancelled
+
+    def _remove(self, ticket: Ticket):
+        queued = self._waiting.get(ticket.client)
+        queued.remove(ticket)
+        if not queued:
+            del self._waiting[ticket.client]
+        self._waiting_count -= 1
+        ticket.state = STATE_CANCELLED
+        self._tickets.pop(ticket.job_id, None)
+
+    def _notify_cancelled(self, cancelled):
+        for ticket, reason in cancelled:
+            metrics.inc("admission_cancelled_total", reason=reason)
+            if ticket._on_cancel is not None:
+                ticket._on_cancel(reason)
+
+    def _start_ticket(self, ticket: Ticket):
+        ticket.started_at = time.monotonic()
+        metrics.observe("admission_wait_seconds", ticket.started_at - ticket.enqueued_at)
+        try:
+            ticket._start(ticket)
+        except Exception:
+            self.release(ticket)
+            raise
+
+
+def init_app(app):
+    controller = AdmissionController(
+        max_concurrent=app.config.get('GENERATE_MAX_CONCURRENT') or app.config.get('JOB_WORKERS', 4),
+        max_queue=app.config.get('GENERATE_MAX_QUEUE', 32),
+        idle_timeout=app.config.get('GENERATE_IDLE_TIMEOUT', 30),
+        max_wait=app.config.get('GENERATE_MAX_WAIT', 240),
+    )
+    app.extensions['admission'] = controller
+    return controller
+
+
+def get_admission(app):
+    return app.extensions['admission']
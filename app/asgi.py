@@ -0,0 +1,243 @@
+"""
+ASGIサーバー向けのエントリポイント（非同期モード）
+
+    uvicorn app.asgi:application --host 0.0.0.0 --port 5000
+
+POST /api/generate はイベントループ上で非同期OpenAIクライアントを使って処理し、
+PPTX描画（CPU処理）とファイル保存はスレッドプールで実行する。応答待ちの生成はスレッドを
+占有しないため、1プロセスで多数の生成を同時に保持できる（同時実行数の既定値は LLM_ASYNC_MAX_CONNECTIONS）。
+それ以外のルート（/、/api/download/<filename>、ジョブ状況など）は既存のFlaskアプリで処理する。
+Flaskのルートはリクエストごとに別のスレッドで実行するため、SSE接続が開いたままでも他のリクエストを待たせない。
+"""
+import os
+import json
+import uuid
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+from app import create_app
+from app.admission import get_admission, AdmissionRejected
+from app.jobs import get_job_queue, STAGE_LLM, STAGE_RENDERING
+from app.memory_store import get_memory_store
+from app.main import (
+    CANCEL_MESSAGES, PPTX_MIMETYPE, accepted_payload, cancel_callback, client_key, finish_deck, finish_preview,
+    llm_progress_callback, parse_generate_request, rejected_payload,
+)
+from app.pptx_creator import render_presentation_bytes
+from app.slide_generator import agenerate_slide_structure
+
+logger = logging.getLogger(__name__)
+
+flask_app = create_app()
+_wsgi_app = WsgiToAsgi(flask_app)
+_render_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('ASYNC_RENDER_WORKERS', '4')), thread_name_prefix="slide-render"
+)
+# 実行中の生成タスク（ガベージコレクションで破棄されないよう参照を保持）
+_tasks = set()
+# 応答待ちはスレッドを占有しないため、同時実行数の既定値はワーカー数ではなく非同期クライアントの接続数
+if not flask_app.config.get('GENERATE_MAX_CONCURRENT'):
+    get_admission(flask_app).max_concurrent = int(os.getenv('LLM_ASYNC_MAX_CONNECTIONS') or '100')
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+    elif scope["type"] == "http" and scope["path"] == "/api/generate" and scope["method"] == "POST":
+        await generate_slide(scope, receive, send)
+    else:
+        await _wsgi(scope, receive, send)
+
+
+async def _wsgi(scope, receive, send):
+    # WsgiToAsgi は既定で全リクエストを同じ1つのスレッドで順に実行するため、リクエストごとにスレッドを分ける
+    async with ThreadSensitiveContext():
+        await _wsgi_app(scope, receive, send)
+
+
+async def generate_slide(scope, receive, send):
+    try:
+        try:
+            data = json.loads(await _read_body(receive) or b"{}")
+        except json.JSONDecodeError:
+            await _send_json(send, 400, {"status": "error", "message": "リクエストの形式が不正です。"})
+            return
+        try:
+            content, use_cache, delivery = parse_generate_request(data if isinstance(data, dict) else {})
+        except ValueError as e:
+            await _send_json(send, 400, {"status": "error", "message": str(e)})
+            return
+        admission = get_admission(flask_app)
+        client = client_key(flask_app.config, _headers(scope), (scope.get("client") or ("",))[0])
+        if delivery == 'inline':
+            await _generate_inline(receive, send, admission, client, content, use_cache)
+            return
+
+        queue = get_job_queue(flask_app)
+        memory_store = get_memory_store(flask_app) if delivery == 'memory' else None
+        job_id = queue.create()
+        loop = asyncio.get_running_loop()
+        try:
+            # 実行枠が空き次第イベントループ上で開始（枠の解放は別スレッドから呼ばれることもある）
+            admission.submit(
+                client,
+                lambda ticket: _call_on_loop(loop, _spawn, _run_admitted(admission, ticket, run_generation_job(
+                    job_id, queue, content, use_cache, memory_store, render=delivery != 'preview'
+                ))),
+                on_cancel=cancel_callback(job_id, queue),
+                job_id=job_id,
+            )
+        except AdmissionRejected:
+            queue.discard(job_id)
+            raise
+        payload = accepted_payload(job_id)
+        await _send_json(send, 202, payload, headers=[(b"location", payload["status_url"].encode())])
+    except AdmissionRejected as e:
+        await _send_rejected(send, e)
+    except Exception as e:
+        await _send_json(send, 500, {"status": "error", "message": str(e)})
+
+
+def _call_on_loop(loop, func, *args):
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        func(*args)
+    else:
+        loop.call_soon_threadsafe(func, *args)
+
+
+def _spawn(coro):
+    task = asyncio.ensure_future(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def _run_admitted(admission, ticket, job):
+    try:
+        await job
+    finally:
+        admission.release(ticket)
+
+
+async def run_generation_job(job_id: str, queue, content: str, use_cache: bool = True, memory_store=None, render=True):
+    """
+    イベントループ上で実行: スライド構造生成（非同期） → PowerPoint生成（スレッドプール）
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        queue.update(job_id, stage=STAGE_LLM, progress=10)
+        slide_structure = await agenerate_slide_structure(
+            content,
+            on_slide=lambda slide: queue.add_slide(job_id, slide),
+            on_progress=llm_progress_callback(job_id, queue),
+            use_cache=use_cache,
+        )
+        if slide_structure.get("status") == "error":
+            queue.fail(job_id, slide_structure.get("message", "スライド構造の生成に失敗しました。"))
+            return
+        if not render:
+            finish_preview(job_id, queue, slide_structure)
+            return
+
+        queue.update(job_id, stage=STAGE_RENDERING, progress=85)
+        try:
+            pptx_bytes = await loop.run_in_executor(_render_executor, render_presentation_bytes, slide_structure)
+        except Exception as e:
+            queue.fail(job_id, f"PPTX生成エラー: {str(e)}")
+            return
+        await loop.run_in_executor(
+            _render_executor, finish_deck, job_id, queue, pptx_bytes, slide_structure, memory_store
+        )
+    except Exception as e:
+        logger.exception("生成ジョブが失敗しました")
+        queue.fail(job_id, str(e))
+
+
+async def _generate_inline(receive, send, admission, client: str, content: str, use_cache: bool):
+    """
+    実行枠を待ってから生成する。待っている間にクライアントが切断したら生成せずに終える
+    """
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    ticket = admission.submit(client, lambda ticket: _call_on_loop(loop, ready.set))
+    waiting = asyncio.ensure_future(ready.wait())
+    disconnected = asyncio.ensure_future(_wait_disconnect(receive))
+    await asyncio.wait({waiting, disconnected}, timeout=admission.max_wait, return_when=asyncio.FIRST_COMPLETED)
+    waiting.cancel()
+    disconnected.cancel()
+    if not ready.is_set():
+        reason = "disconnect" if disconnected.done() and not disconnected.cancelled() else "timeout"
+        if admission.cancel(ticket, reason):
+            if reason == "timeout":
+                await _send_rejected(send, AdmissionRejected(503, admission.retry_after(), CANCEL_MESSAGES["timeout"]))
+            return
+    try:
+        slide_structure = await agenerate_slide_structure(content, use_cache=use_cache)
+        if slide_structure.get("status") == "error":
+            await _send_json(send, 500, slide_structure)
+            return
+        pptx_bytes = await loop.run_in_executor(_render_executor, render_presentation_bytes, slide_structure)
+    finally:
+        admission.release(ticket)
+    filename = f"presentation_{uuid.uuid4().hex}.pptx"
+    await _send(send, 200, pptx_bytes, [
+        (b"content-type", PPTX_MIMETYPE.encode()),
+        (b"content-disposition", f"attachment; filename={filename}".encode()),
+    ])
+
+
+async def _read_body(receive) -> bytes:
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return body
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def _wait_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+def _headers(scope) -> dict:
+    return {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope.get("headers", [])}
+
+
+async def _send_rejected(send, error: AdmissionRejected):
+    await _send_json(send, error.status, rejected_payload(error), headers=[(b"retry-after", str(error.retry_after).encode())])
+
+
+async def _send_json(send, status: int, payload: dict, headers=()):
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    await _send(send, status, body, [(b"content-type", b"application/json"), *headers])
+
+
+async def _send(send, status: int, body: bytes, headers):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [*headers, (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            # 実行中の生成の完了を待ってから終了
+            if _tasks:
+                await asyncio.wait(set(_tasks))
+            _render_executor.shutdown(wait=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
@@ -0,0 +1,196 @@
+"""
+ソーステキストのディレクトリ（またはJSONL）からスライドを一括生成するオフラインバッチ
+
+使用例:
+    python -m app.batch briefs/ --output-dir data/batch --concurrency 8 --render-workers 4
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from app.llm_scheduler import PRIORITY_BATCH
+from app.slide_generator import generate_slide_structure
+from app.pptx_stream import stream_presentation
+from app.storage import SAFE_FILENAME
+
+SOURCE_SUFFIXES = (".txt", ".md")
+
+
+def load_sources(source: Path) -> list:
+    """
+    (id, content) のリストを返す。ディレクトリは .txt/.md、JSONLは {"id", "content"} 形式
+    """
+    if source.is_dir():
+        return [
+            (path.stem, path.read_text(encoding="utf-8"))
+            for path in sorted(source.iterdir())
+            if path.suffix in SOURCE_SUFFIXES
+        ]
+    items = []
+    with open(source, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            items.append((str(record.get("id", line_no)), record["content"]))
+    return items
+
+
+def valid_item_id(item_id: str) -> bool:
+    """
+    出力ファイル名に使えるIDか（英数字・_・-・. のみ。先頭の . とパス区切りは不可）
+    """
+    return bool(SAFE_FILENAME.fullmatch(item_id)) and not item_id.startswith(".")
+
+
+def load_manifest(manifest_path: Path) -> dict:
+    """
+    マニフェストから完了済みの結果を読み込む（同じIDは最後の記録を優先）
+    """
+    done = {}
+    if not manifest_path.exists():
+        return done
+    with open(manifest_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 異常終了で途中まで書かれた行は無視
+                continue
+            if record.get("status") == "done":
+                done[record["id"]] = record
+            else:
+                done.pop(record["id"], None)
+    return done
+
+
+def _generate(item_id: str, content: str, use_cache: bool):
+    start = time.perf_counter()
+    # 画面からの生成を優先させるためバッチ優先度で送信
+    structure = generate_slide_structure(content, use_cache=use_cache, priority=PRIORITY_BATCH)
+    return item_id, structure, time.perf_counter() - start
+
+
+def _render(structure: dict, output_path: str):
+    # プロセスプールで実行されるためモジュールトップレベルに定義
+    # 長いレポートから数百枚のデッキになることがあるため、1枚ずつファイルへ書き出してメモリを一定に保つ
+    start = time.perf_counter()
+    result = stream_presentation(structure.get("slides", []), output_path, structure.get("title", ""))
+    return result, time.perf_counter() - start
+
+
+def _percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def print_stats(records: list, elapsed: float, out=sys.stdout):
+    done = [r for r in records if r["status"] == "done"]
+    failed = len(records) - len(done)
+    print(f"\n完了: {len(done)}件 / 失敗: {failed}件 / 経過時間: {elapsed:.1f}秒", file=out)
+    if elapsed > 0:
+        print(f"スループット: {len(done) / elapsed * 60:.1f} デッキ/分", file=out)
+    for label, key in (("LLM", "llm_seconds"), ("レンダリング", "render_seconds"), ("合計", "total_seconds")):
+        values = [r[key] for r in done if key in r]
+        if values:
+            print(
+                f"{label}: p50={_percentile(values, 50):.2f}s p95={_percentile(values, 95):.2f}s "
+                f"max={max(values):.2f}s",
+                file=out,
+            )
+
+
+def run_batch(source: Path, output_dir: Path, manifest_path: Path = None, concurrency=4, render_workers=None, use_cache=True) -> list:
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = manifest_path or output_dir / "manifest.jsonl"
+    finished = load_manifest(manifest_path)
+    items = [(item_id, content) for item_id, content in load_sources(source) if item_id not in finished]
+    print(f"対象: {len(items)}件（完了済みのためスキップ: {len(finished)}件）")
+
+    records = []
+    started_at = {}
+    start = time.perf_counter()
+    with open(manifest_path, "a", encoding="utf-8") as manifest, \
+            ThreadPoolExecutor(max_workers=concurrency) as llm_pool, \
+            ProcessPoolExecutor(max_workers=render_workers) as render_pool:
+
+        def record(entry):
+            manifest.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            manifest.flush()
+            records.append(entry)
+            print(f"[{entry['status']}] {entry['id']}" + (f": {entry['message']}" if "message" in entry else ""))
+
+        pending = {}
+        for item_id, content in items:
+            if not valid_item_id(item_id):
+                record({"id": item_id, "status": "failed", "stage": "input", "message": "IDに使用できない文字が含まれています。"})
+                continue
+            started_at[item_id] = time.perf_counter()
+            pending[llm_pool.submit(_generate, item_id, content, use_cache)] = ("llm", item_id, None, None)
+
+        while pending:
+            # 完了したものをまとめて処理する（as_completed を毎回作り直すと件数の2乗の待機登録になる）
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, item_id, llm_seconds, output_path = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    record({"id": item_id, "status": "failed", "stage": stage, "message": str(e)})
+                    continue
+
+                if stage == "llm":
+                    _, structure, llm_seconds = result
+                    if structure.get("status") == "error":
+                        record({"id": item_id, "status": "failed", "stage": stage, "message": structure.get("message", "")})
+                        continue
+                    output_path = str(output_dir / f"{item_id}.pptx")
+                    pending[render_pool.submit(_render, structure, output_path)] = ("render", item_id, llm_seconds, output_path)
+                    continue
+
+                output, render_seconds = result
+                if output != output_path:
+                    record({"id": item_id, "status": "failed", "stage": stage, "message": output})
+                    continue
+                record({
+                    "id": item_id,
+                    "status": "done",
+                    "output": output,
+                    "llm_seconds": round(llm_seconds, 3),
+                    "render_seconds": round(render_seconds, 3),
+                    "total_seconds": round(time.perf_counter() - started_at[item_id], 3),
+                })
+
+    print_stats(records, time.perf_counter() - start)
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ソーステキストからスライドを一括生成します")
+    parser.add_argument("source", type=Path, help=".txt/.md を含むディレクトリ、または {id, content} のJSONLファイル")
+    parser.add_argument("--output-dir", type=Path, default=Path("data") / "batch", help="PPTXとマニフェストの出力先")
+    parser.add_argument("--manifest", type=Path, default=None, help="再開用マニフェスト（既定: 出力先/manifest.jsonl）")
+    parser.add_argument("--concurrency", type=int, default=4, help="LLM呼び出しの同時実行数")
+    parser.add_argument("--render-workers", type=int, default=os.cpu_count(), help="PPTXレンダリングのプロセス数")
+    parser.add_argument("--no-cache", action="store_true", help="スライド構造キャッシュを参照しない")
+    args = parser.parse_args(argv)
+
+    records = run_batch(
+        args.source,
+        args.output_dir,
+        manifest_path=args.manifest,
+        concurrency=args.concurrency,
+        render_workers=args.render_workers,
+        use_cache=not args.no_cache,
+    )
+    return 1 if any(r["status"] != "done" for r in records) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+"""
+スライドの data（{"項目": "値"}）の描画方法を決めるデータ描画エンジン
+
+- 値（"300万円"・"1.2億円"・"80%"・1200 など）を1回の走査でまとめて数値と単位に分解
+- 件数と値の揃い方から、図形（従来の数値ボックス）・ネイティブ表・ネイティブグラフのいずれかを選択
+- 1枚に収まらない表は複数スライドに自動で分割
+"""
+import re
+from collections import namedtuple
+
+KIND_BOXES = "boxes"
+KIND_TABLE = "table"
+KIND_CHART = "chart"
+
+# 漢数字の桁（円・人などの単位の前に付くもの）
+SCALES = {"千": 1e3, "万": 1e4, "百万": 1e6, "千万": 1e7, "億": 1e8, "兆": 1e12}
+# グラフの軸・ラベルに使う表示桁（大きい順）
+DISPLAY_SCALES = (("兆", 1e12), ("億", 1e8), ("万", 1e4))
+# 棒グラフにする項目数の範囲（多すぎると判読できないため表にする）
+CHART_MIN_POINTS = 3
+CHART_MAX_POINTS = 12
+
+_VALUE = re.compile(
+    r"^\s*(?:約|およそ|推定)?\s*[¥￥$]?\s*(?P<sign>[-+−△▲])?\s*"
+    r"(?P<number>\d[\d,，]*(?:\.\d+)?)\s*"
+    r"(?P<scale>百万|千万|千|万|億|兆)?\s*"
+    r"(?P<unit>%|％|[^\d\s\"'（(、,，。/:：]{0,4})"
+)
+
+DataPoint = namedtuple("DataPoint", "label text value unit")
+DataBlock = namedtuple("DataBlock", "kind points unit scale scale_label")
+
+
+def parse_data(data: dict) -> list:
+    """
+    data の全項目を DataPoint（表示文字列・数値・単位）に変換する。数値として読めない値は value=None
+    """
+    points = []
+    for label, raw in data.items():
+        text = _display_text(raw)
+        value, unit = _parse_value(raw, text)
+        points.append(DataPoint(str(label), text, value, unit))
+    return points
+
+
+def _display_text(raw) -> str:
+    if isinstance(raw, bool) or raw is None:
+        return "" if raw is None else str(raw)
+    if isinstance(raw, int):
+        return f"{raw:,}"
+    if isinstance(raw, float):
+        return f"{raw:,.2f}".rstrip("0").rstrip(".")
+    return str(raw).strip()
+
+
+def _parse_value(raw, text: str):
+    if isinstance(raw, bool):
+        return None, ""
+    if isinstance(raw, (int, float)):
+        return float(raw), ""
+    match = _VALUE.match(text)
+    if match is None:
+        return None, ""
+    value = float(match.group("number").replace(",", "").replace("，", ""))
+    if match.group("sign") in ("-", "−", "△", "▲"):
+        value = -value
+    value *= SCALES.get(match.group("scale"), 1)
+    unit = match.group("unit").replace("％", "%")
+    return value, unit
+
+
+def chartable(points: list, min_points=CHART_MIN_POINTS) -> bool:
+    """
+    全項目が数値で単位が揃っており、グラフで比較できる件数であれば True
+    """
+    if not min_points <= len(points) <= CHART_MAX_POINTS:
+        return False
+    if any(p.value is None for p in points):
+        return False
+    return len({p.unit for p in points}) == 1
+
+
+def display_scale(points: list):
+    """
+    グラフ表示用の (割る数, 桁の表記) を返す（例: すべて1億以上なら (1e8, "億")）
+    """
+    # 最小の値が1未満にならない範囲で最大の桁を選ぶ（例: 1,200万円と3.6億円は「万」でそろえる）
+    values = [abs(p.value) for p in points if p.value]
+    if values and points[0].unit != "%":
+        smallest = min(values)
+        for label, scale in DISPLAY_SCALES:
+            if smallest >= scale:
+                return scale, label
+    return 1, ""
+
+
+def plan_data(data: dict, box_limit: int, rows_per_page: int, min_chart_points=CHART_MIN_POINTS) -> list:
+    """
+    data の描画方法を決め、スライド1枚ごとの DataBlock のリストを返す（data が空なら空リスト）
+
+    - box_limit 件以下: 各レイアウト従来の図形（数値ボックス・メトリクス枠）
+    - 数値・単位が揃っている（min_chart_points=None ならグラフにしない）: ネイティブグラフ（1枚）
+    - それ以外: ネイティブ表（rows_per_page 件ごとに分割）
+    """
+    if not data:
+        return []
+    points = parse_data(data)
+    if len(points) <= box_limit:
+        return [DataBlock(KIND_BOXES, points, "", 1, "")]
+    if min_chart_points is not None and chartable(points, min_chart_points):
+        scale, scale_label = display_scale(points)
+        return [DataBlock(KIND_CHART, points, points[0].unit, scale, scale_label)]
+    return [
+        DataBlock(KIND_TABLE, points[i:i + rows_per_page], "", 1, "")
+        for i in range(0, len(points), rows_per_page)
+    ]
+
+
+def page_title(title: str, page: int, pages: int) -> str:
+    return f"{title}（{page + 1}/{pages}）" if pages > 1 else title
+
+
+def continuation_slide(slide: dict, page: int, pages: int) -> dict:
+    """
+    分割した2枚目以降のスライド（本文・補足は1枚目のみに表示）
+    """
+    content = slide.get("content", {})
+    if page == 0:
+        return {**slide, "title": page_title(slide.get("title", ""), page, pages)}
+    return {
+        **slide,
+        "title": page_title(slide.get("title", ""), page, pages),
+        "content": {**content, "main_message": "", "supporting_points": []},
+    }
+
+
+def _integral(block: DataBlock) -> bool:
+    return all(float(p.value / block.scale).is_integer() for p in block.points)
+
+
+def _suffix(block: DataBlock) -> str:
+    return (block.scale_label + block.unit).replace('"', "")
+
+
+def chart_number_format(block: DataBlock) -> str:
+    """
+    データラベルの表示形式（例: '#,##0.0"億円"'）。単位は引用符で囲んで表示する
+    """
+    suffix = _suffix(block)
+    return ("#,##0" if _integral(block) else "#,##0.0") + (f'"{suffix}"' if suffix else "")
+
+
+def format_chart_value(block: DataBlock, point: DataPoint) -> str:
+    """
+    chart_number_format と同じ表示（プレビュー用）
+    """
+    value = point.value / block.scale
+    return (f"{value:,.0f}" if _integral(block) else f"{value:,.1f}") + _suffix(block)
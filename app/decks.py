@@ -0,0 +1,49 @@
+import json
+from app.metrics import metrics
+from app.storage import get_deck_storage
+
+
+def deck_filename(deck_id: str) -> str:
+    return f"presentation_{deck_id}.pptx"
+
+
+def structure_filename(deck_id: str) -> str:
+    return f"presentation_{deck_id}.json"
+
+
+def save_deck(deck_id: str, pptx_bytes: bytes, structure: dict, memory_store=None) -> str:
+    """
+    PPTXと元のスライド構造を保存し、ダウンロード用ファイル名を返す（スライド単位の再生成に使用）
+
+    メモリ保持の上限に収まらないデッキはディスクに保存する
+    """
+    filename = deck_filename(deck_id)
+    structure_bytes = json.dumps(structure, ensure_ascii=False).encode("utf-8")
+    if memory_store is not None and not memory_store.fits(len(pptx_bytes) + len(structure_bytes)):
+        memory_store = None
+    with metrics.span("save", backend="memory" if memory_store is not None else "disk"):
+        if memory_store is not None:
+            memory_store.put(filename, pptx_bytes)
+            memory_store.put(structure_filename(deck_id), structure_bytes)
+        else:
+            storage = get_deck_storage()
+            storage.write(filename, pptx_bytes)
+            storage.write(structure_filename(deck_id), structure_bytes)
+    return filename
+
+
+def load_deck(deck_id: str, memory_store=None):
+    """
+    保存済みの (PPTXバイト列, スライド構造) を返す。存在しない場合は None
+    """
+    if memory_store is not None:
+        pptx_bytes = memory_store.get(deck_filename(deck_id))
+        structure_bytes = memory_store.get(structure_filename(deck_id))
+        if pptx_bytes is not None and structure_bytes is not None:
+            return pptx_bytes, json.loads(structure_bytes)
+    storage = get_deck_storage()
+    pptx_bytes = storage.read(deck_filename(deck_id))
+    structure_bytes = storage.read(structure_filename(deck_id))
+    if pptx_bytes is None or structure_bytes is None:
+        return None
+    return pptx_bytes, json.loads(structure_bytes)
@@ -0,0 +1,156 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from app.metrics import metrics
+
+# ジョブの進行段階
+STAGE_QUEUED = "queued"
+STAGE_LLM = "llm"
+STAGE_RENDERING = "rendering"
+STAGE_DONE = "done"
+STAGE_FAILED = "failed"
+FINISHED_STAGES = (STAGE_DONE, STAGE_FAILED)
+
+
+class JobQueue:
+    """
+    スライド生成ジョブを上限付きワーカープールで非同期実行し、進行状況を保持する
+    """
+
+    def __init__(self, max_workers=4, max_jobs=1000):
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="slide-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+
+    def submit(self, func, *args, **kwargs) -> str:
+        """
+        ジョブを登録してジョブIDを返す。funcは先頭引数にジョブIDを受け取る
+        """
+        job_id = self.create()
+        self.start(job_id, func, *args, **kwargs)
+        return job_id
+
+    def start(self, job_id: str, func, *args, **kwargs):
+        """
+        登録済みのジョブをワーカープールで実行する（受け付け制御で順番待ちしたジョブの開始）
+        """
+        self._executor.submit(self._run, job_id, func, args, kwargs)
+
+    def create(self) -> str:
+        """
+        実行をワーカープールに任せずにジョブだけを登録する（非同期モードではイベントループ上で実行）
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "stage": STAGE_QUEUED,
+                "progress": 0,
+                "slides": [],
+                "version": 0,
+                "created_at": now,
+                "updated_at": now,
+            }
+            self._prune()
+        return job_id
+
+    def discard(self, job_id: str):
+        """
+        受け付けなかったジョブを取り除く
+        """
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._snapshot(job_id)
+
+    def update(self, job_id: str, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.update(fields)
+            self._touch(job)
+
+    def add_slide(self, job_id: str, slide: dict):
+        """
+        生成途中で確定したスライドを追加する
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["slides"].append(slide)
+            self._touch(job)
+
+    def wait_for_change(self, job_id: str, version: int, timeout=15):
+        """
+        ジョブがversionより新しくなるか完了するまで待機し、スナップショットを返す
+        """
+        with self._changed:
+            self._changed.wait_for(
+                lambda: job_id not in self._jobs
+                or self._jobs[job_id]["version"] > version
+                or self._jobs[job_id]["stage"] in FINISHED_STAGES,
+                timeout=timeout,
+            )
+            return self._snapshot(job_id)
+
+    def _snapshot(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        snapshot = dict(job)
+        snapshot["slides"] = list(job["slides"])
+        return snapshot
+
+    def _touch(self, job):
+        job["version"] += 1
+        job["updated_at"] = time.time()
+        self._changed.notify_all()
+
+    def fail(self, job_id: str, message: str):
+        metrics.inc("errors_total", type="job_failed")
+        self.update(job_id, stage=STAGE_FAILED, message=message)
+
+    def _run(self, job_id, func, args, kwargs):
+        try:
+            func(job_id, *args, **kwargs)
+        except Exception as e:
+            self.fail(job_id, str(e))
+
+    def _prune(self):
+        # 保持件数を超えた場合は完了済みの古いジョブから破棄
+        if len(self._jobs) <= self.max_jobs:
+            return
+        finished = sorted(
+            (job for job in self._jobs.values() if job["stage"] in FINISHED_STAGES),
+            key=lambda job: job["updated_at"],
+        )
+        for job in finished[:len(self._jobs) - self.max_jobs]:
+            del self._jobs[job["job_id"]]
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+def init_app(app):
+    """
+    アプリケーションにジョブキューを登録する
+    """
+    queue = JobQueue(
+        max_workers=app.config.get('JOB_WORKERS', 4),
+        max_jobs=app.config.get('JOB_MAX_RETAINED', 1000),
+    )
+    app.extensions['job_queue'] = queue
+    return queue
+
+
+def get_job_queue(app):
+    return app.extensions['job_queue']
@@ -0,0 +1,109 @@
+import os
+import threading
+import httpx
+import openai
+from dotenv import load_dotenv
+from pathlib import Path
+
+_client = None
+_async_client = None
+_lock = threading.Lock()
+
+
+def build_llm_client(api_key=None, base_url=None, timeout=60, max_connections=20, max_keepalive=10, keepalive_expiry=60):
+    """
+    接続プールを保持する OpenAI クライアントを生成（タイムアウトはリクエスト単位で指定）
+    """
+    api_key = api_key or os.getenv('OPENAI_API_KEY')
+    if not api_key:
+        raise ValueError('OpenAI APIキーが設定されていません。')
+    http_client = httpx.Client(
+        timeout=timeout,
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        ),
+    )
+    return openai.OpenAI(
+        api_key=api_key,
+        base_url=base_url or os.getenv('OPENAI_BASE_URL') or None,
+        timeout=timeout,
+        http_client=http_client,
+    )
+
+
+def build_async_llm_client(api_key=None, base_url=None, timeout=60, max_connections=100, max_keepalive=20, keepalive_expiry=60):
+    """
+    非同期モード（ASGI）用の AsyncOpenAI クライアントを生成。待機中の生成がスレッドを占有しないため接続数は多めにとる
+    """
+    api_key = api_key or os.getenv('OPENAI_API_KEY')
+    if not api_key:
+        raise ValueError('OpenAI APIキーが設定されていません。')
+    http_client = httpx.AsyncClient(
+        timeout=timeout,
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        ),
+    )
+    return openai.AsyncOpenAI(
+        api_key=api_key,
+        base_url=base_url or os.getenv('OPENAI_BASE_URL') or None,
+        timeout=timeout,
+        http_client=http_client,
+    )
+
+
+def init_app(app):
+    """
+    アプリ起動時にプロセス共通のクライアントを1度だけ構成する
+    """
+    global _client
+    with _lock:
+        if _client is None:
+            try:
+                _client = build_llm_client(
+                    api_key=app.config.get('OPENAI_API_KEY'),
+                    base_url=app.config.get('OPENAI_BASE_URL'),
+                    timeout=app.config.get('LLM_TIMEOUT', 60),
+                    max_connections=app.config.get('LLM_MAX_CONNECTIONS', 20),
+                )
+            except ValueError as e:
+                # APIキー未設定でも画面は起動し、生成時にエラーを返す
+                app.logger.warning(str(e))
+        app.extensions['llm_client'] = _client
+    return _client
+
+
+def get_llm_client():
+    """
+    共有クライアントを返す。create_app を経由しない実行（CLI・テスト）では環境変数から構成する
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                load_dotenv(dotenv_path=Path(__file__).parent.parent / 'config' / '.env')
+                _client = build_llm_client(
+                    timeout=float(os.getenv('LLM_TIMEOUT', '60')),
+                    max_connections=int(os.getenv('LLM_MAX_CONNECTIONS', '20')),
+                )
+    return _client
+
+
+def get_async_llm_client():
+    """
+    非同期モード用の共有クライアントを返す（イベントループ1つで使う前提）
+    """
+    global _async_client
+    if _async_client is None:
+        with _lock:
+            if _async_client is None:
+                load_dotenv(dotenv_path=Path(__file__).parent.parent / 'config' / '.env')
+                _async_client = build_async_llm_client(
+                    timeout=float(os.getenv('LLM_TIMEOUT', '60')),
+                    max_connections=int(os.getenv('LLM_ASYNC_MAX_CONNECTIONS', '100')),
+                )
+    return _async_client
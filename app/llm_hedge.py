@@ -0,0 +1,266 @@
+"""
+LLM呼び出しのヘッジ（応答の遅いリクエストのテールレイテンシ対策）
+
+- 最初のリクエストが「過去の初回トークンまでの時間のパーセンタイル」以内に応答を始めなければ、
+  フォールバックモデルで2つ目のリクエストを送信し、先に有効な応答を返した方を採用してもう一方は中止する
+- 失敗したリクエスト（スケジューラーの再試行後）は次のフォールバックモデルで送信し直す
+- 遅延によるヘッジは直近のリクエストの max_rate 以下に抑える（平均コストはほぼ増えない）
+"""
+import os
+import time
+import queue
+import asyncio
+import logging
+import threading
+from collections import deque
+from app.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+REASON_SLOW = "slow"
+REASON_ERROR = "error"
+
+
+class HedgeAttempt:
+    """
+    ヘッジ中の1回の送信。中止時に呼ぶ処理（ストリームのクローズなど）を登録できる
+    """
+
+    def __init__(self, model: str, hedge=False):
+        self.model = model
+        self.hedge = hedge
+        self.cancelled = False
+        self._closers = []
+        self._lock = threading.Lock()
+
+    def on_cancel(self, closer):
+        # 中止済みであれば（結果が遅れて届いた場合）すぐに閉じる
+        with self._lock:
+            if not self.cancelled:
+                self._closers.append(closer)
+                return
+        _close(closer)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            closers, self._closers = self._closers, []
+        for closer in closers:
+            _close(closer)
+
+
+def _close(closer):
+    try:
+        closer()
+    except Exception as e:
+        logger.debug("中止したLLMリクエストのクローズに失敗しました: %s", e)
+
+
+class HedgePolicy:
+    def __init__(self, enabled=False, percentile=95.0, models=(), max_rate=0.1,
+                 min_delay=1.0, default_delay=10.0, window=200, min_samples=20):
+        self.enabled = enabled
+        self.percentile = percentile
+        # ヘッジ・失敗時に使うモデル（先頭から順に使用。空なら元のモデルで再送信）
+        self.models = tuple(models)
+        self.max_rate = max_rate
+        self.min_delay = min_delay
+        # 計測値が min_samples 件に満たない間の待ち時間
+        self.default_delay = default_delay
+        self.min_samples = min_samples
+        self._samples = {}
+        self._window = window
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def delay(self, mode: str) -> float:
+        """
+        ヘッジを送信するまでの待ち時間（mode ごとの応答開始までの時間のパーセンタイル）
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(mode, ()))
+        if len(samples) < self.min_samples:
+            return self.default_delay
+        index = min(len(samples) - 1, int(len(samples) * self.percentile / 100))
+        return max(self.min_delay, samples[index])
+
+    def observe(self, mode: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(mode, deque(maxlen=self._window)).append(seconds)
+
+    def hedge_rate(self) -> float:
+        with self._lock:
+            return sum(self._recent) / len(self._recent) if self._recent else 0.0
+
+    def _admit(self) -> bool:
+        """
+        このリクエストで遅延によるヘッジを許可するか（直近のヘッジ率が max_rate 未満）
+        """
+        metrics.inc("llm_hedge_requests_total")
+        with self._lock:
+            return sum(self._recent) < self.max_rate * max(len(self._recent), 1)
+
+    def _finish(self, mode, start, winner, hedged):
+        with self._lock:
+            self._recent.append(hedged)
+        # ヘッジした方が勝った場合、元のリクエストの所要時間は少なくとも経過時間以上
+        self.observe(mode, time.perf_counter() - start)
+        if hedged:
+            metrics.inc("llm_hedge_wins_total", winner="hedge" if winner.hedge else "primary", model=winner.model)
+
+    def _next_attempt(self, fallbacks: list, reason: str) -> HedgeAttempt:
+        model = fallbacks.pop(0)
+        metrics.inc("llm_hedges_total", reason=reason, model=model)
+        logger.info("LLMリクエストをヘッジします（%s, model=%s）", reason, model)
+        return HedgeAttempt(model, hedge=True)
+
+    def run(self, func, model: str, mode: str):
+        """
+        func(attempt) を実行し、遅い・失敗した場合はフォールバックモデルで並行して送信する。最初に成功した結果を返す
+
+        func は応答の開始（ストリーミングなら最初のトークン）まで待って返し、attempt.model のモデルで送信する
+        """
+        if not self.enabled:
+            return func(HedgeAttempt(model))
+        results = queue.Queue()
+        attempts = []
+
+        def launch(attempt):
+            attempts.append(attempt)
+
+            def target():
+                try:
+                    results.put((attempt, func(attempt), None))
+                except BaseException as e:
+                    results.put((attempt, None, e))
+
+            threading.Thread(target=target, name="llm-hedge", daemon=True).start()
+
+        start = time.perf_counter()
+        deadline = start + self.delay(mode)
+        can_hedge = self._admit()
+        fallbacks = list(self.models) or [model]
+        hedged = False
+        running = 0
+        errors = []
+        winner = None
+        launch(HedgeAttempt(model))
+        running += 1
+        try:
+            while True:
+                timeout = None
+                if can_hedge and not hedged and fallbacks:
+                    timeout = max(0.0, deadline - time.perf_counter())
+                try:
+                    attempt, result, error = results.get(timeout=timeout)
+                except queue.Empty:
+                    hedged = True
+                    launch(self._next_attempt(fallbacks, REASON_SLOW))
+                    running += 1
+                    continue
+                running -= 1
+                if error is None:
+                    winner = attempt
+                    self._finish(mode, start, winner, hedged)
+                    return result
+                errors.append(error)
+                if running == 0:
+                    if not fallbacks:
+                        raise errors[0]
+                    hedged = True
+                    launch(self._next_attempt(fallbacks, REASON_ERROR))
+                    running += 1
+        finally:
+            for attempt in attempts:
+                if attempt is not winner:
+                    attempt.cancel()
+
+    async def arun(self, func, model: str, mode: str):
+        """
+        run の非同期版（func はコルーチン関数。採用されなかった送信はタスクごと中止する）
+        """
+        if not self.enabled:
+            return await func(HedgeAttempt(model))
+        tasks = {}
+
+        def launch(attempt):
+            tasks[asyncio.ensure_future(func(attempt))] = attempt
+
+        start = time.perf_counter()
+        deadline = start + self.delay(mode)
+        can_hedge = self._admit()
+        fallbacks = list(self.models) or [model]
+        hedged = False
+        errors = []
+        winner = None
+        launch(HedgeAttempt(model))
+        try:
+            while True:
+                timeout = None
+                if can_hedge and not hedged and fallbacks:
+                    timeout = max(0.0, deadline - time.perf_counter())
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    launch(self._next_attempt(fallbacks, REASON_SLOW))
+                    continue
+                for task in done:
+                    attempt = tasks.pop(task)
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                    elif winner is None:
+                        winner = attempt
+                        result = task.result()
+                    else:
+                        attempt.cancel()
+                if winner is not None:
+                    self._finish(mode, start, winner, hedged)
+                    return result
+                if not tasks:
+                    if not fallbacks:
+                        raise errors[0]
+                    hedged = True
+                    launch(self._next_attempt(fallbacks, REASON_ERROR))
+        finally:
+            for task, attempt in tasks.items():
+                task.cancel()
+                attempt.cancel()
+
+
+_policy = None
+_lock = threading.Lock()
+
+
+def _build_from(config):
+    models = config.get('LLM_HEDGE_MODELS') or ()
+    if isinstance(models, str):
+        models = [m.strip() for m in models.split(',') if m.strip()]
+    return HedgePolicy(
+        enabled=str(config.get('LLM_HEDGE_ENABLED', 'false')).lower() in ('1', 'true', 'yes'),
+        percentile=float(config.get('LLM_HEDGE_PERCENTILE', 95)),
+        models=models,
+        max_rate=float(config.get('LLM_HEDGE_MAX_RATE', 0.1)),
+        min_delay=float(config.get('LLM_HEDGE_MIN_DELAY', 1.0)),
+        default_delay=float(config.get('LLM_HEDGE_DEFAULT_DELAY', 10.0)),
+    )
+
+
+def init_app(app):
+    global _policy
+    with _lock:
+        if _policy is None:
+            _policy = _build_from(app.config)
+        app.extensions['llm_hedge'] = _policy
+    return _policy
+
+
+def get_hedge_policy():
+    """
+    プロセス共通のヘッジ設定を返す。create_app を経由しない実行では環境変数から構成する
+    """
+    global _policy
+    if _policy is None:
+        with _lock:
+            if _policy is None:
+                _policy = _build_from(os.environ)
+    return _policy
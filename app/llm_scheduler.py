@@ -0,0 +1,288 @@
+"""
+OpenAI呼び出しのプロセス共通スケジューラー
+
+- RPM/TPMのトークンバケットで送信量を平準化（トークン数はプロンプトの計測値 + max_tokens）
+- 待機中は対話（画面からの生成）をバッチより優先
+- 429・接続エラー・5xxはジッター付き指数バックオフで再試行（429発生時は全体を一時停止）
+- 同一内容の同時リクエストは1回の上流呼び出しにまとめる
+"""
+import os
+import copy
+import asyncio
+import json
+import time
+import heapq
+import random
+import hashlib
+import logging
+import itertools
+import threading
+from concurrent.futures import Future
+import openai
+from app.metrics import metrics
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+_PRIORITY_LABELS = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BATCH: "batch"}
+
+logger = logging.getLogger(__name__)
+
+
+def request_key(params: dict) -> str:
+    """
+    同一リクエスト判定用のキー（モデル・メッセージ・温度・max_tokens）
+    """
+    keyed = {k: params.get(k) for k in ("model", "messages", "temperature", "max_tokens")}
+    return hashlib.sha256(json.dumps(keyed, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, burst: float = None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst or per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+
+class LLMScheduler:
+    RETRYABLE_ERRORS = (
+        openai.RateLimitError,
+        openai.APIConnectionError,
+        openai.APITimeoutError,
+        openai.InternalServerError,
+    )
+
+    def __init__(self, rpm=0, tpm=0, max_retries=5, backoff_base=1.0, backoff_max=30.0):
+        # 0以下は無制限
+        self._requests = TokenBucket(rpm) if rpm > 0 else None
+        self._tokens = TokenBucket(tpm) if tpm > 0 else None
+        self.tpm = max(tpm, 0)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._cond = threading.Condition()
+        self._waiting = []
+        # 非同期版の待機者（Ticket → (イベントループ, 再確認の合図)）。同期版と同じ列に並ぶ
+        self._async_waiters = {}
+        self._seq = itertools.count()
+        self._paused_until = 0.0
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+
+    def call(self, func, tokens=0, priority=PRIORITY_INTERACTIVE, key=None):
+        """
+        送信枠を確保して func() を実行し、再試行可能なエラーはバックオフして再実行する。
+        key を指定すると同じ key の実行中リクエストの結果を共有する
+        """
+        if key is not None:
+            return self.coalesce(key, lambda: self.call(func, tokens, priority))
+        for attempt in range(self.max_retries + 1):
+            self.acquire(tokens, priority)
+            try:
+                return func()
+            except self.RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self._retry_delay(attempt, e))
+
+    async def acall(self, func, tokens=0, priority=PRIORITY_INTERACTIVE):
+        """
+        call の非同期版（func はコルーチン関数）。送信枠の待機はスレッドを使わずイベントループ上で行う
+        """
+        for attempt in range(self.max_retries + 1):
+            if self._requests is not None or self._tokens is not None or self._paused_until > time.monotonic():
+                await self.aacquire(tokens, priority)
+            try:
+                return await func()
+            except self.RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(self._retry_delay(attempt, e))
+
+    def acquire(self, tokens=0, priority=PRIORITY_INTERACTIVE):
+        """
+        優先度順に並び、RPM/TPMの枠が空くまで待機する
+        """
+        start = time.monotonic()
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    timeout = None
+                    if self._waiting[0] == ticket:
+                        now = time.monotonic()
+                        timeout = max(self._paused_until - now, self._wait_time(tokens, now))
+                        if timeout <= 0:
+                            self._take(tokens)
+                            break
+                    self._cond.wait(timeout)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._notify()
+        metrics.observe(
+            "llm_scheduler_wait_seconds", time.monotonic() - start,
+            priority=_PRIORITY_LABELS.get(priority, str(priority)),
+        )
+
+    async def aacquire(self, tokens=0, priority=PRIORITY_INTERACTIVE):
+        """
+        acquire の非同期版。同期版の待機者と同じ優先度順の列に並び、枠が空くまでスレッドを使わずイベントループ上で待つ
+        """
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        start = time.monotonic()
+        with self._cond:
+            ticket = (priority, next(self._seq))
+            heapq.heappush(self._waiting, ticket)
+            self._async_waiters[ticket] = (loop, wakeup)
+        try:
+            while True:
+                with self._cond:
+                    timeout = None
+                    if self._waiting[0] == ticket:
+                        now = time.monotonic()
+                        timeout = max(self._paused_until - now, self._wait_time(tokens, now))
+                        if timeout <= 0:
+                            self._take(tokens)
+                            break
+                    wakeup.clear()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            with self._cond:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                del self._async_waiters[ticket]
+                self._notify()
+        metrics.observe(
+            "llm_scheduler_wait_seconds", time.monotonic() - start,
+            priority=_PRIORITY_LABELS.get(priority, str(priority)),
+        )
+
+    def _notify(self):
+        """
+        列の先頭が変わったことを同期版・非同期版の待機者に知らせる（self._cond を保持して呼ぶ）
+        """
+        self._cond.notify_all()
+        for loop, wakeup in self._async_waiters.values():
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                # イベントループが終了済み
+                pass
+
+    def coalesce(self, key, func):
+        """
+        同じ key の処理が実行中であれば完了を待って結果の複製を返し、なければ func() を実行する
+        """
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            metrics.inc("llm_coalesced_total")
+            return copy.deepcopy(future.result())
+        try:
+            result = func()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+    def _wait_time(self, tokens, now):
+        wait = 0.0
+        if self._requests is not None:
+            wait = max(wait, self._requests.wait_time(1, now))
+        if self._tokens is not None:
+            wait = max(wait, self._tokens.wait_time(tokens, now))
+        return wait
+
+    def _take(self, tokens):
+        if self._requests is not None:
+            self._requests.take(1)
+        if self._tokens is not None:
+            self._tokens.take(tokens)
+
+    def _retry_delay(self, attempt, error) -> float:
+        delay = self._backoff(attempt, error)
+        metrics.inc("llm_retries_total", reason=type(error).__name__)
+        logger.info("LLM呼び出しを%.1f秒後に再試行します（%s）", delay, type(error).__name__)
+        return delay
+
+    def _backoff(self, attempt, error) -> float:
+        # フルジッター: 0〜base*2^attempt の一様乱数（Retry-After があればそれ以上待つ）
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        if isinstance(error, openai.RateLimitError):
+            # クォータ超過は全リクエスト共通のため、待機中の他のリクエストも止める
+            with self._cond:
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        return delay
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+_scheduler = None
+_lock = threading.Lock()
+
+
+def _build_from(config):
+    return LLMScheduler(
+        rpm=int(config.get('LLM_RPM', 0)),
+        tpm=int(config.get('LLM_TPM', 0)),
+        max_retries=int(config.get('LLM_MAX_RETRIES', 5)),
+        backoff_base=float(config.get('LLM_BACKOFF_BASE', 1.0)),
+        backoff_max=float(config.get('LLM_BACKOFF_MAX', 30.0)),
+    )
+
+
+def init_app(app):
+    global _scheduler
+    with _lock:
+        if _scheduler is None:
+            _scheduler = _build_from(app.config)
+        app.extensions['llm_scheduler'] = _scheduler
+    return _scheduler
+
+
+def get_llm_scheduler():
+    """
+    プロセス共通のスケジューラーを返す。create_app を経由しない実行では環境変数から構成する
+    """
+    global _scheduler
+    if _scheduler is None:
+        with _lock:
+            if _scheduler is None:
+                _scheduler = _build_from(os.environ)
+    return _scheduler
@@ -1,16 +1,43 @@
+import io
 import os
+import mimetypes
+import re
+import json
 import uuid
+import threading
 from pathlib import Path
-from flask import Blueprint, render_template, request, jsonify, send_from_directory, current_app
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, Response, render_template, request, jsonify, send_file, send_from_directory, current_app
 from flask_cors import CORS
 from dotenv import load_dotenv
-from app.slide_generator import generate_slide_structure
-from app.pptx_creator import create_presentation
+from app.slide_generator import SlideGenerator, generate_slide_structure
+from app.structure_cache import get_structure_cache
+from app.pptx_creator import PPTXCreator, render_presentation_bytes
+from app.jobs import get_job_queue, FINISHED_STAGES, STAGE_LLM, STAGE_RENDERING, STAGE_DONE, STAGE_FAILED
+from app.admission import get_admission, AdmissionRejected
+from app.memory_store import get_memory_store
+from app.decks import deck_filename, save_deck, load_deck
+from app.storage import get_deck_storage, content_etag
+from app.metrics import metrics
+from app.structure_schema import normalize_slide, normalize_structure, StructureParseError
+from app.preview import render_preview_html
+
+PPTX_MIMETYPE = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
+# 生成結果の受け取り方: file=ディスク保存 / memory=短時間メモリ保持 / inline=レスポンス本文で返却 /
+# preview=PPTXを作らずスライド構造のみ（/api/jobs/<job_id>/preview で確認）
+DELIVERY_MODES = ("file", "memory", "inline", "preview")
+
+DECK_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+# 開始前に中止したジョブのメッセージ（受け付け制御の中止理由ごと）
+CANCEL_MESSAGES = {
+    "disconnect": "接続が切れたため生成を中止しました。",
+    "idle": "接続が切れたため生成を中止しました。",
+    "timeout": "待ち時間が上限を超えたため生成を中止しました。",
+}
 
 # パス設定
 BASE_DIR = Path(__file__).parent.parent.resolve()
-DATA_DIR = BASE_DIR / "data" / "generated"
-DATA_DIR.mkdir(parents=True, exist_ok=True)
 
 main = Blueprint('main', __name__)
 CORS(main)
@@ -22,52 +49,472 @@ load_dotenv(os.path.join(BASE_DIR, 'config', '.env'))
 def index():
     return render_template('index.html')
 
+def run_generation_job(job_id: str, queue, content: str, use_cache: bool = True, memory_store=None, render=True):
+    """
+    ワーカースレッドで実行: スライド構造生成 → PowerPoint生成（render=Falseならプレビュー用の構造のみ）
+    """
+    queue.update(job_id, stage=STAGE_LLM, progress=10)
+    slide_structure = generate_slide_structure(
+        content,
+        on_slide=lambda slide: queue.add_slide(job_id, slide),
+        on_progress=llm_progress_callback(job_id, queue),
+        use_cache=use_cache,
+    )
+    if slide_structure.get("status") == "error":
+        queue.fail(job_id, slide_structure.get("message", "スライド構造の生成に失敗しました。"))
+        return
+    if not render:
+        finish_preview(job_id, queue, slide_structure)
+        return
+
+    queue.update(job_id, stage=STAGE_RENDERING, progress=85)
+    try:
+        pptx_bytes = render_presentation_bytes(slide_structure)
+    except Exception as e:
+        queue.fail(job_id, f"PPTX生成エラー: {str(e)}")
+        return
+    finish_deck(job_id, queue, pptx_bytes, slide_structure, memory_store)
+
+def run_admitted(job_id: str, admission, ticket, func, *args, **kwargs):
+    """
+    受け付け制御の枠を確保したジョブを実行し、終了後に枠を返す
+    """
+    try:
+        func(job_id, *args, **kwargs)
+    finally:
+        admission.release(ticket)
+
+def cancel_callback(job_id: str, queue):
+    def on_cancel(reason):
+        queue.update(job_id, stage=STAGE_FAILED, message=CANCEL_MESSAGES.get(reason, "生成を中止しました。"))
+    return on_cancel
+
+def client_key(config, headers, remote_addr) -> str:
+    """
+    公平な割り当てに使うクライアントの識別子（GENERATE_CLIENT_HEADER を設定すればそのヘッダーの先頭の値）
+    """
+    header = config.get('GENERATE_CLIENT_HEADER')
+    value = headers.get(header.lower()) if header else None
+    if value:
+        return value.split(',')[0].strip()
+    return remote_addr or "unknown"
+
+def rejected_payload(error: AdmissionRejected) -> dict:
+    return {"status": "error", "message": str(error), "retry_after": error.retry_after}
+
+def llm_progress_callback(job_id: str, queue):
+    def on_progress(received_tokens, max_tokens):
+        # LLM段階は進捗10%〜80%に割り当て（受信トークン数 / max_tokens）
+        progress = 10 + int(70 * min(received_tokens / max_tokens, 1.0))
+        if progress > queue.get(job_id)["progress"]:
+            queue.update(job_id, progress=progress)
+    return on_progress
+
+def finish_deck(job_id: str, queue, pptx_bytes: bytes, slide_structure: dict, memory_store=None):
+    # デッキIDはUUIDで一意化
+    deck_id = uuid.uuid4().hex
+    try:
+        filename = save_deck(deck_id, pptx_bytes, slide_structure, memory_store)
+    except Exception as e:
+        queue.fail(job_id, f"ファイル保存エラー: {str(e)}")
+        return
+    queue.update(
+        job_id,
+        stage=STAGE_DONE,
+        progress=100,
+        deck_id=deck_id,
+        filename=filename,
+        download_url=f"/api/download/{filename}",
+    )
+
+def finish_preview(job_id: str, queue, slide_structure: dict):
+    """
+    PPTXを描画せずに完了させる。同じ内容で再度生成すると構造キャッシュからPPTXだけを作成できる
+    """
+    queue.update(
+        job_id,
+        stage=STAGE_DONE,
+        progress=100,
+        structure=slide_structure,
+        preview_url=f"/api/jobs/{job_id}/preview",
+    )
+
+def apply_slide_patches(structure: dict, patches: list, generator=None) -> tuple:
+    """
+    スライド単位のパッチを適用した新しい構造と、変更されたスライドのインデックスを返す
+
+    パッチ: {"slide_number": N, "title"/"type"/"content": 置き換える値} または
+           {"slide_number": N, "regenerate": true, "instruction": "修正指示"}
+    """
+    structure = json.loads(json.dumps(structure))
+    slides = structure.get("slides", [])
+    changed = []
+    regenerate = []
+    for patch in patches:
+        index = int(patch.get("slide_number", 0)) - 1
+        if not 0 <= index < len(slides):
+            raise ValueError(f"スライド{index + 1}は存在しません。")
+        if patch.get("regenerate"):
+            regenerate.append((index, patch.get("instruction", "")))
+        else:
+            for key in ("title", "type", "content"):
+                if key in patch:
+                    slides[index][key] = patch[key]
+            slides[index] = normalize_slide(slides[index], index + 1)
+        changed.append(index)
+
+    if regenerate:
+        generator = generator or SlideGenerator()
+        with ThreadPoolExecutor(max_workers=len(regenerate)) as executor:
+            results = list(executor.map(
+                lambda item: generator.regenerate_slide(structure, item[0], item[1]), regenerate
+            ))
+        for (index, _), result in zip(regenerate, results):
+            if result.get("status") == "error":
+                raise RuntimeError(result.get("message", "スライドの再生成に失敗しました。"))
+            slides[index] = result
+    return structure, sorted(set(changed))
+
+def run_patch_job(job_id: str, queue, deck_id: str, patches: list, memory_store=None):
+    """
+    ワーカースレッドで実行: 変更対象スライドのみ再生成 → 前回のPPTXを元に該当スライドだけ描き直し
+    """
+    deck = load_deck(deck_id, memory_store)
+    if deck is None:
+        queue.fail(job_id, "デッキが存在しません。")
+        return
+    previous_bytes, structure = deck
+
+    queue.update(job_id, stage=STAGE_LLM, progress=10)
+    try:
+        new_structure, changed = apply_slide_patches(structure, patches)
+    except Exception as e:
+        queue.fail(job_id, str(e))
+        return
+
+    queue.update(job_id, stage=STAGE_RENDERING, progress=85)
+    try:
+        pptx_bytes = PPTXCreator().rerender_bytes(previous_bytes, new_structure, changed)
+    except Exception as e:
+        queue.fail(job_id, f"PPTX生成エラー: {str(e)}")
+        return
+    for index in changed:
+        queue.add_slide(job_id, new_structure["slides"][index])
+    finish_deck(job_id, queue, pptx_bytes, new_structure, memory_store)
+
+def parse_generate_request(data) -> tuple:
+    """
+    生成リクエストを検証して (content, use_cache, delivery) を返す。不正な場合は ValueError
+    """
+    content = (data or {}).get('content', '').strip()
+    if not content:
+        raise ValueError("コンテンツが空です。")
+    # no_cache=true でキャッシュを参照せずに再生成
+    use_cache = not parse_flag(data.get('no_cache', False), 'no_cache')
+    delivery = data.get('delivery', 'file')
+    if delivery not in DELIVERY_MODES:
+        raise ValueError(f"deliveryは{', '.join(DELIVERY_MODES)}のいずれかを指定してください。")
+    return content, use_cache, delivery
+
+def parse_flag(value, name: str) -> bool:
+    """
+    真偽値のパラメータを解釈する（true/false と文字列の "true"/"false"/"1"/"0" のみ）。不正な場合は ValueError
+    """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ("true", "1", "false", "0"):
+        return value.strip().lower() in ("true", "1")
+    raise ValueError(f"{name}にはtrueまたはfalseを指定してください。")
+
+def accepted_payload(job_id: str) -> dict:
+    status_url = f"/api/jobs/{job_id}"
+    return {
+        "status": "accepted",
+        "job_id": job_id,
+        "status_url": status_url,
+        "events_url": f"{status_url}/events",
+        "preview_url": f"{status_url}/preview"
+    }
+
 @main.route('/api/generate', methods=['POST'])
 def generate_slide():
     try:
+        try:
+            content, use_cache, delivery = parse_generate_request(request.get_json())
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        admission = get_admission(current_app)
+        client = client_key(current_app.config, request.headers, request.remote_addr)
+        if delivery == 'inline':
+            return _generate_inline(admission, client, content, use_cache)
+
+        # ジョブを登録して即時に応答（実行枠が空き次第ワーカープールで実行）
+        queue = get_job_queue(current_app)
+        memory_store = get_memory_store(current_app) if delivery == 'memory' else None
+        job_id = queue.create()
+        try:
+            admission.submit(
+                client,
+                lambda ticket: queue.start(
+                    job_id, run_admitted, admission, ticket,
+                    run_generation_job, queue, content, use_cache, memory_store, render=delivery != 'preview',
+                ),
+                on_cancel=cancel_callback(job_id, queue),
+                job_id=job_id,
+            )
+        except AdmissionRejected:
+            queue.discard(job_id)
+            raise
+        return _accepted(job_id)
+    except AdmissionRejected as e:
+        return _rejected(e)
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+def _rejected(error: AdmissionRejected):
+    response = jsonify(rejected_payload(error))
+    response.status_code = error.status
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def _accepted(job_id: str):
+    payload = accepted_payload(job_id)
+    response = jsonify(payload)
+    response.status_code = 202
+    response.headers['Location'] = payload["status_url"]
+    return response
+
+@main.route('/api/decks/<deck_id>', methods=['PATCH'])
+def patch_deck(deck_id):
+    """
+    保存済みデッキの一部スライドだけを差し替え・再生成したデッキを新しいジョブとして作成する
+    """
+    try:
+        if not DECK_ID_PATTERN.fullmatch(deck_id):
+            return jsonify({"status": "error", "message": "デッキIDが不正です。"}), 400
         data = request.get_json()
-        content = data.get('content', '').strip()
-        if not content:
-            return jsonify({"status": "error", "message": "コンテンツが空です。"}), 400
-
-        # スライド構造生成
-        slide_structure = generate_slide_structure(content)
-        print(slide_structure)
-        # ファイル名生成（UUIDで一意化）
-        filename = f"presentation_{uuid.uuid4().hex}.pptx"
-        output_path = DATA_DIR / filename
-
-        # PowerPointファイル生成
-        create_presentation(slide_structure, str(output_path))
-
-        download_url = f"/api/download/{filename}"
-        return jsonify({
-            "status": "success",
-            "filename": filename,
-            "download_url": download_url
-        })
+        patches = data.get('patches', [])
+        if not patches:
+            return jsonify({"status": "error", "message": "パッチが空です。"}), 400
+        memory_store = get_memory_store(current_app)
+        if load_deck(deck_id, memory_store) is None:
+            return jsonify({"status": "error", "message": "デッキが存在しません。"}), 404
+        # 元のデッキと同じ保存先（メモリ保持中ならメモリ）に結果を保存
+        in_memory = memory_store.get(deck_filename(deck_id)) is not None
+        # 新規生成と同じ受け付け制御を通す（同時実行数・キュー長・クライアントごとの上限）
+        admission = get_admission(current_app)
+        client = client_key(current_app.config, request.headers, request.remote_addr)
+        queue = get_job_queue(current_app)
+        job_id = queue.create()
+        try:
+            admission.submit(
+                client,
+                lambda ticket: queue.start(
+                    job_id, run_admitted, admission, ticket,
+                    run_patch_job, queue, deck_id, patches, memory_store if in_memory else None,
+                ),
+                on_cancel=cancel_callback(job_id, queue),
+                job_id=job_id,
+            )
+        except AdmissionRejected:
+            queue.discard(job_id)
+            raise
+        return _accepted(job_id)
+    except AdmissionRejected as e:
+        return _rejected(e)
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+def _generate_inline(admission, client: str, content: str, use_cache: bool):
+    """
+    生成したPPTXをディスクに書かずにレスポンス本文として返す（同期処理。実行枠が空くまで待つ）
+    """
+    ready = threading.Event()
+    ticket = admission.submit(client, lambda ticket: ready.set())
+    if not ready.wait(admission.max_wait) and admission.cancel(ticket, "timeout"):
+        return _rejected(AdmissionRejected(503, admission.retry_after(), CANCEL_MESSAGES["timeout"]))
+    try:
+        slide_structure = generate_slide_structure(content, use_cache=use_cache)
+        if slide_structure.get("status") == "error":
+            return jsonify(slide_structure), 500
+        pptx_bytes = render_presentation_bytes(slide_structure)
+    finally:
+        admission.release(ticket)
+    filename = f"presentation_{uuid.uuid4().hex}.pptx"
+    return send_file(
+        io.BytesIO(pptx_bytes),
+        mimetype=PPTX_MIMETYPE,
+        as_attachment=True,
+        download_name=filename
+    )
+
+@main.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = get_job_queue(current_app).get(job_id)
+    # ポーリングが続いている間は順番待ちのジョブを中止しない
+    get_admission(current_app).touch(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "ジョブが存在しません。"}), 404
+    return jsonify({"status": "success", **job})
+
+@main.route('/api/jobs/<job_id>/preview', methods=['GET'])
+def job_preview(job_id):
+    """
+    ジョブのスライドをHTML/SVGのプレビューとして返す（生成途中は確定済みのスライドのみ）
+    """
+    job = get_job_queue(current_app).get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "ジョブが存在しません。"}), 404
+    structure = job.get("structure") or {"slides": job["slides"]}
+    return _preview_response(structure)
+
+@main.route('/api/preview', methods=['POST'])
+def preview_structure():
+    """
+    リクエスト本文のスライド構造（{"title", "slides"}）をHTML/SVGのプレビューとして返す
+    """
+    try:
+        structure = normalize_structure(request.get_json(silent=True))
+    except StructureParseError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return _preview_response(structure)
+
+def _preview_response(structure: dict):
+    with metrics.span("preview"):
+        html = render_preview_html(structure)
+    response = Response(html, mimetype='text/html', headers={'Cache-Control': 'no-cache'})
+    # 内容が変わっていない再読み込みには 304 を返す
+    response.set_etag(content_etag(html.encode('utf-8')))
+    return response.make_conditional(request)
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@main.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """
+    Server-Sent Eventsでジョブの進捗と確定したスライドを逐次配信する
+    """
+    queue = get_job_queue(current_app)
+    admission = get_admission(current_app)
+    job = queue.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "ジョブが存在しません。"}), 404
+
+    def stream(job):
+        # 接続中は順番待ちのジョブを保持し、切断されたら（他に接続がなければ）開始前のジョブを中止する
+        admission.attach(job_id)
+        try:
+            yield from _job_stream(queue, job_id, job)
+        finally:
+            admission.detach(job_id)
+
+    return Response(
+        stream(job),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def _job_stream(queue, job_id: str, job: dict):
+    sent_slides = 0
+    last_stage = None
+    last_progress = None
+    while True:
+        if job is None:
+            yield _sse("failed", {"message": "ジョブが存在しません。"})
+            return
+        for slide in job["slides"][sent_slides:]:
+            yield _sse("slide", {"index": sent_slides, "slide": slide})
+            sent_slides += 1
+        if job["stage"] != last_stage or job["progress"] != last_progress:
+            last_stage, last_progress = job["stage"], job["progress"]
+            yield _sse("progress", {"stage": last_stage, "progress": last_progress})
+        if job["stage"] in FINISHED_STAGES:
+            job = {k: v for k, v in job.items() if k != "slides"}
+            yield _sse(job["stage"], job)
+            return
+        version = job["version"]
+        job = queue.wait_for_change(job_id, version)
+        if job is not None and job["version"] == version:
+            # 接続維持用のコメント行
+            yield ": keep-alive\n\n"
+
+@main.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    cache = get_structure_cache()
+    if cache is None:
+        return jsonify({"status": "success", "enabled": False})
+    return jsonify({"status": "success", "enabled": True, **cache.stats()})
+
+@main.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @main.route('/api/download/<path:filename>', methods=['GET'])
 def download_file(filename):
+    with metrics.span("download"):
+        return _download(filename)
+
+def _download(filename):
+    """
+    ETag（内容ハッシュ）・Last-Modified による条件付きGET（304）と Range（206）に対応して返す。
+    DOWNLOAD_OFFLOAD を指定した場合、ディスク上のデッキの送信はフロントのプロキシに任せる
+    """
     try:
+        # メモリ保持中のデッキを優先
+        entry = get_memory_store(current_app).entry(filename)
+        if entry is not None:
+            stored_at, data, etag = entry
+            return send_file(
+                io.BytesIO(data),
+                mimetype=PPTX_MIMETYPE,
+                as_attachment=True,
+                download_name=filename,
+                etag=etag,
+                last_modified=stored_at,
+            )
         # 日本語ファイル名対応
-        file_path = DATA_DIR / filename
-        if not file_path.exists():
+        storage = get_deck_storage()
+        file_path = storage.open_path(filename)
+        if file_path is None:
             return jsonify({"status": "error", "message": "ファイルが存在しません。"}), 404
+        etag = storage.etag(filename, file_path)
+        offload = current_app.config.get('DOWNLOAD_OFFLOAD', '')
+        if offload:
+            return _offload_download(offload, storage, file_path, filename, etag)
         return send_from_directory(
-            directory=str(DATA_DIR),
-            path=filename,
+            directory=str(file_path.parent),
+            path=file_path.name,
             as_attachment=True,
-            download_name=filename.encode('utf-8').decode('utf-8')
+            download_name=filename.encode('utf-8').decode('utf-8'),
+            etag=etag,
         )
     except Exception as e:
+        metrics.inc("errors_total", type="download")
         return jsonify({"status": "error", "message": str(e)}), 500
 
+def _offload_download(offload: str, storage, file_path: Path, filename: str, etag: str):
+    """
+    本文を返さず、X-Accel-Redirect / X-Sendfile ヘッダーでプロキシにファイルを送信させる（Range はプロキシが処理）
+    """
+    if offload == 'x-accel':
+        prefix = current_app.config.get('DOWNLOAD_ACCEL_PREFIX', '/protected-decks/').rstrip('/')
+        header, target = 'X-Accel-Redirect', f"{prefix}/{file_path.relative_to(storage.root).as_posix()}"
+    else:
+        header, target = 'X-Sendfile', str(file_path)
+    mimetype = PPTX_MIMETYPE if filename.endswith('.pptx') else mimetypes.guess_type(filename)[0]
+    response = Response(mimetype=mimetype or 'application/octet-stream')
+    response.headers.set('Content-Disposition', 'attachment', filename=filename)
+    response.set_etag(etag)
+    response.last_modified = file_path.stat().st_mtime
+    response.cache_control.no_cache = True
+    response = response.make_conditional(request)
+    if response.status_code != 304:
+        response.headers[header] = target
+    return response
+
 # 追加: アプリケーションの起動部分
 if __name__ == '__main__':
-    from flask import Flask
-    app = Flask(__name__, template_folder='../templates', static_folder='../static')
-    app.register_blueprint(main)
-    app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
+    from app import create_app
+    app = create_app()
+    app.run(debug=True, host='0.0.0.0', port=5000)
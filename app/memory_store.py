@@ -0,0 +1,76 @@
+import time
+import threading
+from collections import OrderedDict
+from app.storage import content_etag
+
+
+class InMemoryDeckStore:
+    """
+    生成済みPPTXを短時間だけメモリに保持するストア（TTLと合計サイズ上限、超過時は古い順に破棄）
+    """
+
+    def __init__(self, ttl=600, max_bytes=256 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._decks = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def fits(self, size: int) -> bool:
+        return size <= self.max_bytes
+
+    def put(self, filename: str, data: bytes) -> bool:
+        """
+        保存できたかを返す（単体で合計サイズ上限を超えるデータは保存しない）
+        """
+        if not self.fits(len(data)):
+            return False
+        with self._lock:
+            self._discard(filename)
+            self._decks[filename] = (time.time(), data, content_etag(data))
+            self._total_bytes += len(data)
+            self._expire()
+            while self._total_bytes > self.max_bytes and self._decks:
+                self._discard(next(iter(self._decks)))
+        return True
+
+    def get(self, filename: str):
+        entry = self.entry(filename)
+        return entry[1] if entry else None
+
+    def entry(self, filename: str):
+        """
+        (保存時刻, データ, ETag) を返す（存在しない・期限切れなら None）
+        """
+        with self._lock:
+            self._expire()
+            return self._decks.get(filename)
+
+    def __contains__(self, filename):
+        return self.get(filename) is not None
+
+    def _discard(self, filename):
+        entry = self._decks.pop(filename, None)
+        if entry:
+            self._total_bytes -= len(entry[1])
+
+    def _expire(self):
+        deadline = time.time() - self.ttl
+        while self._decks:
+            filename, (stored_at, *_) = next(iter(self._decks.items()))
+            if stored_at >= deadline:
+                break
+            self._discard(filename)
+
+
+def init_app(app):
+    store = InMemoryDeckStore(
+        ttl=app.config.get('MEMORY_STORE_TTL', 600),
+        max_bytes=app.config.get('MEMORY_STORE_MAX_BYTES', 256 * 1024 * 1024),
+    )
+    app.extensions['deck_memory_store'] = store
+    return store
+
+
+def get_memory_store(app):
+    return app.extensions['deck_memory_store']
@@ -0,0 +1,150 @@
+"""
+処理段階ごとの計測値（カウンター・ヒストグラム）を保持し、Prometheusテキスト形式で出力する
+"""
+import time
+import threading
+from contextlib import contextmanager
+from app.structure_cache import get_structure_cache
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: tuple, extra=()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def inc(self, name: str, value=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    hist["buckets"][i] += 1
+            hist["sum"] += value
+            hist["count"] += 1
+
+    @contextmanager
+    def span(self, stage: str, **labels):
+        """
+        with ブロックの所要時間を slide_stage_seconds{stage=...} に記録
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("slide_stage_seconds", time.perf_counter() - start, stage=stage, **labels)
+
+    def register_collector(self, collector):
+        """
+        出力時に呼び出され (名前, 種別, {ラベル: 値}) のリストを返す関数を登録（キャッシュ統計など）
+        """
+        self._collectors.append(collector)
+
+    def counter_value(self, name: str, **labels):
+        with self._lock:
+            return self._counters.get(name, {}).get(_label_key(labels), 0)
+
+    def histogram_count(self, name: str, **labels):
+        with self._lock:
+            hist = self._histograms.get(name, {}).get(_label_key(labels))
+            return hist["count"] if hist else 0
+
+    def render_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {
+                name: {key: {"buckets": list(h["buckets"]), "sum": h["sum"], "count": h["count"]} for key, h in series.items()}
+                for name, series in self._histograms.items()
+            }
+        for name, series in sorted(counters.items()):
+            self._header(lines, name, "counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        for name, series in sorted(histograms.items()):
+            self._header(lines, name, "histogram")
+            for key, hist in sorted(series.items()):
+                for bound, count in zip(self.buckets, hist["buckets"]):
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', str(bound))])} {count}")
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {hist['count']}")
+                lines.append(f"{name}_sum{_format_labels(key)} {hist['sum']}")
+                lines.append(f"{name}_count{_format_labels(key)} {hist['count']}")
+        for collector in self._collectors:
+            for name, kind, series in collector():
+                self._header(lines, name, kind)
+                for labels, value in series.items():
+                    lines.append(f"{name}{_format_labels(_label_key(dict(labels)))} {value}")
+        return "\n".join(lines) + "\n"
+
+    def _header(self, lines, name, kind):
+        if name in self._help:
+            lines.append(f"# HELP {name} {self._help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+
+# プロセス共通のレジストリ
+metrics = Metrics()
+metrics.describe("slide_stage_seconds", "Duration of each generation stage in seconds")
+metrics.describe("llm_time_to_first_token_seconds", "Time until the first streamed token from the LLM")
+metrics.describe("llm_request_seconds", "Total LLM completion latency in seconds")
+metrics.describe("llm_tokens_total", "LLM tokens used (streamed completions are counted per chunk)")
+metrics.describe("errors_total", "Errors by type")
+metrics.describe("structure_cache_hits_total", "Structure cache hits by tier")
+
+
+def _structure_cache_collector():
+    cache = get_structure_cache()
+    if cache is None:
+        return []
+    stats = cache.stats()
+    return [
+        ("structure_cache_hits_total", "counter", {
+            (("tier", "memory"),): stats["memory_hits"],
+            (("tier", "disk"),): stats["disk_hits"],
+        }),
+        ("structure_cache_misses_total", "counter", {(): stats["misses"]}),
+        ("structure_cache_evictions_total", "counter", {(): stats["evictions"]}),
+        ("structure_cache_entries", "gauge", {
+            (("tier", "memory"),): stats["memory_entries"],
+            (("tier", "disk"),): stats["disk_entries"],
+        }),
+    ]
+
+
+def init_app(app):
+    if _structure_cache_collector not in metrics._collectors:
+        metrics.register_collector(_structure_cache_collector)
+    app.extensions['metrics'] = metrics
+    return metrics
@@ -1,12 +1,33 @@
 from pathlib import Path
+import io
 import os
+import copy
+import threading
 from datetime import datetime
 from pptx import Presentation
 from pptx.util import Cm, Pt
-from pptx.enum.text import PP_ALIGN
+from pptx.chart.data import CategoryChartData
 from pptx.dml.color import RGBColor
+from pptx.enum.chart import XL_CHART_TYPE, XL_LABEL_POSITION
 from pptx.enum.shapes import MSO_SHAPE
-import tempfile
+from pptx.oxml import parse_xml
+from pptx.oxml.ns import nsdecls
+from app.metrics import metrics
+from app.data_render import (
+    CHART_MIN_POINTS, KIND_CHART, KIND_TABLE, chart_number_format, continuation_slide, plan_data,
+)
+from app.pptx_styles import TextStyle, apply_styles
+from app.storage import get_deck_storage
+
+class _CachedChartData(CategoryChartData):
+    """
+    埋め込みブックを生成しないグラフデータ（表示はグラフXML内のキャッシュ値で行われる）
+    """
+
+    @property
+    def xlsx_blob(self):
+        return b""
+
 
 class PPTXCreator:
     # BCGカラーパレット
@@ -24,12 +45,48 @@ class PPTXCreator:
     FONT_BODY = ("游ゴシック", 18, False)
     FONT_CAPTION = ("游ゴシック", 14, False)
 
+    # スライド種別ごとのヘッダーライン色
+    HEADER_COLORS = {
+        "content_slide": BCG_BLUE,
+        "financial_slide": ACCENT_ORANGE,
+        "implementation_slide": SECONDARY_BLUE,
+        "chart_slide": BCG_BLUE,
+    }
+    # テキストスタイル（フォント階層と色をrPr断片に事前コンパイル）
+    STYLE_TITLE = TextStyle(FONT_TITLE, color=WHITE, align="center")
+    STYLE_SUBTITLE = TextStyle(FONT_SUBTITLE, color=WHITE, align="center")
+    STYLE_HEADER = TextStyle(FONT_HEADER, color=DARK_GRAY)
+    STYLE_BODY = TextStyle(FONT_BODY, color=DARK_GRAY)
+    STYLE_BULLET = TextStyle(FONT_BODY, color=DARK_GRAY, align="left")
+    STYLE_ACTION = TextStyle(FONT_BODY, color=ACCENT_ORANGE)
+    STYLE_BOX = TextStyle(FONT_BODY)
+    STYLE_BOX_EMPHASIS = TextStyle(FONT_BODY, bold=True)
+    STYLE_CAPTION = TextStyle(FONT_CAPTION, color=DARK_GRAY)
+    STYLE_METRIC = TextStyle(FONT_CAPTION)
+    # 表のセル（色は表スタイルに従う: 見出し行は白、本文は黒）
+    STYLE_TABLE = TextStyle(FONT_CAPTION)
+
+    SLIDE_TYPES = ("title_slide", "content_slide", "financial_slide", "implementation_slide", "chart_slide")
+
+    # data の描画方法（スライド種別ごと）: (従来の図形で描く上限件数, 表1枚あたりの行数, グラフにする最少件数)
+    # 上限を超えるとグラフまたは表にし、表が1枚に収まらなければスライドを分割する。
+    # グラフは埋め込みブックの分ファイルが大きくなるため、数値を見せるスライドに限る（None: 常に表）
+    DATA_LAYOUTS = {
+        "content_slide": (5, 12, None),
+        "financial_slide": (4, 12, CHART_MIN_POINTS),
+        "chart_slide": (0, 12, 2),
+    }
+    TABLE_ROW_HEIGHT = 0.8
+    # グラフの埋め込みブック（PowerPointの「データの編集」用、1グラフ約5KB・生成に約5ms）を作るか。
+    # 表示はグラフXML内のキャッシュ値で行われるため、既定では作らずにファイルを小さく・描画を速くする
+    EMBED_CHART_WORKBOOK = False
+
     def __init__(self, output_dir=None):
-        if output_dir is None:
-            self.output_dir = Path("data") / "generated"
-        else:
-            self.output_dir = Path(output_dir)
-        self.output_dir.mkdir(parents=True, exist_ok=True)
+        # 出力先未指定の場合は共通の保存領域（STORAGE_ROOT）に保存。保存領域はファイルに書き出すときに初めて取得する
+        # （メモリ上の描画やバッチのレンダリングプロセスでは保存領域を作らない）
+        self.output_dir = Path(output_dir) if output_dir is not None else None
+        if self.output_dir is not None:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
         self.fonts = ["游ゴシック", "Yu Gothic", "メイリオ", "Meiryo", "sans-serif"]
         self.slide_width = Cm(33.867)
         self.slide_height = Cm(19.05)
@@ -38,118 +95,180 @@ class PPTXCreator:
         """
         スライド構造からPowerPointファイルを生成し、パスを返す
         """
-        prs = Presentation()
-        prs.slide_width = self.slide_width
-        prs.slide_height = self.slide_height
         try:
-            slides = structure.get("slides", [])
-            for slide in slides:
-                stype = slide.get("type", "content_slide")
-                if stype == "title_slide":
-                    self._add_title_slide(prs, slide, structure.get("title", ""))
-                elif stype == "content_slide":
-                    self._add_content_slide(prs, slide)
-                elif stype == "financial_slide":
-                    self._add_financial_slide(prs, slide)
-                elif stype == "implementation_slide":
-                    self._add_implementation_slide(prs, slide)
-                else:
-                    self._add_content_slide(prs, slide)
-            now = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"presentation_{now}.pptx"
-            output_path = self.output_dir / filename
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pptx") as tmp:
-                tmp_path = Path(tmp.name)
-                try:
-                    prs.save(str(tmp_path))
-                    tmp.close()
-                    tmp_path.replace(output_path)
-                except Exception as e:
-                    return f"ファイル保存エラー: {str(e)}"
-                finally:
-                    if tmp_path.exists():
-                        try:
-                            tmp_path.unlink()
-                        except Exception:
-                            pass
-            return str(output_path)
+            data = self.render_bytes(structure)
         except Exception as e:
             return f"PPTX生成エラー: {str(e)}"
+        now = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"presentation_{now}.pptx"
+        try:
+            if self.output_dir is None:
+                output_path = get_deck_storage().write(filename, data)
+            else:
+                output_path = self.output_dir / filename
+                output_path.write_bytes(data)
+        except Exception as e:
+            return f"ファイル保存エラー: {str(e)}"
+        return str(output_path)
 
-    def _set_font(self, shape, size=18, bold=False, color=None):
-        for p in shape.text_frame.paragraphs:
-            for run in p.runs:
-                run.font.size = Pt(size)
-                run.font.bold = bold
-                run.font.name = self.fonts[0]
-                if color:
-                    run.font.color.rgb = color
+    def render_bytes(self, structure: dict) -> bytes:
+        """
+        スライド構造からPowerPointファイルをメモリ上に生成し、バイト列を返す
+        """
+        buffer = io.BytesIO()
+        prs = self.build_presentation(structure)
+        with metrics.span("pptx_serialize"):
+            prs.save(buffer)
+        return buffer.getvalue()
 
-    def _add_title_slide(self, prs, slide, pres_title):
-        layout = prs.slide_layouts[6]  # 空白
-        s = prs.slides.add_slide(layout)
-        # 背景グラデーション
+    def build_presentation(self, structure: dict):
+        # 構成済みスケルトンを複製（テンプレート解析・レイアウト準備を毎回行わない）
+        prs = self._prepare(PresentationSkeleton.get(self).new_presentation())
+        slides = structure.get("slides", [])
+        for slide in slides:
+            self._render_slide(prs, slide, structure.get("title", ""))
+        return prs
+
+    def rerender_bytes(self, previous: bytes, structure: dict, indices) -> bytes:
+        """
+        前回生成したPPTXを読み込み、indicesで指定したスライドだけを描き直して返す（他のスライドはそのまま再利用）
+        """
+        prs = self._prepare(Presentation(io.BytesIO(previous)))
+        sld_id_lst = prs.slides._sldIdLst
+        if len(sld_id_lst) != len(structure["slides"]) or any(
+            self.page_count(slide) != 1 for slide in structure["slides"]
+        ):
+            # 複数スライドに分割されたスライドがあると位置が対応しないため全体を描き直す
+            return self.render_bytes(structure)
+        for index in sorted(set(indices)):
+            if not 0 <= index < len(sld_id_lst):
+                raise IndexError(f"スライド{index + 1}は存在しません。")
+            self._render_slide(prs, structure["slides"][index], structure.get("title", ""))
+            # 末尾に追加した新スライドを元の位置へ移動し、旧スライドを除去
+            new_id = sld_id_lst[-1]
+            old_id = sld_id_lst[index]
+            sld_id_lst.remove(new_id)
+            old_id.addprevious(new_id)
+            sld_id_lst.remove(old_id)
+            prs.part.drop_rel(old_id.rId)
+            prs.part.rename_slide_parts([sld_id.rId for sld_id in sld_id_lst])
+        buffer = io.BytesIO()
+        prs.save(buffer)
+        return buffer.getvalue()
+
+    def _prepare(self, prs):
+        self._skeleton = PresentationSkeleton.get(self)
+        self._layout = next(
+            (layout for layout in prs.slide_layouts if layout.name == "Blank"),
+            prs.slide_layouts[0],
+        )
+        return prs
+
+    def _render_slide(self, prs, slide, pres_title):
+        stype = slide.get("type", "content_slide")
+        with metrics.span("render", slide_type=stype if stype in self.SLIDE_TYPES else "other"):
+            if stype == "title_slide":
+                self._add_title_slide(prs, slide, pres_title)
+                return
+            if stype == "implementation_slide":
+                self._add_implementation_slide(prs, slide)
+                return
+            # data の件数によっては表を複数スライドに分割
+            blocks = self.plan_slide_data(slide) or [None]
+            for page, block in enumerate(blocks):
+                page_slide = continuation_slide(slide, page, len(blocks))
+                if stype == "financial_slide":
+                    self._add_financial_slide(prs, page_slide, block)
+                elif stype == "chart_slide":
+                    self._add_chart_slide(prs, page_slide, block)
+                else:
+                    self._add_content_slide(prs, page_slide, block)
+
+    @classmethod
+    def plan_slide_data(cls, slide) -> list:
+        """
+        スライドの data をスライド1枚ごとの DataBlock に分ける（data を描かない種別・data なしは空リスト）
+        """
+        stype = slide.get("type", "content_slide")
+        if stype in ("title_slide", "implementation_slide"):
+            return []
+        box_limit, rows, min_chart_points = cls.DATA_LAYOUTS.get(stype, cls.DATA_LAYOUTS["content_slide"])
+        return plan_data(slide.get("content", {}).get("data", {}), box_limit, rows, min_chart_points)
+
+    @classmethod
+    def page_count(cls, slide) -> int:
+        return max(1, len(cls.plan_slide_data(slide)))
+
+    def _new_slide(self, prs, stype):
+        s = prs.slides.add_slide(self._layout)
+        self._skeleton.decorate(s, stype)
+        return s
+
+    def _decorate(self, s, stype):
+        """
+        スライド種別ごとの背景と装飾図形（スケルトン構築時に1度だけ実行）
+        """
         fill = s.background.fill
-        fill.gradient()
-        fill.gradient_stops[0].color.rgb = self.BCG_BLUE
-        fill.gradient_stops[1].color.rgb = self.SECONDARY_BLUE
+        if stype == "title_slide":
+            fill.gradient()
+            fill.gradient_stops[0].color.rgb = self.BCG_BLUE
+            fill.gradient_stops[1].color.rgb = self.SECONDARY_BLUE
+            line = s.shapes.add_shape(MSO_SHAPE.RECTANGLE, Cm(2), Cm(17), Cm(10), Cm(0.5))
+            line.fill.solid()
+            line.fill.fore_color.rgb = self.BCG_BLUE
+            line.line.color.rgb = self.BCG_BLUE
+            line.shadow.inherit = False
+            return
+        fill.solid()
+        fill.fore_color.rgb = self.WHITE
+        color = self.HEADER_COLORS.get(stype, self.BCG_BLUE)
+        header = s.shapes.add_shape(MSO_SHAPE.RECTANGLE, Cm(0), Cm(0), self.slide_width, Cm(0.5))
+        header.fill.solid()
+        header.fill.fore_color.rgb = color
+        header.line.color.rgb = color
+
+    def _add_title_slide(self, prs, slide, pres_title):
+        # 背景グラデーション・左下ライン装飾はスケルトンから複製
+        s = self._new_slide(prs, "title_slide")
         # タイトル
         title = slide.get("title", pres_title)
         title_shape = s.shapes.add_textbox(Cm(2), Cm(6), Cm(30), Cm(4))
         title_shape.text = title
-        self._set_font(title_shape, size=self.FONT_TITLE[1], bold=self.FONT_TITLE[2], color=self.WHITE)
-        for p in title_shape.text_frame.paragraphs:
-            p.alignment = PP_ALIGN.CENTER
+        styles = [(title_shape, self.STYLE_TITLE)]
         # サブタイトル
         subtitle = slide["content"].get("main_message", "")
         if subtitle:
             sub_shape = s.shapes.add_textbox(Cm(2), Cm(10), Cm(30), Cm(2.5))
             sub_shape.text = subtitle
-            self._set_font(sub_shape, size=self.FONT_SUBTITLE[1], color=self.WHITE)
-            for p in sub_shape.text_frame.paragraphs:
-                p.alignment = PP_ALIGN.CENTER
-        # 左下ライン装飾
-        line = s.shapes.add_shape(MSO_SHAPE.RECTANGLE, Cm(2), Cm(17), Cm(10), Cm(0.5))
-        line.fill.solid()
-        line.fill.fore_color.rgb = self.BCG_BLUE
-        line.line.color.rgb = self.BCG_BLUE
-        line.shadow.inherit = False
-
-    def _add_content_slide(self, prs, slide):
-        layout = prs.slide_layouts[6]
-        s = prs.slides.add_slide(layout)
-        # 背景色
-        fill = s.background.fill
-        fill.solid()
-        fill.fore_color.rgb = self.WHITE
-        # ヘッダーライン
-        header = s.shapes.add_shape(MSO_SHAPE.RECTANGLE, Cm(0), Cm(0), self.slide_width, Cm(0.5))
-        header.fill.solid()
-        header.fill.fore_color.rgb = self.BCG_BLUE
-        header.line.color.rgb = self.BCG_BLUE
+            styles.append((sub_shape, self.STYLE_SUBTITLE))
+        apply_styles(styles)
+
+    def _add_content_slide(self, prs, slide, block=None):
+        # 背景色・ヘッダーラインはスケルトンから複製
+        s = self._new_slide(prs, "content_slide")
         # タイトル
         title = slide.get("title", "")
         title_shape = s.shapes.add_textbox(Cm(2), Cm(1), Cm(29), Cm(2.5))
         title_shape.text = title
-        self._set_font(title_shape, size=self.FONT_HEADER[1], bold=self.FONT_HEADER[2], color=self.DARK_GRAY)
+        styles = [(title_shape, self.STYLE_HEADER)]
         # 本文（メインメッセージ）
         main_msg = slide["content"].get("main_message", "")
         msg_shape = s.shapes.add_textbox(Cm(2), Cm(4), Cm(20), Cm(3))
         msg_shape.text = main_msg
-        self._set_font(msg_shape, size=self.FONT_BODY[1], color=self.DARK_GRAY)
+        styles.append((msg_shape, self.STYLE_BODY))
         # 箇条書き
         points = slide["content"].get("supporting_points", [])[:5]
         y = 7
         for pt in points:
             box = s.shapes.add_textbox(Cm(3), Cm(y), Cm(25), Cm(1.5))
             box.text = pt
-            self._set_font(box, size=self.FONT_BODY[1], color=self.DARK_GRAY)
-            for p in box.text_frame.paragraphs:
-                p.alignment = PP_ALIGN.LEFT
+            styles.append((box, self.STYLE_BULLET))
             y += 2
-        # 右側メトリクス
+        # 右側メトリクス（件数が多い場合は表・グラフ）
         data = slide["content"].get("data", {})
-        if data:
+        if block is not None and block.kind == KIND_TABLE:
+            self._add_data_table(s, block, 22, 4, 10)
+        elif data:
             metrics_box = s.shapes.add_shape(MSO_SHAPE.RECTANGLE, Cm(24), Cm(4), Cm(7), Cm(6))
             metrics_box.fill.solid()
             metrics_box.fill.fore_color.rgb = self.LIGHT_GRAY
@@ -160,27 +279,25 @@ class PPTXCreator:
             for k, v in data.items():
                 p = tf.add_paragraph()
                 p.text = f"{k}: {v}"
-                p.font.size = Pt(self.FONT_CAPTION[1])
-                p.font.name = self.FONT_CAPTION[0]
+                styles.append((p, self.STYLE_METRIC))
+        apply_styles(styles)
 
-    def _add_financial_slide(self, prs, slide):
-        layout = prs.slide_layouts[6]
-        s = prs.slides.add_slide(layout)
-        fill = s.background.fill
-        fill.solid()
-        fill.fore_color.rgb = self.WHITE
-        # ヘッダーライン
-        header = s.shapes.add_shape(MSO_SHAPE.RECTANGLE, Cm(0), Cm(0), self.slide_width, Cm(0.5))
-        header.fill.solid()
-        header.fill.fore_color.rgb = self.ACCENT_ORANGE
-        header.line.color.rgb = self.ACCENT_ORANGE
+    def _add_financial_slide(self, prs, slide, block=None):
+        # 背景色・ヘッダーラインはスケルトンから複製
+        s = self._new_slide(prs, "financial_slide")
         # タイトル
         title = slide.get("title", "")
         title_shape = s.shapes.add_textbox(Cm(2), Cm(1), Cm(29), Cm(2.5))
         title_shape.text = title
-        self._set_font(title_shape, size=self.FONT_HEADER[1], bold=self.FONT_HEADER[2], color=self.DARK_GRAY)
-        # メイン数値ハイライト
+        styles = [(title_shape, self.STYLE_HEADER)]
+        # メイン数値ハイライト（件数が多い場合は表・グラフ）
         data = slide["content"].get("data", {})
+        if block is not None and block.kind == KIND_TABLE:
+            self._add_data_table(s, block, 3, 4, 11)
+            data = {}
+        elif block is not None and block.kind == KIND_CHART:
+            self._add_data_chart(s, block, 2, 4, 12, 11.5, self.ACCENT_ORANGE)
+            data = {}
         y = 4
         for k, v in data.items():
             num_box = s.shapes.add_shape(MSO_SHAPE.RECTANGLE, Cm(3), Cm(y), Cm(10), Cm(2))
@@ -190,36 +307,27 @@ class PPTXCreator:
             num_box.shadow.inherit = True
             tf = num_box.text_frame
             tf.text = f"{k}: {v}"
-            tf.paragraphs[0].font.size = Pt(self.FONT_BODY[1])
-            tf.paragraphs[0].font.bold = True
-            tf.paragraphs[0].font.name = self.FONT_BODY[0]
+            styles.append((num_box, self.STYLE_BOX_EMPHASIS))
             y += 2.5
         # 本文
         main_msg = slide["content"].get("main_message", "")
         msg_shape = s.shapes.add_textbox(Cm(15), Cm(4), Cm(15), Cm(6))
         msg_shape.text = main_msg
-        self._set_font(msg_shape, size=self.FONT_BODY[1], color=self.DARK_GRAY)
+        styles.append((msg_shape, self.STYLE_BODY))
         # データソース
         caption = s.shapes.add_textbox(Cm(2), Cm(16.5), Cm(25), Cm(1))
         caption.text = "出典: 社内データ・外部調査等"
-        self._set_font(caption, size=self.FONT_CAPTION[1], color=self.DARK_GRAY)
+        styles.append((caption, self.STYLE_CAPTION))
+        apply_styles(styles)
 
     def _add_implementation_slide(self, prs, slide):
-        layout = prs.slide_layouts[6]
-        s = prs.slides.add_slide(layout)
-        fill = s.background.fill
-        fill.solid()
-        fill.fore_color.rgb = self.WHITE
-        # ヘッダーライン
-        header = s.shapes.add_shape(MSO_SHAPE.RECTANGLE, Cm(0), Cm(0), self.slide_width, Cm(0.5))
-        header.fill.solid()
-        header.fill.fore_color.rgb = self.SECONDARY_BLUE
-        header.line.color.rgb = self.SECONDARY_BLUE
+        # 背景色・ヘッダーラインはスケルトンから複製
+        s = self._new_slide(prs, "implementation_slide")
         # タイトル
         title = slide.get("title", "")
         title_shape = s.shapes.add_textbox(Cm(2), Cm(1), Cm(29), Cm(2.5))
         title_shape.text = title
-        self._set_font(title_shape, size=self.FONT_HEADER[1], bold=self.FONT_HEADER[2], color=self.DARK_GRAY)
+        styles = [(title_shape, self.STYLE_HEADER)]
         # タイムライン（簡易）
         y = 4
         points = slide["content"].get("supporting_points", [])[:5]
@@ -231,28 +339,178 @@ class PPTXCreator:
             phase_box.shadow.inherit = True
             tf = phase_box.text_frame
             tf.text = pt
-            tf.paragraphs[0].font.size = Pt(self.FONT_BODY[1])
-            tf.paragraphs[0].font.name = self.FONT_BODY[0]
+            styles.append((phase_box, self.STYLE_BOX))
             y += 2
         # アクション項目
         main_msg = slide["content"].get("main_message", "")
         action_shape = s.shapes.add_textbox(Cm(3), Cm(15), Cm(25), Cm(2))
         action_shape.text = main_msg
-        self._set_font(action_shape, size=self.FONT_BODY[1], color=self.ACCENT_ORANGE)
+        styles.append((action_shape, self.STYLE_ACTION))
         # 責任者・期限（仮）
         caption = s.shapes.add_textbox(Cm(2), Cm(17.5), Cm(25), Cm(1))
         caption.text = "責任者・期限: 詳細は別紙参照"
-        self._set_font(caption, size=self.FONT_CAPTION[1], color=self.DARK_GRAY)
+        styles.append((caption, self.STYLE_CAPTION))
+        apply_styles(styles)
+
+    def _add_chart_slide(self, prs, slide, block=None):
+        # 背景色・ヘッダーラインはスケルトンから複製
+        s = self._new_slide(prs, "chart_slide")
+        # タイトル
+        title = slide.get("title", "")
+        title_shape = s.shapes.add_textbox(Cm(2), Cm(1), Cm(29), Cm(2.5))
+        title_shape.text = title
+        styles = [(title_shape, self.STYLE_HEADER)]
+        # 本文（グラフから読み取れる結論）
+        main_msg = slide["content"].get("main_message", "")
+        msg_shape = s.shapes.add_textbox(Cm(2), Cm(3.5), Cm(29), Cm(2))
+        msg_shape.text = main_msg
+        styles.append((msg_shape, self.STYLE_BODY))
+        # グラフ（数値が揃わない場合は表）
+        if block is not None and block.kind == KIND_CHART:
+            self._add_data_chart(s, block, 2, 5.5, 20, 10.5, self.BCG_BLUE)
+        elif block is not None:
+            self._add_data_table(s, block, 2, 5.5, 20)
+        # 右側の補足
+        y = 5.5
+        for pt in slide["content"].get("supporting_points", [])[:5]:
+            box = s.shapes.add_textbox(Cm(23), Cm(y), Cm(9), Cm(2))
+            box.text = pt
+            styles.append((box, self.STYLE_CAPTION))
+            y += 2
+        # データソース
+        caption = s.shapes.add_textbox(Cm(2), Cm(16.5), Cm(25), Cm(1))
+        caption.text = "出典: 社内データ・外部調査等"
+        styles.append((caption, self.STYLE_CAPTION))
+        apply_styles(styles)
+
+    def _add_data_table(self, s, block, x, y, width):
+        """
+        項目・値の2列のネイティブ表（項目ごとに図形を並べない）。行は書式込みのXMLを組み立てて1度に追加する
+        """
+        rows = [("項目", "値")] + [(point.label, point.text) for point in block.points]
+        row_height = Cm(self.TABLE_ROW_HEIGHT)
+        frame = s.shapes.add_table(1, 2, Cm(x), Cm(y), Cm(width), row_height * len(rows))
+        table = frame.table
+        table.columns[0].width = Cm(width * 0.6)
+        table.columns[1].width = Cm(width * 0.4)
+
+        def cell(text):
+            return f"<a:tc><a:txBody><a:bodyPr/><a:lstStyle/>{self.STYLE_TABLE.paragraph_xml(text)}</a:txBody><a:tcPr/></a:tc>"
+
+        rows_xml = "".join(f'<a:tr h="{row_height}">{cell(label)}{cell(value)}</a:tr>' for label, value in rows)
+        parsed = parse_xml(f"<a:tbl {nsdecls('a')}>{rows_xml}</a:tbl>")
+        tbl = table._tbl
+        tbl.remove(tbl.tr_lst[0])
+        for tr in list(parsed):
+            tbl.append(tr)
+
+    def _add_data_chart(self, s, block, x, y, width, height, color):
+        """
+        単位の揃った数値を比較するネイティブ棒グラフ（値は桁をそろえてデータラベルに表示）
+        """
+        chart_data = CategoryChartData() if self.EMBED_CHART_WORKBOOK else _CachedChartData()
+        chart_data.categories = [point.label for point in block.points]
+        chart_data.add_series(block.scale_label + block.unit or "値", [point.value / block.scale for point in block.points])
+        chart = s.shapes.add_chart(
+            XL_CHART_TYPE.COLUMN_CLUSTERED, Cm(x), Cm(y), Cm(width), Cm(height), chart_data
+        ).chart
+        if not self.EMBED_CHART_WORKBOOK:
+            external = chart._chartSpace.externalData
+            chart._chartSpace.remove(external)
+            chart.part.drop_rel(external.rId)
+        chart.has_legend = False
+        chart.font.name = self.FONT_CAPTION[0]
+        chart.font.size = Pt(self.FONT_CAPTION[1])
+        chart.font.color.rgb = self.DARK_GRAY
+        chart.value_axis.visible = False
+        chart.value_axis.has_major_gridlines = False
+        plot = chart.plots[0]
+        plot.gap_width = 60
+        fill = plot.series[0].format.fill
+        fill.solid()
+        fill.fore_color.rgb = color
+        plot.has_data_labels = True
+        labels = plot.data_labels
+        labels.number_format = chart_number_format(block)
+        labels.number_format_is_linked = False
+        labels.position = XL_LABEL_POSITION.OUTSIDE_END
+
+class PresentationSkeleton:
+    """
+    スライドサイズ設定・空白レイアウトのみに絞ったベースプレゼンテーション（シリアライズ済み）と、
+    スライド種別ごとの背景・装飾図形XMLをプロセスごとに1度だけ構築して使い回す
+    """
+    _cache = {}
+    _lock = threading.Lock()
+
+    def __init__(self, creator):
+        prs = Presentation()
+        prs.slide_width = creator.slide_width
+        prs.slide_height = creator.slide_height
+        # 空白レイアウト以外を削除して、読み込み・保存するパーツを減らす
+        blank = prs.slide_layouts[6]
+        for layout in list(prs.slide_layouts):
+            if layout is not blank:
+                prs.slide_layouts.remove(layout)
+        buffer = io.BytesIO()
+        prs.save(buffer)
+        self.data = buffer.getvalue()
+
+        # 種別ごとの装飾を一時スライドに描画し、要素を保持
+        scratch = self.new_presentation()
+        self.decorations = {}
+        for stype in creator.SLIDE_TYPES:
+            s = scratch.slides.add_slide(scratch.slide_layouts[0])
+            creator._decorate(s, stype)
+            bg = s._element.cSld.bg
+            shapes = [sp for sp in s.shapes._spTree.iter_shape_elms()]
+            self.decorations[stype] = (bg, shapes)
+
+    @classmethod
+    def get(cls, creator):
+        key = (creator.slide_width, creator.slide_height)
+        skeleton = cls._cache.get(key)
+        if skeleton is None:
+            with cls._lock:
+                skeleton = cls._cache.get(key)
+                if skeleton is None:
+                    skeleton = cls._cache[key] = cls(creator)
+        return skeleton
+
+    def new_presentation(self):
+        return Presentation(io.BytesIO(self.data))
+
+    def decorate(self, s, stype):
+        bg, shapes = self.decorations.get(stype, self.decorations["content_slide"])
+        if bg is not None:
+            # p:bg は p:spTree より前に置く必要がある
+            s._element.cSld.insert(0, copy.deepcopy(bg))
+        sp_tree = s.shapes._spTree
+        for sp in shapes:
+            el = copy.deepcopy(sp)
+            el.nvSpPr.cNvPr.id = s.shapes._next_shape_id
+            sp_tree.append(el)
+
 
 # 追加: main.pyから直接呼び出せる関数
 def create_presentation(structure: dict, output_path: str = None) -> str:
     creator = PPTXCreator()
-    result = creator.create_presentation(structure)
-    if output_path and isinstance(result, str) and not result.startswith("PPTX生成エラー"):
-        # ファイルを指定パスに移動
-        try:
-            Path(result).replace(output_path)
-            return output_path
-        except Exception as e:
-            return f"ファイル移動エラー: {str(e)}"
-    return result 
\ No newline at end of file
+    if not output_path:
+        return creator.create_presentation(structure)
+    # 指定パスへ直接1回だけ書き込む（一時ファイル・リネームなし）
+    try:
+        data = creator.render_bytes(structure)
+    except Exception as e:
+        return f"PPTX生成エラー: {str(e)}"
+    try:
+        Path(output_path).write_bytes(data)
+        return output_path
+    except Exception as e:
+        return f"ファイル保存エラー: {str(e)}"
+
+
+def render_presentation_bytes(structure: dict) -> bytes:
+    """
+    ディスクを介さずにPowerPointファイルのバイト列を生成
+    """
+    return PPTXCreator().render_bytes(structure)
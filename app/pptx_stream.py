@@ -0,0 +1,151 @@
+"""
+スライドを1枚ずつ描画してZIP（PPTX）へ直接書き出すストリーミング出力
+
+python-pptx の Presentation に全スライドを保持してから保存すると、メモリ使用量がスライド枚数に比例して増える。
+ここでは作業用のプレゼンテーションで1枚描画するごとにスライドXMLをZIPへ書き込んでから破棄し、
+プレゼンテーション本体（スライド一覧）・リレーションシップ・コンテンツタイプは最後にまとめて書き込む。
+保持し続けるのはスライドごとのIDとZIPの目次だけなので、枚数によらずピークメモリはほぼ一定になる。
+"""
+import io
+import re
+import zipfile
+from pathlib import Path
+from lxml import etree
+from pptx.opc.constants import CONTENT_TYPE as CT, RELATIONSHIP_TYPE as RT
+from pptx.opc.oxml import serialize_part_xml
+from pptx.opc.packuri import PackURI
+from pptx.oxml import parse_xml
+from app.metrics import metrics
+from app.pptx_creator import PPTXCreator, PresentationSkeleton
+
+PRESENTATION_PART = "ppt/presentation.xml"
+PRESENTATION_RELS = "ppt/_rels/presentation.xml.rels"
+CONTENT_TYPES = "[Content_Types].xml"
+# 最後に書き換えて出力するパーツ（それ以外のスケルトンのパーツはそのまま先に複製する）
+_FINAL_PARTS = (PRESENTATION_PART, PRESENTATION_RELS, CONTENT_TYPES)
+
+_PKG_RELS_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+_CT_NS = "http://schemas.openxmlformats.org/package/2006/content-types"
+# スライドIDは256から（ECMA-376の下限）
+FIRST_SLIDE_ID = 256
+
+
+class StreamingPPTXWriter:
+    """
+    スライドのイテレータを受け取り、1枚ずつPPTXのZIPエントリとして書き出す
+    """
+
+    def __init__(self, creator: PPTXCreator = None):
+        self.creator = creator or PPTXCreator()
+        self.skeleton = PresentationSkeleton.get(self.creator)
+
+    def write(self, slides, output, title: str = "") -> int:
+        """
+        slides（スライドdictのイテラブル）を output（パスまたはバイナリファイル）へ書き出し、スライド枚数を返す
+        """
+        if isinstance(output, (str, Path)):
+            with open(output, "wb") as f:
+                return self.write(slides, f, title)
+
+        with zipfile.ZipFile(io.BytesIO(self.skeleton.data)) as base, \
+                zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as out:
+            for name in base.namelist():
+                if name not in _FINAL_PARTS:
+                    out.writestr(name, base.read(name))
+
+            # 作業用プレゼンテーション: 1枚描画するたびに書き出して取り除く
+            prs = self.creator._prepare(self.skeleton.new_presentation())
+            sld_id_lst = prs.slides._sldIdLst
+            count = 0
+            # スライド以外に追加したパーツ（グラフ・埋め込みブック）の (パーツ名, コンテンツタイプ)
+            self._parts = []
+            self._part_numbers = {}
+            for slide in slides:
+                # data の多いスライドは複数枚に分割されることがある
+                self.creator._render_slide(prs, slide, title)
+                for sld_id in list(sld_id_lst):
+                    count += 1
+                    self._write_slide(out, prs.part.related_part(sld_id.rId), count)
+                    sld_id_lst.remove(sld_id)
+                    prs.part.drop_rel(sld_id.rId)
+
+            rids = self._write_presentation_rels(out, base.read(PRESENTATION_RELS), count)
+            self._write_presentation(out, base.read(PRESENTATION_PART), rids)
+            self._write_content_types(out, base.read(CONTENT_TYPES), count, self._parts)
+        return count
+
+    def _write_slide(self, out, part, number: int):
+        """
+        スライドXMLと、それが参照するパーツ（レイアウト以外: グラフ・埋め込みブックなど）を書き出す
+        """
+        with metrics.span("pptx_serialize"):
+            self._write_related(out, part)
+            out.writestr(f"ppt/slides/slide{number}.xml", serialize_part_xml(part._element))
+            out.writestr(f"ppt/slides/_rels/slide{number}.xml.rels", part.rels.xml)
+
+    def _write_related(self, out, part):
+        # _Relationships の反復はリレーションシップ自体を返す
+        for rel in part.rels:
+            if rel.is_external or rel.reltype == RT.SLIDE_LAYOUT:
+                continue
+            target = rel.target_part
+            # 作業用プレゼンテーションでは毎回 chart1.xml などの同じ名前になるため、通し番号を振り直す
+            target.partname = self._next_partname(target.partname)
+            self._write_related(out, target)
+            out.writestr(target.partname.membername, target.blob)
+            if len(target.rels):
+                out.writestr(target.partname.rels_uri.membername, target.rels.xml)
+            self._parts.append((target.partname, target.content_type))
+
+    def _next_partname(self, partname: PackURI) -> PackURI:
+        stem = re.sub(r"\d+$", "", partname.filename.rsplit(".", 1)[0])
+        key = (partname.baseURI, stem, partname.ext)
+        number = self._part_numbers[key] = self._part_numbers.get(key, 0) + 1
+        return PackURI(f"{partname.baseURI}/{stem}{number}.{partname.ext}")
+
+    def _write_presentation_rels(self, out, rels_xml: bytes, count: int) -> list:
+        root = etree.fromstring(rels_xml)
+        used = {rel.get("Id") for rel in root}
+        rids = []
+        n = 1
+        for number in range(1, count + 1):
+            while f"rId{n}" in used:
+                n += 1
+            rid = f"rId{n}"
+            used.add(rid)
+            rids.append(rid)
+            etree.SubElement(
+                root, f"{{{_PKG_RELS_NS}}}Relationship",
+                Id=rid, Type=RT.SLIDE, Target=f"slides/slide{number}.xml",
+            )
+        out.writestr(PRESENTATION_RELS, _xml_bytes(root))
+        return rids
+
+    def _write_presentation(self, out, presentation_xml: bytes, rids: list):
+        presentation = parse_xml(presentation_xml)
+        sld_id_lst = presentation.get_or_add_sldIdLst()
+        for i, rid in enumerate(rids):
+            sld_id_lst._add_sldId(id=FIRST_SLIDE_ID + i, rId=rid)
+        out.writestr(PRESENTATION_PART, serialize_part_xml(presentation))
+
+    def _write_content_types(self, out, types_xml: bytes, count: int, parts=()):
+        root = etree.fromstring(types_xml)
+        overrides = [(f"/ppt/slides/slide{number}.xml", CT.PML_SLIDE) for number in range(1, count + 1)]
+        for partname, content_type in [*overrides, *parts]:
+            etree.SubElement(root, f"{{{_CT_NS}}}Override", PartName=partname, ContentType=content_type)
+        out.writestr(CONTENT_TYPES, _xml_bytes(root))
+
+
+def _xml_bytes(element) -> bytes:
+    return etree.tostring(element, encoding="UTF-8", standalone=True)
+
+
+def stream_presentation(slides, output_path: str, title: str = "") -> str:
+    """
+    スライドを1枚ずつ output_path のPPTXへ書き出す（大量スライド向け）。失敗時はエラーメッセージを返す
+    """
+    try:
+        StreamingPPTXWriter().write(slides, output_path, title)
+        return output_path
+    except Exception as e:
+        return f"PPTX生成エラー: {str(e)}"
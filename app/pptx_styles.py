@@ -0,0 +1,63 @@
+import copy
+from xml.sax.saxutils import escape
+from lxml import etree
+from pptx.oxml import parse_xml
+from pptx.oxml.ns import nsdecls, qn
+
+_ALIGN_VALUES = {"left": "l", "center": "ctr", "right": "r"}
+
+
+class TextStyle:
+    """
+    フォント階層（名前・サイズ・太字）と色を、1度だけ a:rPr のXML断片にコンパイルしたテキストスタイル
+    """
+
+    def __init__(self, font, color=None, bold=None, align=None):
+        name, size, font_bold = font
+        self.name = name
+        self.size = size
+        self.bold = font_bold if bold is None else bold
+        self.color = color
+        self.align = _ALIGN_VALUES[align] if align else None
+        self._rpr = self._compile()
+        self._rpr_xml = etree.tostring(self._rpr, encoding="unicode")
+
+    def _compile(self):
+        # 子要素の順序は CT_TextCharacterProperties に従う（塗り → latin）
+        fill = f'<a:solidFill><a:srgbClr val="{self.color}"/></a:solidFill>' if self.color else ""
+        return parse_xml(
+            f'<a:rPr {nsdecls("a")} sz="{int(self.size * 100)}" b="{1 if self.bold else 0}">'
+            f'{fill}<a:latin typeface="{self.name}"/></a:rPr>'
+        )
+
+    def paragraph_xml(self, text: str) -> str:
+        """
+        書式付きの a:p のXML文字列（表のセルなど、要素をまとめて組み立てる場合に使う）
+        """
+        ppr = f'<a:pPr algn="{self.align}"/>' if self.align else ""
+        if not text:
+            return f"<a:p>{ppr}</a:p>"
+        return f"<a:p>{ppr}<a:r>{self._rpr_xml}<a:t>{escape(text)}</a:t></a:r></a:p>"
+
+    def apply(self, element):
+        """
+        element（図形・段落のXML要素）配下の全ランに書式を一括設定
+        """
+        for r in element.iter(qn("a:r")):
+            rpr = r.find(qn("a:rPr"))
+            new_rpr = copy.deepcopy(self._rpr)
+            if rpr is not None:
+                r.replace(rpr, new_rpr)
+            else:
+                r.insert(0, new_rpr)
+        if self.align:
+            for p in element.iter(qn("a:p")):
+                p.get_or_add_pPr().set("algn", self.align)
+
+
+def apply_styles(assignments):
+    """
+    (図形または段落, TextStyle) の組をスライド単位でまとめて適用する
+    """
+    for target, style in assignments:
+        style.apply(target._element)
@@ -0,0 +1,276 @@
+"""
+スライド構造からブラウザ向けの軽量プレビュー（HTML + SVG）を生成する
+
+PPTXCreator の各レイアウト（_add_title_slide / _add_content_slide / _add_financial_slide /
+_add_implementation_slide / _add_chart_slide）と同じ座標・配色・フォント階層で描き、data の表・グラフ・
+スライド分割も同じ判定（PPTXCreator.plan_slide_data）に従うため、PPTXを作らずに仕上がりを確認できる
+"""
+from html import escape
+from app.data_render import KIND_CHART, KIND_TABLE, continuation_slide, format_chart_value
+from app.pptx_creator import PPTXCreator as P
+from app.pptx_styles import TextStyle
+from app.structure_schema import normalize_slide
+
+# 座標はcm指定をポイントに換算し、スライド全体（33.867cm × 19.05cm）を 960 × 540 で表す
+PT_PER_CM = 72 / 2.54
+SLIDE_WIDTH = 960
+SLIDE_HEIGHT = 540
+# テキストボックスの内側余白（PowerPointの既定値: 左右0.1インチ・上下0.05インチ）
+INSET_X = 7.2
+INSET_Y = 3.6
+# 色指定のない図形内テキストはテーマの既定色（白）で描画される
+SHAPE_TEXT_COLOR = P.WHITE
+FONT_FAMILY = "'游ゴシック', 'Yu Gothic', 'メイリオ', 'Meiryo', sans-serif"
+# 表の既定スタイル（中間スタイル2 - アクセント1）の見出し行と縞模様の色
+TABLE_HEADER_COLOR = P.SECONDARY_BLUE
+TABLE_BAND_COLORS = ("CFD5EA", "E9EBF5")
+TABLE_TEXT_COLOR = "000000"
+STYLE_TABLE_HEADER = TextStyle(P.FONT_CAPTION, bold=True)
+# グラフのデータラベル・項目名（グラフ全体のフォントはキャプションサイズ）
+STYLE_CHART_LABEL = TextStyle(P.FONT_CAPTION, color=P.DARK_GRAY, align="center")
+
+_XHTML = "http://www.w3.org/1999/xhtml"
+
+
+def _pt(cm: float) -> float:
+    return round(cm * PT_PER_CM, 1)
+
+
+def _css_text(style, color=None) -> str:
+    color = style.color or color or P.DARK_GRAY
+    align = {"l": "left", "ctr": "center", "r": "right"}.get(style.align, "left")
+    return (
+        f"font-size:{style.size}px;font-weight:{'bold' if style.bold else 'normal'};"
+        f"color:#{color};text-align:{align}"
+    )
+
+
+class _Canvas:
+    """
+    1枚分のSVG要素を座標（cm）指定で積み上げる
+    """
+
+    def __init__(self, uid):
+        # 1ページに複数のSVGを並べるため、グラデーション・影のIDはスライドごとに分ける
+        self.uid = uid
+        self.parts = []
+
+    def rect(self, x, y, w, h, fill, stroke=None, shadow=False):
+        attrs = f'x="{_pt(x)}" y="{_pt(y)}" width="{_pt(w)}" height="{_pt(h)}" fill="{fill}"'
+        if stroke:
+            attrs += f' stroke="#{stroke}"'
+        if shadow:
+            attrs += f' filter="url(#shadow-{self.uid})"'
+        self.parts.append(f"<rect {attrs}/>")
+
+    def text(self, x, y, w, h, paragraphs, middle=False):
+        """
+        テキストボックス（middle=Trueは図形内テキスト: 上下中央揃え）。paragraphs は (文字列, TextStyle, 既定色) の列
+        """
+        if not any(text for text, _, _ in paragraphs):
+            return
+        body = "".join(
+            f'<p style="margin:0;{_css_text(style, color)}">{escape(text)}</p>'
+            for text, style, color in paragraphs
+        )
+        layout = "display:flex;flex-direction:column;justify-content:center;" if middle else ""
+        self.parts.append(
+            f'<foreignObject x="{_pt(x)}" y="{_pt(y)}" width="{_pt(w)}" height="{_pt(h)}">'
+            f'<div xmlns="{_XHTML}" style="{layout}box-sizing:border-box;height:100%;'
+            f'padding:{INSET_Y}px {INSET_X}px;overflow:hidden;overflow-wrap:anywhere;line-height:1.2">'
+            f"{body}</div></foreignObject>"
+        )
+
+    def table(self, block, x, y, width):
+        """
+        PPTXCreator._add_data_table と同じ2列（項目 60% / 値 40%）の表
+        """
+        h = P.TABLE_ROW_HEIGHT
+        rows = [("項目", "値")] + [(p.label, p.text) for p in block.points]
+        for i, (label, value) in enumerate(rows):
+            row_y = y + h * i
+            fill = TABLE_HEADER_COLOR if i == 0 else TABLE_BAND_COLORS[(i - 1) % 2]
+            self.rect(x, row_y, width, h, f"#{fill}", stroke=P.WHITE)
+            style = STYLE_TABLE_HEADER if i == 0 else P.STYLE_TABLE
+            color = P.WHITE if i == 0 else TABLE_TEXT_COLOR
+            self.text(x, row_y, width * 0.6, h, [(label, style, color)], middle=True)
+            self.text(x + width * 0.6, row_y, width * 0.4, h, [(value, style, color)], middle=True)
+
+    def chart(self, block, x, y, width, height, color):
+        """
+        PPTXCreator._add_data_chart と同じ棒グラフ（値軸なし・データラベルを棒の上に表示）
+        """
+        label_h = 1.0
+        plot_top = y + label_h
+        plot_h = height - label_h * 2
+        values = [p.value for p in block.points]
+        top = max(max(values), 0)
+        bottom = min(min(values), 0)
+        span = (top - bottom) or 1
+        zero_y = plot_top + plot_h * top / span
+        slot = width / len(block.points)
+        bar_w = slot / 1.6
+        for i, point in enumerate(block.points):
+            bar_x = x + slot * i + (slot - bar_w) / 2
+            bar_h = plot_h * abs(point.value) / span
+            bar_y = zero_y - bar_h if point.value >= 0 else zero_y
+            self.rect(bar_x, bar_y, bar_w, max(bar_h, 0.01), f"#{color}")
+            value_y = bar_y - label_h if point.value >= 0 else bar_y + bar_h
+            self.text(x + slot * i, value_y, slot, label_h,
+                      [(format_chart_value(block, point), STYLE_CHART_LABEL, None)], middle=True)
+            self.text(x + slot * i, y + height - label_h, slot, label_h,
+                      [(point.label, STYLE_CHART_LABEL, None)], middle=True)
+        self.rect(x, zero_y, width, 0.02, f"#{P.LIGHT_GRAY}")
+
+    def header_line(self, stype):
+        color = P.HEADER_COLORS.get(stype, P.BCG_BLUE)
+        self.rect(0, 0, 33.867, 0.5, f"#{color}", stroke=color)
+
+
+def _title_slide(c: _Canvas, slide, pres_title):
+    c.rect(0, 0, 33.867, 19.05, f"url(#title-gradient-{c.uid})")
+    c.rect(2, 17, 10, 0.5, f"#{P.BCG_BLUE}", stroke=P.BCG_BLUE)
+    c.text(2, 6, 30, 4, [(slide.get("title") or pres_title, P.STYLE_TITLE, None)])
+    c.text(2, 10, 30, 2.5, [(slide["content"]["main_message"], P.STYLE_SUBTITLE, None)])
+
+
+def _content_slide(c: _Canvas, slide, block=None):
+    content = slide["content"]
+    c.header_line("content_slide")
+    c.text(2, 1, 29, 2.5, [(slide["title"], P.STYLE_HEADER, None)])
+    c.text(2, 4, 20, 3, [(content["main_message"], P.STYLE_BODY, None)])
+    y = 7
+    for pt in content["supporting_points"][:5]:
+        c.text(3, y, 25, 1.5, [(pt, P.STYLE_BULLET, None)])
+        y += 2
+    data = content["data"]
+    if block is not None and block.kind == KIND_TABLE:
+        c.table(block, 22, 4, 10)
+    elif data:
+        c.rect(24, 4, 7, 6, f"#{P.LIGHT_GRAY}", stroke=P.SECONDARY_BLUE, shadow=True)
+        # 見出し段落には書式を適用しないため、図形テキストの既定（本文サイズ・白）になる
+        paragraphs = [("メトリクス", P.STYLE_BOX, SHAPE_TEXT_COLOR)]
+        paragraphs += [(f"{k}: {v}", P.STYLE_METRIC, SHAPE_TEXT_COLOR) for k, v in data.items()]
+        c.text(24, 4, 7, 6, paragraphs, middle=True)
+
+
+def _financial_slide(c: _Canvas, slide, block=None):
+    content = slide["content"]
+    c.header_line("financial_slide")
+    c.text(2, 1, 29, 2.5, [(slide["title"], P.STYLE_HEADER, None)])
+    data = content["data"]
+    if block is not None and block.kind == KIND_TABLE:
+        c.table(block, 3, 4, 11)
+        data = {}
+    elif block is not None and block.kind == KIND_CHART:
+        c.chart(block, 2, 4, 12, 11.5, P.ACCENT_ORANGE)
+        data = {}
+    y = 4
+    for k, v in data.items():
+        c.rect(3, y, 10, 2, f"#{P.LIGHT_GRAY}", stroke=P.ACCENT_ORANGE, shadow=True)
+        c.text(3, y, 10, 2, [(f"{k}: {v}", P.STYLE_BOX_EMPHASIS, SHAPE_TEXT_COLOR)], middle=True)
+        y += 2.5
+    c.text(15, 4, 15, 6, [(content["main_message"], P.STYLE_BODY, None)])
+    c.text(2, 16.5, 25, 1, [("出典: 社内データ・外部調査等", P.STYLE_CAPTION, None)])
+
+
+def _implementation_slide(c: _Canvas, slide):
+    content = slide["content"]
+    c.header_line("implementation_slide")
+    c.text(2, 1, 29, 2.5, [(slide["title"], P.STYLE_HEADER, None)])
+    y = 4
+    for i, pt in enumerate(content["supporting_points"][:5]):
+        fill = P.LIGHT_GRAY if i % 2 == 0 else P.WHITE
+        c.rect(3, y, 25, 1.5, f"#{fill}", stroke=P.SECONDARY_BLUE, shadow=True)
+        c.text(3, y, 25, 1.5, [(pt, P.STYLE_BOX, SHAPE_TEXT_COLOR)], middle=True)
+        y += 2
+    c.text(3, 15, 25, 2, [(content["main_message"], P.STYLE_ACTION, None)])
+    c.text(2, 17.5, 25, 1, [("責任者・期限: 詳細は別紙参照", P.STYLE_CAPTION, None)])
+
+
+def _chart_slide(c: _Canvas, slide, block=None):
+    content = slide["content"]
+    c.header_line("chart_slide")
+    c.text(2, 1, 29, 2.5, [(slide["title"], P.STYLE_HEADER, None)])
+    c.text(2, 3.5, 29, 2, [(content["main_message"], P.STYLE_BODY, None)])
+    if block is not None and block.kind == KIND_CHART:
+        c.chart(block, 2, 5.5, 20, 10.5, P.BCG_BLUE)
+    elif block is not None:
+        c.table(block, 2, 5.5, 20)
+    y = 5.5
+    for pt in content["supporting_points"][:5]:
+        c.text(23, y, 9, 2, [(pt, P.STYLE_CAPTION, None)])
+        y += 2
+    c.text(2, 16.5, 25, 1, [("出典: 社内データ・外部調査等", P.STYLE_CAPTION, None)])
+
+
+_LAYOUTS = {
+    "content_slide": _content_slide,
+    "financial_slide": _financial_slide,
+    "chart_slide": _chart_slide,
+}
+
+
+def render_slide_svgs(slide, pres_title: str = "", number: int = None) -> list:
+    """
+    1枚分のスライドをSVG文字列のリストにする（data が多い場合は PPTXCreator と同じく複数枚に分割。
+    未対応の種別は content_slide として描画）
+    """
+    slide = normalize_slide(slide, number)
+    stype = slide["type"]
+    if stype == "title_slide":
+        c = _Canvas(slide["slide_number"])
+        _title_slide(c, slide, pres_title)
+        return [_svg(c, slide)]
+    if stype == "implementation_slide":
+        c = _Canvas(slide["slide_number"])
+        _implementation_slide(c, slide)
+        return [_svg(c, slide)]
+    blocks = P.plan_slide_data(slide) or [None]
+    svgs = []
+    for page, block in enumerate(blocks):
+        page_slide = continuation_slide(slide, page, len(blocks))
+        c = _Canvas(f"{slide['slide_number']}-{page + 1}")
+        _LAYOUTS.get(stype, _content_slide)(c, page_slide, block)
+        svgs.append(_svg(c, page_slide))
+    return svgs
+
+
+def _svg(c: _Canvas, slide) -> str:
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {SLIDE_WIDTH} {SLIDE_HEIGHT}" '
+        f'role="img" aria-label="{escape(slide["title"])}" '
+        f'style="background:#{P.WHITE};font-family:{escape(FONT_FAMILY)}">'
+        f"{_defs(c.uid)}{''.join(c.parts)}</svg>"
+    )
+
+
+def _defs(uid) -> str:
+    return (
+        "<defs>"
+        f'<linearGradient id="title-gradient-{uid}" x1="0" y1="0" x2="1" y2="0">'
+        f'<stop offset="0" stop-color="#{P.BCG_BLUE}"/><stop offset="1" stop-color="#{P.SECONDARY_BLUE}"/>'
+        "</linearGradient>"
+        f'<filter id="shadow-{uid}" x="-5%" y="-5%" width="115%" height="130%">'
+        '<feDropShadow dx="2" dy="2" stdDeviation="2" flood-opacity="0.3"/>'
+        "</filter></defs>"
+    )
+
+
+def render_preview_html(structure: dict) -> str:
+    """
+    デッキ全体のプレビュー（スライドごとの figure を並べたHTML断片）を返す
+    """
+    pres_title = structure.get("title", "") if isinstance(structure, dict) else ""
+    slides = structure.get("slides", []) if isinstance(structure, dict) else []
+    figures = []
+    position = 0
+    for number, slide in enumerate(slides, start=1):
+        for svg in render_slide_svgs(slide, pres_title, number):
+            # 番号は分割後のPPTX上の位置、data-slide-number は元のスライド番号
+            position += 1
+            figures.append(
+                f'<figure class="slide-preview-item" data-slide-number="{number}">'
+                f"{svg}<figcaption>{position}</figcaption></figure>"
+            )
+    return f'<div class="slide-preview-deck">{"".join(figures)}</div>'
@@ -1,58 +1,682 @@
 import os
-import openai
 import json
-import socket
 import re
-from dotenv import load_dotenv
-from pathlib import Path
+import asyncio
+import functools
+import itertools
+import time
+import logging
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from app.llm_client import get_async_llm_client, get_llm_client
+from app.llm_hedge import get_hedge_policy
+from app.llm_scheduler import PRIORITY_INTERACTIVE, get_llm_scheduler, request_key
+from app.metrics import metrics
+from app.structure_cache import get_structure_cache, make_cache_key
+from app.token_budget import TokenBudget
+from app.structure_schema import (
+    StructureParseError, extract_json_text, normalize_slide, normalize_structure,
+    parse_json_tolerant, strip_trailing_commas,
+)
+
+logger = logging.getLogger(__name__)
+
+# この文字数を超える入力は節に分割して並列生成する
+CHUNK_THRESHOLD_CHARS = int(os.getenv('CHUNK_THRESHOLD_CHARS', '6000'))
+CHUNK_SECTION_CHARS = int(os.getenv('CHUNK_SECTION_CHARS', '3000'))
+# 生成方式: single=1回の応答で全スライドを生成 / outline=構成を先に生成し、各スライドの内容を並列に生成
+GENERATION_MODE = os.getenv('GENERATION_MODE', 'single')
+# outline方式で同時に展開するスライド数
+EXPAND_WORKERS = int(os.getenv('EXPAND_WORKERS', '16'))
+# outline方式で各スライドの展開に添える元文書の抜粋の上限（文字数）
+EXPAND_EXCERPT_CHARS = int(os.getenv('EXPAND_EXCERPT_CHARS', '1500'))
+
+class SlideStreamParser:
+    """
+    ストリーミング中のJSONテキストから "slides" 配列の要素を、オブジェクトが閉じた時点で取り出す
+    """
+    SLIDES_KEY = re.compile(r'"slides"\s*:\s*\[')
+
+    def __init__(self):
+        self._buf = ""
+        self._pos = 0
+        self._in_slides = False
+        self._finished = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._obj_start = None
+
+    @property
+    def finished(self) -> bool:
+        """
+        "slides" 配列の閉じ括弧まで読み終えたか
+        """
+        return self._finished
+
+    def feed(self, text: str) -> list:
+        """
+        テキスト断片を追加し、新たに確定したスライドのリストを返す
+        """
+        self._buf += text
+        slides = []
+        if self._finished:
+            return slides
+        if not self._in_slides:
+            match = self.SLIDES_KEY.search(self._buf)
+            if not match:
+                return slides
+            self._in_slides = True
+            self._pos = match.end()
+        buf = self._buf
+        while self._pos < len(buf):
+            ch = buf[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                if self._depth == 0:
+                    self._obj_start = self._pos
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0 and self._obj_start is not None:
+                    try:
+                        slides.append(json.loads(buf[self._obj_start:self._pos + 1]))
+                    except json.JSONDecodeError:
+                        pass
+                    self._obj_start = None
+            elif ch == "]" and self._depth == 0:
+                self._finished = True
+                self._pos += 1
+                break
+            self._pos += 1
+        return slides
+
 
 class SlideGenerator:
-    def __init__(self, timeout=60):
-        load_dotenv(dotenv_path=Path(__file__).parent.parent / 'config' / '.env')
-        self.api_key = os.getenv('OPENAI_API_KEY')
+    MODEL = "gpt-4"
+    TEMPERATURE = 0.2
+    # _build_prompt のテンプレートを変更したら更新する（キャッシュキーに含まれる）
+    PROMPT_VERSION = "3"
+    # 途中で切れた応答の続きを要求する最大回数
+    CONTINUATION_ROUNDS = 2
+    SYSTEM_PROMPT = "あなたはBCGのパートナーであり、ピラミッドストラクチャ・MECE・結論ファースト・データドリブン・1スライド1メッセージ・ビジネスインパクト明確化の原則を徹底するプロフェッショナルなスライド構成コンサルタントです。"
+
+    # トークン予算を使わない呼び出し（max_tokens未指定時）の既定値
+    DEFAULT_MAX_TOKENS = 1800
+
+    def __init__(self, timeout=60, max_tokens=None, client=None, scheduler=None, priority=PRIORITY_INTERACTIVE, async_client=None, hedge=None):
+        # クライアントはプロセス共通（接続プール共有・グローバル設定の変更なし）
+        self.client = client or get_llm_client()
+        # 非同期モード（agenerate_structure）でのみ使用。未指定時は初回使用時に共有クライアントを取得
+        self.async_client = async_client
+        # 送信レート・再試行・同一リクエストの集約もプロセス共通のスケジューラーで管理
+        self.scheduler = scheduler or get_llm_scheduler()
+        # 応答開始の遅いリクエストはフォールバックモデルで並行送信（LLM_HEDGE_ENABLED）
+        self.hedge = hedge or get_hedge_policy()
+        self.priority = priority
         self.timeout = timeout
-        if not self.api_key:
-            raise ValueError('OpenAI APIキーが設定されていません。')
-        openai.api_key = self.api_key
+        # max_tokensを指定しない場合は入力の長さ（想定スライド枚数）から決める
+        self.max_tokens = max_tokens
+        self.budget = TokenBudget(self.MODEL)
 
-    def generate_structure(self, content: str) -> dict:
+    def generate_structure(self, content: str, on_slide=None, on_progress=None) -> dict:
         """
         入力テキストをBCGパートナーレベルの詳細なスライド構造(JSON)に変換
+
+        on_slideを指定するとストリーミングモードで呼び出し、スライドが1枚確定するたびに
+        on_slide(slide)を、トークン受信ごとにon_progress(受信トークン数, max_tokens)を呼ぶ
+        """
+        with metrics.span("prompt_build"):
+            prompt, max_tokens = self._plan_request(content, self._build_prompt)
+        if max_tokens is None:
+            logger.warning("入力がコンテキスト長に収まらないため分割して生成します（%d文字）", len(content))
+            return self.generate_chunked(content, max_chars=max(500, len(content) // 2), on_slide=on_slide, on_progress=on_progress)
+        return self._complete_structure(prompt, on_slide, on_progress, max_tokens)
+
+    async def agenerate_structure(self, content: str, on_slide=None, on_progress=None) -> dict:
+        """
+        generate_structure の非同期版。応答待ちの間スレッドを占有しない
+        """
+        with metrics.span("prompt_build"):
+            prompt, max_tokens = self._plan_request(content, self._build_prompt)
+        if max_tokens is None:
+            logger.warning("入力がコンテキスト長に収まらないため分割して生成します（%d文字）", len(content))
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, functools.partial(
+                self.generate_chunked, content, max_chars=max(500, len(content) // 2),
+                on_slide=on_slide, on_progress=on_progress,
+            ))
+        return await self._acomplete_structure(prompt, on_slide, on_progress, max_tokens)
+
+    def _plan_request(self, content: str, build_prompt, outline=False) -> tuple:
+        """
+        トークン予算に沿ってプロンプトを組み立て (プロンプト, max_tokens) を返す
+
+        短い入力は例示を省いたプロンプトにし、max_tokensは想定スライド枚数から決める（outline=True は構成のみの分）。
+        コンテキスト長に収まらない場合 max_tokens は None
         """
-        prompt = self._build_prompt(content)
+        compact = self.budget.use_compact_prompt(content)
+        slides = self.budget.expected_slides(content)
+        prompt = build_prompt(content, compact=compact, slides=slides)
+        if outline:
+            wanted = self.budget.outline_tokens(content)
+        else:
+            wanted = self.max_tokens or self.budget.completion_tokens(content)
+        prompt_tokens = self.budget.count(self.SYSTEM_PROMPT + prompt)
+        return prompt, self.budget.fit_completion(prompt_tokens, wanted)
+
+    def generate_chunked(self, content: str, max_chars=3000, max_workers=4, on_slide=None, on_progress=None) -> dict:
+        """
+        長文を節ごとに分割して並列にスライド化し、重複を除いて1つの構造に統合する
+        """
+        sections = split_sections(content, max_chars)
+        if len(sections) == 1:
+            return self.generate_structure(content, on_slide=on_slide, on_progress=on_progress)
+
+        total = len(sections)
+        done = []
+
+        def generate_part(index):
+            with metrics.span("prompt_build"):
+                prompt, max_tokens = self._plan_request(
+                    sections[index],
+                    lambda section, **options: self._build_section_prompt(section, index, total, **options),
+                )
+            if max_tokens is None:
+                return {"status": "error", "message": "入力が長すぎるためスライドを生成できません。"}
+            part = self._complete_structure(prompt, max_tokens=max_tokens)
+            done.append(index)
+            if on_progress:
+                on_progress(len(done), total)
+            return part
+
+        with ThreadPoolExecutor(max_workers=min(max_workers, total)) as executor:
+            parts = list(executor.map(generate_part, range(total)))
+        for part in parts:
+            if part.get("status") == "error":
+                return part
+
+        merged = merge_structures(parts)
+        if on_slide:
+            for slide in merged["slides"]:
+                on_slide(slide)
+        return merged
+
+    def generate_outlined(self, content: str, on_slide=None, on_progress=None, max_workers=EXPAND_WORKERS) -> dict:
+        """
+        2段階生成: 構成（タイトル・種類・メインメッセージ）を先に生成し、各スライドの補足項目とデータを
+        並列に生成して組み立てる。所要時間はスライド枚数によらず「構成 + スライド1枚分」程度になる
+
+        on_progress は (完了した段階の数, 全段階の数) で呼ぶ（構成の生成と各スライドの展開が1段階ずつ）
+        """
+        with metrics.span("prompt_build"):
+            prompt, max_tokens = self._plan_request(content, self._build_outline_prompt, outline=True)
+        if max_tokens is None or not self._expansions_fit_tpm(content):
+            return self.generate_structure(content, on_slide=on_slide, on_progress=on_progress)
+        outline = self._complete_structure(prompt, max_tokens=max_tokens)
+        if outline.get("status") == "error":
+            return outline
+        assembly = OutlineAssembly(outline, on_slide, on_progress)
+        if assembly.pending:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(assembly.pending))) as executor:
+                futures = {
+                    executor.submit(self._expand_slide, content, assembly.outline, index): index
+                    for index in assembly.pending
+                }
+                for future in as_completed(futures):
+                    assembly.add(futures[future], future.result())
+        return assembly.result()
+
+    async def agenerate_outlined(self, content: str, on_slide=None, on_progress=None) -> dict:
+        """
+        generate_outlined の非同期版（各スライドの展開を同時に送信）
+        """
+        with metrics.span("prompt_build"):
+            prompt, max_tokens = self._plan_request(content, self._build_outline_prompt, outline=True)
+        if max_tokens is None or not self._expansions_fit_tpm(content):
+            return await self.agenerate_structure(content, on_slide=on_slide, on_progress=on_progress)
+        outline = await self._acomplete_structure(prompt, max_tokens=max_tokens)
+        if outline.get("status") == "error":
+            return outline
+        assembly = OutlineAssembly(outline, on_slide, on_progress)
+
+        async def expand(index):
+            prompt, max_tokens = self._plan_expansion(content, assembly.outline, index)
+            if max_tokens is None:
+                assembly.add(index, None)
+                return
+            assembly.add(index, await self._acomplete_structure(prompt, max_tokens=max_tokens, deck=False))
+
+        await asyncio.gather(*(expand(index) for index in assembly.pending))
+        return assembly.result()
+
+    def _expand_slide(self, content: str, outline: dict, index: int):
+        prompt, max_tokens = self._plan_expansion(content, outline, index)
+        if max_tokens is None:
+            return None
+        return self._complete_structure(prompt, max_tokens=max_tokens, deck=False)
+
+    def _expansions_fit_tpm(self, content: str) -> bool:
+        """
+        想定スライド枚数分の展開リクエストの合計トークン数が TPM の枠に収まるか。収まらない場合、展開は
+        レート制限で順番待ちになり1回の生成より遅く高価になるため、1回の生成に切り替える
+        """
+        tpm = self.scheduler.tpm
+        if not tpm:
+            return True
+        slides = self.budget.expected_slides(content)
+        placeholder = {"slides": [{"title": "", "content": {"main_message": ""}}] * slides}
+        prompt = self._build_expand_prompt(content, placeholder, 0)
+        # デッキ構成の各行（タイトル・メインメッセージ）は構成のスライド1枚分として見積もる
+        per_request = (
+            self.budget.count(self.SYSTEM_PROMPT + prompt)
+            + slides * self.budget.OUTLINE_TOKENS_PER_SLIDE
+            + self.budget.expansion_tokens()
+        )
+        if (slides - 1) * per_request <= tpm:
+            return True
+        metrics.inc("outline_fallbacks_total", reason="tpm")
+        logger.info("展開リクエストの見積もり（%d件 × %dトークン）がTPMの枠を超えるため1回の生成に切り替えます", slides - 1, per_request)
+        return False
+
+    def _plan_expansion(self, content: str, outline: dict, index: int) -> tuple:
+        """
+        index番目のスライドを展開する (プロンプト, max_tokens)。コンテキスト長に収まらない場合 max_tokens は None
+        """
+        prompt = self._build_expand_prompt(content, outline, index)
+        prompt_tokens = self.budget.count(self.SYSTEM_PROMPT + prompt)
+        return prompt, self.budget.fit_completion(prompt_tokens, self.budget.expansion_tokens())
+
+    def regenerate_slide(self, structure: dict, index: int, instruction: str = "") -> dict:
+        """
+        デッキ全体の流れを保ったまま、index番目のスライド1枚だけを再生成する
+        """
+        prompt = self._build_slide_prompt(structure, index, instruction)
+        result = self._complete_structure(prompt, max_tokens=600, deck=False)
+        if isinstance(result, dict) and result.get("status") == "error":
+            return result
+        # {"slides": [...]} 形式で返された場合も受け付ける
+        if isinstance(result, dict) and isinstance(result.get("slides"), list) and result["slides"]:
+            result = result["slides"][0]
+        elif isinstance(result, list) and result:
+            result = result[0]
+        return normalize_slide(result, index + 1)
+
+    def _complete_structure(self, prompt: str, on_slide=None, on_progress=None, max_tokens=None, deck=True) -> dict:
+        """
+        LLMの応答をパースしてスライド構造を返す。deck=Trueの場合はスキーマ補正を行い、
+        max_tokens到達で途中切れした場合は不足分のみ続きを生成する
+        """
+        steps = self._structure_steps(prompt, deck)
         try:
-            old_timeout = socket.getdefaulttimeout()
-            socket.setdefaulttimeout(self.timeout)
-            client = openai.OpenAI(api_key=self.api_key)
-            response = client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "あなたはBCGのパートナーであり、ピラミッドストラクチャ・MECE・結論ファースト・データドリブン・1スライド1メッセージ・ビジネスインパクト明確化の原則を徹底するプロフェッショナルなスライド構成コンサルタントです。"},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.2,
-                max_tokens=1800,
-                timeout=self.timeout
-            )
-            socket.setdefaulttimeout(old_timeout)
-            result_text = response.choices[0].message.content
-            print("AIレスポンス:", result_text)
-            # コードブロックや説明文を除去してJSON部分のみ抽出
-            match = re.search(r"```(?:json)?\s*(\{[\s\S]*?\})\s*```", result_text)
-            if match:
-                json_str = match.group(1)
-            else:
-                match = re.search(r"(\{[\s\S]*\})", result_text)
-                json_str = match.group(1) if match else result_text
-            try:
-                result_json = json.loads(json_str)
-            except json.JSONDecodeError:
-                return {"status": "error", "message": "AIから有効なJSONが返りませんでした。AIレスポンス: " + result_text}
-            return result_json
+            step_prompt, first = next(steps)
+            while True:
+                try:
+                    text = self._request(step_prompt, on_slide, on_progress if first else None, max_tokens)
+                except Exception as e:
+                    step_prompt, first = steps.throw(e)
+                else:
+                    step_prompt, first = steps.send(text)
+        except StopIteration as done:
+            return done.value
+
+    async def _acomplete_structure(self, prompt: str, on_slide=None, on_progress=None, max_tokens=None, deck=True) -> dict:
+        """
+        _complete_structure の非同期版（非同期クライアントで送信）
+        """
+        steps = self._structure_steps(prompt, deck)
+        try:
+            step_prompt, first = next(steps)
+            while True:
+                try:
+                    text = await self._arequest(step_prompt, on_slide, on_progress if first else None, max_tokens)
+                except Exception as e:
+                    step_prompt, first = steps.throw(e)
+                else:
+                    step_prompt, first = steps.send(text)
+        except StopIteration as done:
+            return done.value
+
+    def _structure_steps(self, prompt: str, deck=True):
+        """
+        応答の補正と続きの生成の手順（同期・非同期で共通）
+
+        送信するプロンプトと初回かどうかを yield し、応答テキストを受け取る。最終結果を return する
+        """
+        try:
+            result_text = yield prompt, True
         except Exception as e:
+            metrics.inc("errors_total", type=type(e).__name__)
+            logger.warning("AI処理エラー: %s", e)
             return {"status": "error", "message": f"AI処理エラー: {str(e)}"}
+        with metrics.span("json_extract"):
+            try:
+                data, truncated = parse_json_tolerant(result_text)
+                if not deck:
+                    return data
+                # 途中で切れた応答は確定済みのスライドがなくても続きを生成する
+                structure = normalize_structure(data, allow_empty=truncated)
+            except StructureParseError:
+                metrics.inc("errors_total", type="invalid_json")
+                logger.warning("AIから有効なJSONが返りませんでした（%d文字）", len(result_text))
+                return {"status": "error", "message": "AIから有効なJSONが返りませんでした。AIレスポンス: " + result_text}
+        if not truncated:
+            return structure
+
+        # 途中で切れた応答のうち確定済みのスライドを残し、残りのスライドだけを追加で生成する
+        metrics.inc("structure_repairs_total", kind="truncated")
+        slides, finished = complete_slides(result_text)
+        added = 0
+        # finished: slides配列は閉じており、外側の括弧が欠けただけ
+        for _ in range(0 if finished else self.CONTINUATION_ROUNDS):
+            metrics.inc("structure_repairs_total", kind="continuation")
+            try:
+                text = yield self._build_continuation_prompt(prompt, slides), False
+                data, truncated = parse_json_tolerant(text)
+                continued = normalize_structure(data, allow_empty=True)["slides"]
+            except Exception as e:
+                logger.warning("続きの生成に失敗しました: %s", e)
+                break
+            if truncated:
+                continued, finished = complete_slides(text)
+            slides += continued
+            added += len(continued)
+            if not truncated or finished or not continued:
+                break
+        if added:
+            structure = normalize_structure({**structure, "slides": slides})
+        if not structure["slides"]:
+            metrics.inc("errors_total", type="empty_structure")
+            logger.warning("AIの応答にスライドが含まれていませんでした（%d文字）", len(result_text))
+            return {"status": "error", "message": "AIの応答にスライドが含まれていませんでした。"}
+        return structure
+
+    def _request_params(self, prompt: str, stream: bool, max_tokens=None) -> dict:
+        return dict(
+            model=self.MODEL,
+            messages=[
+                {"role": "system", "content": self.SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=self.TEMPERATURE,
+            max_tokens=max_tokens or self.max_tokens or self.DEFAULT_MAX_TOKENS,
+            timeout=self.timeout,
+            stream=stream
+        )
+
+    def _estimate_request_tokens(self, params: dict) -> int:
+        # TPMはプロンプトとmax_tokensの合計で消費される
+        return self.budget.count(self.SYSTEM_PROMPT + params["messages"][-1]["content"]) + params["max_tokens"]
+
+    def _request(self, prompt: str, on_slide=None, on_progress=None, max_tokens=None) -> str:
+        stream = on_slide is not None or on_progress is not None
+        params = self._request_params(prompt, stream, max_tokens)
+        tokens = self._estimate_request_tokens(params)
+        start = time.perf_counter()
+        if stream:
+            chunks = self.hedge.run(
+                lambda attempt: self._open_stream(params, tokens, attempt), params["model"], "stream"
+            )
+            handle_chunk, finish = self._stream_handler(on_slide, on_progress, start, params["max_tokens"])
+            for chunk in chunks:
+                handle_chunk(chunk)
+            result_text = finish()
+        else:
+            # ストリーミングしない呼び出しは同一内容の同時リクエストを1回にまとめる
+            result_text = self.scheduler.coalesce(request_key(params), lambda: self.hedge.run(
+                lambda attempt: self.scheduler.call(
+                    lambda: self._complete_text({**params, "model": attempt.model}, attempt), tokens, self.priority
+                ),
+                params["model"], "complete",
+            ))
+        metrics.observe("llm_request_seconds", time.perf_counter() - start, mode="stream" if stream else "complete")
+        logger.debug("AIレスポンス: %s", result_text)
+        return result_text or ""
+
+    def _open_stream(self, params: dict, tokens: int, attempt):
+        """
+        attempt のモデルでストリーミング応答を開始し、最初の本文チャンクまで読んだうえで全チャンクのイテレータを返す
+        """
+        response = self.scheduler.call(
+            lambda: self.client.chat.completions.create(**{**params, "model": attempt.model}), tokens, self.priority
+        )
+        # ヘッジで採用されなかった場合は接続を閉じて受信を止める
+        http_response = getattr(response, "response", None)
+        if http_response is not None:
+            attempt.on_cancel(http_response.close)
+        chunks = iter(response)
+        head = []
+        for chunk in chunks:
+            head.append(chunk)
+            if chunk.choices and chunk.choices[0].delta.content:
+                break
+        return itertools.chain(head, chunks)
+
+    async def _arequest(self, prompt: str, on_slide=None, on_progress=None, max_tokens=None) -> str:
+        stream = on_slide is not None or on_progress is not None
+        params = self._request_params(prompt, stream, max_tokens)
+        tokens = self._estimate_request_tokens(params)
+        client = self.async_client or get_async_llm_client()
+        start = time.perf_counter()
+
+        async def send(attempt):
+            response = await self.scheduler.acall(
+                lambda: client.chat.completions.create(**{**params, "model": attempt.model}), tokens, self.priority
+            )
+            if not stream:
+                return response
+            return await self._aopen_stream(response, attempt)
+
+        response = await self.hedge.arun(send, params["model"], "stream" if stream else "complete")
+        if stream:
+            handle_chunk, finish = self._stream_handler(on_slide, on_progress, start, params["max_tokens"])
+            async for chunk in response:
+                handle_chunk(chunk)
+            result_text = finish()
+        else:
+            result_text = response.choices[0].message.content
+            self._record_usage(getattr(response, "usage", None))
+        metrics.observe("llm_request_seconds", time.perf_counter() - start, mode="stream" if stream else "complete")
+        logger.debug("AIレスポンス: %s", result_text)
+        return result_text or ""
+
+    @staticmethod
+    async def _aopen_stream(response, attempt):
+        """
+        _open_stream の非同期版（最初の本文チャンクまで読み、全チャンクの非同期イテレータを返す）
+        """
+        http_response = getattr(response, "response", None)
+        if http_response is not None:
+            attempt.on_cancel(lambda: asyncio.ensure_future(http_response.aclose()))
+        chunks = response.__aiter__()
+        head = []
+        try:
+            async for chunk in chunks:
+                head.append(chunk)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    break
+        except asyncio.CancelledError:
+            attempt.cancel()
+            raise
 
-    def _build_prompt(self, content: str) -> str:
+        async def replay():
+            for chunk in head:
+                yield chunk
+            async for chunk in chunks:
+                yield chunk
+
+        return replay()
+
+    def _complete_text(self, params: dict, attempt=None) -> str:
+        if attempt is None or not self.hedge.enabled:
+            response = self.client.chat.completions.create(**params)
+        else:
+            # ヘッジで採用されなかった場合に接続を閉じられるよう、生の応答を受け取ってから解析する
+            raw = self.client.chat.completions.with_raw_response.create(**params)
+            attempt.on_cancel(raw.http_response.close)
+            response = raw.parse()
+        self._record_usage(getattr(response, "usage", None))
+        return response.choices[0].message.content
+
+    def _stream_handler(self, on_slide, on_progress, start=None, max_tokens=None):
+        """
+        ストリーミング応答のチャンク処理関数と、全文を返す終了関数の組を返す（確定したスライドを逐次通知）
+        """
+        parser = SlideStreamParser()
+        chunks = []
+        received = 0
+
+        def handle_chunk(chunk):
+            nonlocal received
+            received += 1
+            if not chunk.choices:
+                return
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                return
+            if not chunks and start is not None:
+                metrics.observe("llm_time_to_first_token_seconds", time.perf_counter() - start)
+            chunks.append(delta)
+            for slide in parser.feed(delta):
+                if on_slide:
+                    on_slide(slide)
+            if on_progress:
+                on_progress(received, max_tokens or self.DEFAULT_MAX_TOKENS)
+
+        def finish():
+            # ストリーミング応答には usage が含まれないため、チャンク数を出力トークン数の近似とする
+            metrics.inc("llm_tokens_total", len(chunks), kind="completion")
+            return "".join(chunks)
+
+        return handle_chunk, finish
+
+    @staticmethod
+    def _record_usage(usage):
+        for kind in ("prompt", "completion"):
+            tokens = getattr(usage, f"{kind}_tokens", None)
+            if isinstance(tokens, int):
+                metrics.inc("llm_tokens_total", tokens, kind=kind)
+
+    def _build_section_prompt(self, section: str, index: int, total: int, compact=False, slides=None) -> str:
+        scope = [f"この文書は長文のため{total}部に分割されています。以下は第{index + 1}部です。"]
+        scope.append("この部分の内容のみをスライド化してください。")
+        if index > 0:
+            scope.append("タイトルスライド（title_slide）は作成しないでください。")
+        if index < total - 1:
+            scope.append("まとめスライド（conclusion_slide）は作成しないでください。")
+        return "\n".join(scope) + "\n" + self._build_prompt(section, compact=compact, slides=slides)
+
+    def _build_continuation_prompt(self, prompt: str, slides: list) -> str:
+        outline = "\n".join(f"{s['slide_number']}. [{s['type']}] {s['title']}" for s in slides)
+        return f"""{prompt}
+【生成済みのスライド】
+前回の出力は文字数上限により途中で終了しました。以下のスライドは生成済みです。
+{outline or "（なし）"}
+
+【続きの出力ルール】
+- スライド{len(slides) + 1}以降の残りのスライドのみを {{"slides": [...]}} 形式のJSONで出力
+- 生成済みのスライドを繰り返さない
+- JSON以外の出力は禁止
+"""
+
+    def _build_slide_prompt(self, structure: dict, index: int, instruction: str) -> str:
+        outline = "\n".join(
+            f"{i + 1}. [{slide.get('type', 'content_slide')}] {slide.get('title', '')}"
+            for i, slide in enumerate(structure.get("slides", []))
+        )
+        current = json.dumps(structure["slides"][index], ensure_ascii=False, indent=2)
+        return f"""
+以下のプレゼンテーション「{structure.get('title', '')}」のうち、スライド{index + 1}のみを改善して書き直してください。
+
+【厳格な出力ルール】
+- 出力は書き直したスライド1枚分のJSONオブジェクトのみ（現在のスライドと同じ形式）
+- 1スライド1メッセージ、結論ファースト、supporting_pointsは3～5個で数値を含める
+- 前後のスライドと内容を重複させない
+- JSON以外の出力は禁止
+
+【デッキ構成】
+{outline}
+
+【現在のスライド{index + 1}】
+{current}
+
+【修正指示】
+{instruction or "より具体的で説得力のある内容にしてください。"}
+"""
+
+    def _build_outline_prompt(self, content: str, compact=False, slides=None) -> str:
+        target = f"\n【スライド枚数の目安】\n{slides}枚程度（タイトル・まとめを含む）\n" if slides else ""
+        return f"""
+以下の文書を、BCGのパートナーとしてプレゼンテーションの構成に変換してください。各スライドの内容（補足項目・データ）は後で1枚ずつ作成します。
+
+【構成の出力ルール】
+- ピラミッドストラクチャ、MECE、結論ファーストを徹底し、各スライドは「1スライド1メッセージ」
+- 各スライドは slide_number・title・type・main_message のみを出力（supporting_points と data は出力しない）
+- main_message は数値やファクトを含む、明確かつインパクトのある結論にする
+- 数値の比較・推移を示すスライドは chart_slide にする
+- JSON以外の出力は禁止
+
+形式: {{"title": "プレゼンテーションタイトル", "slides": [{{"slide_number": 1, "title": "スライドタイトル", "type": "title_slide|content_slide|chart_slide|conclusion_slide", "main_message": "メインメッセージ"}}]}}
+{target}
+【変換対象文書】
+{content}
+"""
+
+    def _build_expand_prompt(self, content: str, outline: dict, index: int) -> str:
+        slides = outline.get("slides", [])
+        listing = "\n".join(
+            f"{i + 1}. [{slide.get('type', 'content_slide')}] {slide.get('title', '')} — {slide.get('content', {}).get('main_message', '')}"
+            for i, slide in enumerate(slides)
+        )
+        slide = slides[index]
+        # 元の文書全体ではなく、このスライドに関連する箇所だけを添える（展開ごとの入力トークン数を抑える）
+        excerpt = relevant_excerpt(content, slide)
+        source_label = "【変換対象文書】" if excerpt == content else "【変換対象文書（このスライドに関連する箇所の抜粋）】"
+        chart_rule = ""
+        if slide.get("type") == "chart_slide":
+            chart_rule = "- このスライドはグラフで表示するため、data には単位をそろえた数値（例：\"1.2億円\"、\"80%\"）を2～12項目入れる\n"
+        return f"""
+以下の文書から作成するプレゼンテーション「{outline.get('title', '')}」のうち、スライド{index + 1}の補足項目とデータのみを作成してください。
+
+【厳格な出力ルール】
+- 出力は {{"supporting_points": ["..."], "data": {{"key": "value"}}}} 形式のJSONオブジェクトのみ
+- supporting_pointsは3～5個。メインメッセージを裏付ける根拠・具体例・アクション・ビジネスインパクトを数値付きで記述
+- 他のスライドと内容を重複させない
+- data には主要な数値を {{"項目": "値"}} で入れる
+{chart_rule}- JSON以外の出力は禁止
+
+【デッキ構成】
+{listing}
+
+【展開するスライド】
+スライド{index + 1}: [{slide.get('type', 'content_slide')}] {slide.get('title', '')}
+メインメッセージ: {slide.get('content', {}).get('main_message', '')}
+
+{source_label}
+{excerpt}
+"""
+
+    def _build_prompt(self, content: str, compact=False, slides=None) -> str:
+        target = f"\n【スライド枚数の目安】\n{slides}枚程度（タイトル・まとめを含む）\n" if slides else ""
+        if compact:
+            # 短い入力向け: ルールを要約し、例示を省略
+            return f"""
+以下の文書を、BCGのパートナーとしてプロフェッショナルなスライド構造のJSONに変換してください。
+ルール: ピラミッドストラクチャ・MECE・結論ファースト、1スライド1メッセージ、各スライドに数値やファクトを含むsupporting_pointsを3～5個。JSON以外の出力は禁止。
+形式: {{"title": "タイトル", "slides": [{{"slide_number": 1, "title": "スライドタイトル", "type": "title_slide|content_slide|chart_slide|conclusion_slide", "content": {{"main_message": "結論", "supporting_points": ["根拠（数値必須）"], "data": {{"key": "value"}}}}}}]}}
+{target}
+【変換対象文書】
+{content}
+"""
         return f"""
 あなたはBCGのパートナーとして、以下の厳格なルールに従い、プロフェッショナルなスライド構造をJSON形式で出力してください。
 
@@ -64,6 +688,7 @@ class SlideGenerator:
 - 各スライドの主張（main_message）は明確かつインパクトのあるものにする
 - 各supporting_pointは根拠や具体例、アクション、ビジネスインパクトを含める
 - 聴衆（経営層・現場・顧客など）に応じた適切な詳細レベルで記述
+- 数値の比較・推移を示すスライドは chart_slide とし、data に単位をそろえた数値（例："1.2億円"、"80%"）を2～12項目入れる
 - JSON以外の出力は禁止
 
 【出力JSON形式】
@@ -107,11 +732,273 @@ class SlideGenerator:
     }}
   ]
 }}
-
+{target}
 【変換対象文書】
 {content}
 """
 
-def generate_slide_structure(content: str) -> dict:
-    generator = SlideGenerator()
-    return generator.generate_structure(content) 
\ No newline at end of file
+class OutlineAssembly:
+    """
+    2段階生成の組み立て: 展開結果を構成に反映し、先頭から順に確定したスライドを通知する（スレッドセーフ）
+    """
+
+    def __init__(self, outline: dict, on_slide=None, on_progress=None):
+        self.outline = outline
+        self.slides = [{**slide, "content": dict(slide.get("content", {}))} for slide in outline.get("slides", [])]
+        # タイトルスライドはメインメッセージ（サブタイトル）のみのため展開しない
+        self.pending = [i for i, slide in enumerate(self.slides) if slide.get("type") != "title_slide"]
+        self.on_slide = on_slide
+        self.on_progress = on_progress
+        self._done = [i not in self.pending for i in range(len(self.slides))]
+        self._emitted = 0
+        self._completed = 0
+        self._lock = threading.Lock()
+        self._report_progress()
+        self._flush()
+
+    def add(self, index: int, expansion):
+        """
+        index番目のスライドの展開結果（{"supporting_points", "data"}）を反映する。失敗時は構成のまま残す
+        """
+        if isinstance(expansion, list) and expansion:
+            expansion = expansion[0]
+        if not isinstance(expansion, dict) or expansion.get("status") == "error":
+            metrics.inc("errors_total", type="expand_failed")
+            logger.warning("スライド%dの展開に失敗しました", index + 1)
+        else:
+            # {"content": {...}} やスライド1枚分の形式で返された場合も受け付ける
+            expanded = expansion.get("content") if isinstance(expansion.get("content"), dict) else expansion
+            content = self.slides[index]["content"]
+            for key, kind in (("supporting_points", list), ("data", dict)):
+                if isinstance(expanded.get(key), kind):
+                    content[key] = expanded[key]
+        with self._lock:
+            self._done[index] = True
+            self._completed += 1
+        self._report_progress()
+        self._flush()
+
+    def _report_progress(self):
+        if self.on_progress:
+            # 構成の生成を1段階目として数える
+            self.on_progress(self._completed + 1, len(self.pending) + 1)
+
+    def _flush(self):
+        with self._lock:
+            ready = []
+            while self._emitted < len(self.slides) and self._done[self._emitted]:
+                ready.append(self.slides[self._emitted])
+                self._emitted += 1
+            if self.on_slide:
+                for slide in ready:
+                    self.on_slide(normalize_slide(slide, slide.get("slide_number")))
+
+    def result(self) -> dict:
+        return normalize_structure({**self.outline, "slides": self.slides})
+
+
+def complete_slides(result_text: str) -> tuple:
+    """
+    途中で切れた応答から、閉じ括弧まで出力済みのスライドのみを取り出し (スライド, slides配列が閉じたか) を返す
+    """
+    parser = SlideStreamParser()
+    try:
+        slides = parser.feed(strip_trailing_commas(extract_json_text(result_text)))
+    except StructureParseError:
+        return [], False
+    return [normalize_slide(slide, number) for number, slide in enumerate(slides, start=1)], parser.finished
+
+
+def split_sections(content: str, max_chars=3000) -> list:
+    """
+    見出し（【】・#）と空行で段落に分け、max_chars以内に詰めた節のリストを返す
+    """
+    paragraphs = []
+    current = []
+    for line in content.splitlines():
+        stripped = line.strip()
+        is_heading = stripped.startswith(("【", "#", "■"))
+        if (not stripped or is_heading) and current:
+            paragraphs.append("\n".join(current))
+            current = []
+        if stripped:
+            current.append(line)
+    if current:
+        paragraphs.append("\n".join(current))
+
+    sections = []
+    buf = ""
+    for para in paragraphs:
+        # 1段落がmax_charsを超える場合は文字数で分割
+        pieces = [para[i:i + max_chars] for i in range(0, len(para), max_chars)] or [para]
+        for piece in pieces:
+            if buf and len(buf) + len(piece) + 2 > max_chars:
+                sections.append(buf)
+                buf = ""
+            buf = f"{buf}\n\n{piece}" if buf else piece
+    if buf:
+        sections.append(buf)
+    return sections or [content]
+
+
+def _bigrams(text: str) -> set:
+    text = re.sub(r"\s+", "", unicodedata.normalize("NFKC", text or "")).lower()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def relevant_excerpt(content: str, slide: dict, max_chars=EXPAND_EXCERPT_CHARS) -> str:
+    """
+    スライドのタイトル・メインメッセージと共通する2文字の並びが多い節を max_chars 以内で選び、元の順序で返す
+    （同点の場合は文書の先頭に近い節を優先。共通する節がなければ文書の先頭から）
+    """
+    if len(content) <= max_chars:
+        return content
+    sections = split_sections(content, max_chars=max(1, max_chars // 3))
+    query = _bigrams(f"{slide.get('title', '')}{slide.get('content', {}).get('main_message', '')}")
+    scores = [len(query & _bigrams(section)) for section in sections]
+    candidates = [i for i, score in enumerate(scores) if score] or range(len(sections))
+    ranked = sorted(candidates, key=lambda i: (-scores[i], i))
+    chosen = []
+    total = 0
+    for i in ranked:
+        if total + len(sections[i]) > max_chars:
+            continue
+        chosen.append(i)
+        total += len(sections[i])
+    return "\n…\n".join(sections[i] for i in sorted(chosen))
+
+
+def _title_key(title: str) -> str:
+    return re.sub(r"\s+", "", unicodedata.normalize("NFKC", title or "")).lower()
+
+
+def merge_structures(parts: list) -> dict:
+    """
+    節ごとの部分構造を統合: タイトル→本文→まとめの順に並べ、同じタイトルのスライドは1枚にまとめる
+    """
+    title = next((p.get("title") for p in parts if p.get("title")), "")
+    title_slides, body, conclusions = [], [], []
+    by_title = {}
+    for part in parts:
+        for slide in part.get("slides", []):
+            stype = slide.get("type", "content_slide")
+            if stype == "title_slide":
+                if not title_slides:
+                    title_slides.append(slide)
+                continue
+            key = (stype, _title_key(slide.get("title", "")))
+            if key[1] and key in by_title:
+                # 重複スライドは補足項目を統合（最大5つ）
+                content = by_title[key].setdefault("content", {})
+                points = content.setdefault("supporting_points", [])
+                for point in slide.get("content", {}).get("supporting_points", []):
+                    if point not in points and len(points) < 5:
+                        points.append(point)
+                content.setdefault("data", {}).update(slide.get("content", {}).get("data", {}) or {})
+                continue
+            by_title[key] = slide
+            (conclusions if stype == "conclusion_slide" else body).append(slide)
+
+    slides = title_slides + body + conclusions[-1:]
+    for number, slide in enumerate(slides, start=1):
+        slide["slide_number"] = number
+    return {"title": title, "slides": slides}
+
+
+def structure_cache_key(content: str) -> str:
+    # 生成方式によって応答の内容が変わるため、outline方式はプロンプトの版を分ける
+    version = SlideGenerator.PROMPT_VERSION + ("-outline" if GENERATION_MODE == "outline" else "")
+    return make_cache_key(content, SlideGenerator.MODEL, SlideGenerator.TEMPERATURE, version)
+
+
+def load_cached_structure(cache, key: str):
+    """
+    キャッシュ済みの構造を返す。補正処理の導入前に保存されたエントリも同じ形にそろえ、スライドのないものは無視する
+    """
+    cached = cache.get(key) if cache is not None else None
+    if cached is None:
+        return None
+    try:
+        return normalize_structure(cached)
+    except StructureParseError:
+        return None
+
+
+def generate_slide_structure(content: str, on_slide=None, on_progress=None, use_cache=True, priority=PRIORITY_INTERACTIVE) -> dict:
+    """
+    キャッシュを参照してスライド構造を返す。use_cache=Falseの場合は必ず再生成してキャッシュを更新
+
+    同じ内容の生成が実行中の場合は、その結果を待って共有する（確定スライドはまとめて通知）
+    """
+    key = structure_cache_key(content)
+    received = []
+
+    def generate():
+        return _generate_structure(content, key, on_slide, on_progress, use_cache, priority, received)
+
+    result = get_llm_scheduler().coalesce(("structure", key, use_cache), generate)
+    if on_slide and not received:
+        # 他のリクエストの生成結果を共有した場合
+        for slide in result.get("slides", []):
+            on_slide(slide)
+    return result
+
+
+def _generate_structure(content, key, on_slide, on_progress, use_cache, priority, received) -> dict:
+    def notify(slide):
+        received.append(slide)
+        if on_slide:
+            on_slide(slide)
+
+    cache = get_structure_cache()
+    cached = load_cached_structure(cache, key) if use_cache else None
+    if cached is not None:
+        for slide in cached.get("slides", []):
+            notify(slide)
+        return cached
+
+    generator = SlideGenerator(priority=priority)
+    stream_slide = notify if on_slide else None
+    if len(content) > CHUNK_THRESHOLD_CHARS:
+        result = generator.generate_chunked(content, max_chars=CHUNK_SECTION_CHARS, on_slide=stream_slide, on_progress=on_progress)
+    elif GENERATION_MODE == "outline":
+        result = generator.generate_outlined(content, on_slide=stream_slide, on_progress=on_progress)
+    else:
+        result = generator.generate_structure(content, on_slide=stream_slide, on_progress=on_progress)
+    # スライドのない結果はキャッシュしない（次回は生成し直す）
+    if cache is not None and result.get("status") != "error" and result.get("slides"):
+        cache.set(key, result)
+    return result
+
+
+async def agenerate_slide_structure(content: str, on_slide=None, on_progress=None, use_cache=True, priority=PRIORITY_INTERACTIVE) -> dict:
+    """
+    generate_slide_structure の非同期版（ASGIモード用）
+
+    長文の分割生成と同一内容の集約はスレッド版を使うためワーカースレッドで実行する
+    """
+    loop = asyncio.get_running_loop()
+    if len(content) > CHUNK_THRESHOLD_CHARS:
+        return await loop.run_in_executor(None, functools.partial(
+            generate_slide_structure, content, on_slide=on_slide, on_progress=on_progress,
+            use_cache=use_cache, priority=priority,
+        ))
+    key = structure_cache_key(content)
+    cache = get_structure_cache()
+    # キャッシュはSQLiteへの同期アクセスのため、イベントループを止めないようスレッドプールで実行
+    cached = await loop.run_in_executor(None, load_cached_structure, cache, key) if use_cache else None
+    if cached is not None:
+        if on_slide:
+            for slide in cached.get("slides", []):
+                on_slide(slide)
+        return cached
+
+    generator = SlideGenerator(priority=priority)
+    if GENERATION_MODE == "outline":
+        result = await generator.agenerate_outlined(content, on_slide=on_slide, on_progress=on_progress)
+    else:
+        result = await generator.agenerate_structure(content, on_slide=on_slide, on_progress=on_progress)
+    # スライドのない結果はキャッシュしない（次回は生成し直す）
+    if cache is not None and result.get("status") != "error" and result.get("slides"):
+        await loop.run_in_executor(None, cache.set, key, result)
+    return result
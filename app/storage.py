@@ -0,0 +1,220 @@
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent.parent.resolve()
+DEFAULT_STORAGE_ROOT = BASE_DIR / "data" / "generated"
+SAFE_FILENAME = re.compile(r"[\w.\-]+")
+# クリーンアップの対象にする拡張子（PPTXと構造JSON）
+DECK_SUFFIXES = (".pptx", ".json")
+# 保持するETag（内容ハッシュ）の件数上限
+ETAG_CACHE_SIZE = 4096
+
+logger = logging.getLogger(__name__)
+
+
+def content_etag(data: bytes) -> str:
+    """
+    デッキ内容のハッシュ（SHA-256の先頭32桁）。HTTPのETag（引用符なし）として使う
+    """
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+class DeckStorage:
+    """
+    生成済みデッキの保存領域
+
+    - ファイル名のハッシュ先頭2桁でサブディレクトリに分散（1ディレクトリのファイル数を抑える）
+    - 作成から ttl 秒経過したデッキ（PPTXと構造JSON）を削除
+    - 合計サイズが max_bytes を超えた場合は最終アクセスが古いデッキから削除（LRU）
+    """
+
+    def __init__(self, root=DEFAULT_STORAGE_ROOT, ttl=7 * 24 * 3600, max_bytes=5 * 1024 ** 3, janitor_interval=600):
+        self.root = Path(root).resolve()
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.janitor_interval = janitor_interval
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._janitor = None
+        self._stop = threading.Event()
+        self._cleanup_lock = threading.Lock()
+        # ファイル名 → (mtime_ns, サイズ, ETag)。書き込み時に登録し、他プロセスが書いたファイルは初回参照時に計算
+        self._etags = OrderedDict()
+        self._etags_lock = threading.Lock()
+
+    def path_for(self, filename: str) -> Path:
+        if not SAFE_FILENAME.fullmatch(filename):
+            raise ValueError("ファイル名が不正です。")
+        # 同じデッキのPPTXと構造JSONが同じシャードに入るよう拡張子を除いた名前で振り分け
+        stem = filename.rsplit(".", 1)[0]
+        shard = hashlib.sha1(stem.encode("utf-8")).hexdigest()[:2]
+        return self.root / shard / filename
+
+    def write(self, filename: str, data: bytes) -> Path:
+        path = self.path_for(filename)
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(data)
+        self._remember_etag(filename, path.stat(), content_etag(data))
+        return path
+
+    def open_path(self, filename: str):
+        """
+        存在するファイルのパスを返し、LRU判定用に最終アクセス時刻を更新する（作成時刻=mtimeは保持）
+        """
+        try:
+            path = self.path_for(filename)
+            stat = path.stat()
+        except (ValueError, FileNotFoundError):
+            return None
+        if time.time() - stat.st_mtime > self.ttl:
+            return None
+        os.utime(path, (time.time(), stat.st_mtime))
+        return path
+
+    def etag(self, filename: str, path: Path) -> str:
+        """
+        ファイル内容のETagを返す（同じ mtime・サイズの間は計算済みの値を再利用）
+        """
+        stat = path.stat()
+        with self._etags_lock:
+            cached = self._etags.get(filename)
+            if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+                self._etags.move_to_end(filename)
+                return cached[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        etag = digest.hexdigest()[:32]
+        self._remember_etag(filename, stat, etag)
+        return etag
+
+    def _remember_etag(self, filename, stat, etag):
+        with self._etags_lock:
+            self._etags[filename] = (stat.st_mtime_ns, stat.st_size, etag)
+            self._etags.move_to_end(filename)
+            while len(self._etags) > ETAG_CACHE_SIZE:
+                self._etags.popitem(last=False)
+
+    def read(self, filename: str):
+        path = self.open_path(filename)
+        return path.read_bytes() if path else None
+
+    def cleanup(self) -> dict:
+        """
+        期限切れファイルの削除と容量上限によるLRU削除を行い、結果を返す
+
+        同じデッキのPPTXと構造JSONは、どちらかの最新の作成・アクセス時刻でまとめて削除する
+        （ダウンロードでPPTXだけが参照されても、再生成に使う構造JSONを先に失わないように）
+        """
+        with self._cleanup_lock:
+            now = time.time()
+            expired = 0
+            evicted = 0
+            # 拡張子を除いたファイル名（デッキ）→ [最新のmtime, 最新のatime, 合計サイズ, パス]
+            decks = {}
+            for path in self.root.glob("*/*"):
+                # 保存領域に置かれたデッキ以外のファイルは削除しない
+                if not self._is_deck_file(path):
+                    continue
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                deck = decks.setdefault(path.parent / path.stem, [0.0, 0.0, 0, []])
+                deck[0] = max(deck[0], stat.st_mtime)
+                deck[1] = max(deck[1], stat.st_atime)
+                deck[2] += stat.st_size
+                deck[3].append(path)
+            live = []
+            for mtime, atime, size, paths in decks.values():
+                if now - mtime > self.ttl:
+                    self._unlink_all(paths)
+                    expired += len(paths)
+                else:
+                    live.append((atime, size, paths))
+            total = sum(size for _, size, _ in live)
+            if total > self.max_bytes:
+                for _, size, paths in sorted(live, key=lambda d: d[0]):
+                    if total <= self.max_bytes:
+                        break
+                    self._unlink_all(paths)
+                    total -= size
+                    evicted += len(paths)
+            return {"expired": expired, "evicted": evicted, "total_bytes": total}
+
+    def _unlink_all(self, paths):
+        for path in paths:
+            self._unlink(path)
+
+    def _is_deck_file(self, path: Path) -> bool:
+        """
+        write で保存したファイルか（デッキの拡張子で、ファイル名から決まるシャードに置かれている）
+        """
+        if path.suffix not in DECK_SUFFIXES:
+            return False
+        try:
+            return self.path_for(path.name) == path
+        except ValueError:
+            return False
+
+    def _unlink(self, path):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def start_janitor(self):
+        """
+        バックグラウンドで定期的に cleanup を実行するスレッドを開始
+        """
+        if self._janitor is not None and self._janitor.is_alive():
+            return
+        self._stop.clear()
+        self._janitor = threading.Thread(target=self._run_janitor, name="deck-storage-janitor", daemon=True)
+        self._janitor.start()
+
+    def stop_janitor(self):
+        self._stop.set()
+
+    def _run_janitor(self):
+        while not self._stop.is_set():
+            try:
+                result = self.cleanup()
+                if result["expired"] or result["evicted"]:
+                    logger.info("デッキ保存領域をクリーンアップしました: %s", result)
+            except Exception:
+                logger.exception("デッキ保存領域のクリーンアップに失敗しました")
+            self._stop.wait(self.janitor_interval)
+
+
+_default_storage = None
+_default_storage_lock = threading.Lock()
+
+
+def get_deck_storage():
+    """
+    プロセス共通の保存領域を返す（STORAGE_ROOT 等の環境変数で構成。空の値は既定値として扱う）
+    """
+    global _default_storage
+    with _default_storage_lock:
+        if _default_storage is None:
+            _default_storage = DeckStorage(
+                root=os.getenv("STORAGE_ROOT") or str(DEFAULT_STORAGE_ROOT),
+                ttl=int(os.getenv("STORAGE_TTL") or str(7 * 24 * 3600)),
+                max_bytes=int(os.getenv("STORAGE_MAX_BYTES") or str(5 * 1024 ** 3)),
+                janitor_interval=int(os.getenv("STORAGE_JANITOR_INTERVAL") or "600"),
+            )
+        return _default_storage
+
+
+def init_app(app):
+    storage = get_deck_storage()
+    storage.start_janitor()
+    app.extensions['deck_storage'] = storage
+    return storage
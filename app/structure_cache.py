@@ -0,0 +1,150 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent.parent.resolve()
+DEFAULT_CACHE_PATH = BASE_DIR / "data" / "cache" / "structures.sqlite3"
+
+
+def normalize_content(content: str) -> str:
+    """
+    全角・半角や空白の揺れを吸収し、実質的に同じ入力が同じキーになるよう正規化
+    """
+    text = unicodedata.normalize("NFKC", content)
+    lines = [re.sub(r"[ \t　]+", " ", line).strip() for line in text.splitlines()]
+    return "\n".join(line for line in lines if line)
+
+
+def make_cache_key(content: str, model: str, temperature: float, prompt_version: str) -> str:
+    payload = json.dumps(
+        [normalize_content(content), prompt_version, model, temperature],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class StructureCache:
+    """
+    生成済みスライド構造のキャッシュ（メモリLRU + SQLite永続化、件数上限とTTLで破棄）
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_memory_entries=256, max_disk_entries=5000, ttl=7 * 24 * 3600):
+        self.path = Path(path)
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS structures ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_structures_accessed ON structures(accessed_at)")
+        self._db.commit()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if now - created_at <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return json.loads(value)
+                del self._memory[key]
+
+            row = self._db.execute(
+                "SELECT value, created_at FROM structures WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._db.execute("DELETE FROM structures WHERE key = ?", (key,))
+                    self._db.commit()
+                self._stats["misses"] += 1
+                return None
+            value, created_at = row
+            self._db.execute("UPDATE structures SET accessed_at = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self._remember(key, created_at, value)
+            self._stats["disk_hits"] += 1
+            return json.loads(value)
+
+    def set(self, key: str, structure: dict):
+        now = time.time()
+        value = json.dumps(structure, ensure_ascii=False)
+        with self._lock:
+            self._remember(key, now, value)
+            self._db.execute(
+                "INSERT OR REPLACE INTO structures (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._stats["writes"] += 1
+            self._evict_disk(now)
+            self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["hits"] = stats["memory_hits"] + stats["disk_hits"]
+            stats["memory_entries"] = len(self._memory)
+            stats["disk_entries"] = self._db.execute("SELECT COUNT(*) FROM structures").fetchone()[0]
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._db.execute("DELETE FROM structures")
+            self._db.commit()
+
+    def _remember(self, key, created_at, value):
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self, now):
+        # 期限切れを削除し、件数上限を超えた分は最終アクセスが古い順に削除
+        cursor = self._db.execute("DELETE FROM structures WHERE created_at < ?", (now - self.ttl,))
+        evicted = cursor.rowcount
+        count = self._db.execute("SELECT COUNT(*) FROM structures").fetchone()[0]
+        if count > self.max_disk_entries:
+            cursor = self._db.execute(
+                "DELETE FROM structures WHERE key IN "
+                "(SELECT key FROM structures ORDER BY accessed_at ASC LIMIT ?)",
+                (count - self.max_disk_entries,),
+            )
+            evicted += cursor.rowcount
+        self._stats["evictions"] += evicted
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_structure_cache():
+    """
+    プロセス共通のキャッシュを返す（環境変数 STRUCTURE_CACHE_ENABLED=false で無効化）
+    """
+    global _default_cache
+    if os.getenv("STRUCTURE_CACHE_ENABLED", "true").lower() in ("0", "false", "no"):
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = StructureCache(
+                path=os.getenv("STRUCTURE_CACHE_PATH", str(DEFAULT_CACHE_PATH)),
+                max_memory_entries=int(os.getenv("STRUCTURE_CACHE_MEMORY_ENTRIES", "256")),
+                max_disk_entries=int(os.getenv("STRUCTURE_CACHE_DISK_ENTRIES", "5000")),
+                ttl=int(os.getenv("STRUCTURE_CACHE_TTL", str(7 * 24 * 3600))),
+            )
+        return _default_cache
@@ -0,0 +1,227 @@
+"""
+LLMが返したスライド構造(JSON)の寛容なパースとスキーマ検証・補正
+"""
+import re
+import json
+
+SLIDE_TYPES = (
+    "title_slide", "content_slide", "chart_slide", "conclusion_slide",
+    "financial_slide", "implementation_slide",
+)
+DEFAULT_SLIDE_TYPE = "content_slide"
+
+_FENCE = re.compile(r"```(?:json)?\s*([\s\S]*?)(?:```|$)")
+# 途中で切れたJSONを閉じる際に試す切断位置の上限（末尾から）
+MAX_REPAIR_ATTEMPTS = 200
+
+
+class StructureParseError(ValueError):
+    pass
+
+
+def extract_json_text(text: str) -> str:
+    """
+    コードブロックや前後の説明文を除き、最初の { から末尾までを返す（末尾が切れていてもよい）
+    """
+    text = text or ""
+    match = _FENCE.search(text)
+    if match and "{" in match.group(1):
+        text = match.group(1)
+    start = text.find("{")
+    if start < 0:
+        raise StructureParseError("AIレスポンスにJSONが含まれていません。")
+    return text[start:]
+
+
+def parse_json_tolerant(text: str) -> tuple:
+    """
+    末尾カンマ・前後の説明文・max_tokens到達による途中切れを許容してパースし、(データ, 途中切れか) を返す
+    """
+    body = strip_trailing_commas(extract_json_text(text))
+    try:
+        # raw_decode は最初のJSON値の後ろに続く説明文を無視する
+        data, _ = json.JSONDecoder().raw_decode(body)
+        return data, False
+    except json.JSONDecodeError:
+        pass
+    data = _close_truncated(body)
+    if data is None:
+        raise StructureParseError("AIから有効なJSONが返りませんでした。")
+    return data, True
+
+
+def strip_trailing_commas(text: str) -> str:
+    out = []
+    in_string = escape = False
+    pending_comma = None
+    for ch in text:
+        if in_string:
+            out.append(ch)
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if pending_comma is not None:
+            if ch.isspace():
+                pending_comma.append(ch)
+                continue
+            if ch not in "}]":
+                out.extend(pending_comma)
+            pending_comma = None
+        if ch == ",":
+            pending_comma = [ch]
+            continue
+        out.append(ch)
+        if ch == '"':
+            in_string = True
+    if pending_comma is not None:
+        out.extend(pending_comma)
+    return "".join(out)
+
+
+def _close_truncated(text: str):
+    """
+    開いたままの文字列・配列・オブジェクトを閉じてパースする。末尾で失敗する場合は
+    直前の要素区切り（カンマ・閉じ括弧・配列の開始）まで切り戻して再試行する
+    """
+    stack = []
+    cuts = []
+    in_string = escape = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            if ch == "[":
+                cuts.append((i + 1, tuple(stack)))
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            cuts.append((i + 1, tuple(stack)))
+        elif ch == ",":
+            cuts.append((i, tuple(stack)))
+
+    candidates = [(text + ('"' if in_string else ""), tuple(stack))]
+    candidates += [(text[:pos], closers) for pos, closers in reversed(cuts)]
+    for body, closers in candidates[:MAX_REPAIR_ATTEMPTS]:
+        try:
+            return json.loads(body + "".join(reversed(closers)))
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def _as_text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value.strip()
+    if isinstance(value, list):
+        return "、".join(_as_text(v) for v in value if v not in (None, ""))
+    if isinstance(value, dict):
+        return "、".join(f"{k}: {_as_text(v)}" for k, v in value.items())
+    return str(value)
+
+
+def _as_points(value) -> list:
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return [text for text in (_as_text(v) for v in value) if text]
+    if isinstance(value, dict):
+        return [f"{k}: {_as_text(v)}" for k, v in value.items()]
+    text = _as_text(value)
+    return [line.strip(" ・-") for line in text.splitlines() if line.strip(" ・-")]
+
+
+def _as_data(value) -> dict:
+    if isinstance(value, dict):
+        return value
+    data = {}
+    if isinstance(value, list):
+        # [{"label": ..., "value": ...}] や [[キー, 値]] 形式も受け付ける
+        for item in value:
+            if isinstance(item, dict) and len(item) >= 2:
+                key, val = list(item.values())[:2]
+                data[_as_text(key)] = val
+            elif isinstance(item, (list, tuple)) and len(item) == 2:
+                data[_as_text(item[0])] = item[1]
+    return data
+
+
+def _as_slide_type(value) -> str:
+    # テンプレートの "title_slide|content_slide|..." がそのまま返る場合は先頭を採用
+    stype = _as_text(value).split("|")[0].strip().lower()
+    return stype if stype in SLIDE_TYPES else DEFAULT_SLIDE_TYPE
+
+
+def normalize_slide(slide, number: int = None) -> dict:
+    """
+    1枚分のスライドを必須キー（slide_number/title/type/content）と型がそろった形に補正
+    """
+    if isinstance(slide, str):
+        slide = {"title": slide}
+    elif not isinstance(slide, dict):
+        slide = {}
+    content = slide.get("content")
+    if isinstance(content, str):
+        content = {"main_message": content}
+    elif not isinstance(content, dict):
+        content = {}
+    else:
+        content = dict(content)
+    # content の外に出力された項目を取り込む
+    for key in ("main_message", "supporting_points", "data"):
+        if key not in content and key in slide:
+            content[key] = slide[key]
+
+    if number is None:
+        try:
+            number = int(slide.get("slide_number"))
+        except (TypeError, ValueError):
+            number = 1
+    normalized = {k: v for k, v in slide.items() if k not in ("main_message", "supporting_points", "data")}
+    normalized.update(
+        slide_number=number,
+        title=_as_text(slide.get("title")),
+        type=_as_slide_type(slide.get("type")),
+        content={
+            **content,
+            "main_message": _as_text(content.get("main_message")),
+            "supporting_points": _as_points(content.get("supporting_points")),
+            "data": _as_data(content.get("data")),
+        },
+    )
+    return normalized
+
+
+def normalize_structure(data, allow_empty=False) -> dict:
+    """
+    デッキ全体を {"title": str, "slides": [...]} の形に補正し、スライド番号を振り直す
+
+    スライドが1枚もない場合は StructureParseError（allow_empty=True なら空のまま返す）
+    """
+    if isinstance(data, list):
+        data = {"slides": data}
+    if not isinstance(data, dict):
+        raise StructureParseError("スライド構造の形式が不正です。")
+    slides = data.get("slides")
+    if isinstance(slides, dict):
+        slides = [slides]
+    elif not isinstance(slides, list):
+        slides = []
+    slides = [normalize_slide(slide, number) for number, slide in enumerate(slides, start=1)]
+    if not slides and not allow_empty:
+        raise StructureParseError("スライド構造にスライドが含まれていません。")
+    title = _as_text(data.get("title")) or (slides[0]["title"] if slides else "")
+    return {**data, "title": title, "slides": slides}
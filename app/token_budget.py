@@ -0,0 +1,118 @@
+"""
+プロンプトのトークン数計測と max_tokens の配分
+
+tiktoken がインストールされていれば正確に数え、なければ文字種からの概算を使う
+"""
+import os
+import re
+import logging
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+# モデルごとのコンテキスト長（入力 + 出力）
+CONTEXT_WINDOWS = {
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-3.5-turbo": 16385,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+# この文字数以下の入力は例示を省いた短いプロンプトを使う
+COMPACT_PROMPT_CHARS = int(os.getenv('COMPACT_PROMPT_CHARS', '1200'))
+
+_HEADING = re.compile(r"^\s*(【|#|■)", re.MULTILINE)
+_encodings = {}
+
+
+def count_tokens(text: str, model: str = "gpt-4") -> int:
+    if tiktoken is not None:
+        encoding = _encodings.get(model)
+        if encoding is None:
+            try:
+                encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                encoding = tiktoken.get_encoding("cl100k_base")
+            _encodings[model] = encoding
+        return len(encoding.encode(text))
+    # 概算: 英数字は約4文字で1トークン、日本語などは1文字1トークン
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars) + 1
+
+
+def context_window(model: str) -> int:
+    override = os.getenv('LLM_CONTEXT_WINDOW')
+    if override:
+        return int(override)
+    for name in sorted(CONTEXT_WINDOWS, key=len, reverse=True):
+        if model.startswith(name):
+            return CONTEXT_WINDOWS[name]
+    return DEFAULT_CONTEXT_WINDOW
+
+
+class TokenBudget:
+    """
+    入力の長さから想定スライド枚数と max_tokens を決め、コンテキスト長を超えないか判定する
+    """
+    # JSON化したスライド1枚（補足3～5項目・データ付き）の出力トークン数の目安
+    TOKENS_PER_SLIDE = 230
+    # 2段階生成の構成（タイトル・種類・メインメッセージのみ）のスライド1枚分の目安
+    OUTLINE_TOKENS_PER_SLIDE = 70
+    # タイトル・括弧などスライド以外の出力分
+    BASE_COMPLETION_TOKENS = 120
+    # 応答が長くなった場合の余裕（続きの生成で補えるため控えめ）
+    COMPLETION_MARGIN = 1.2
+    MIN_SLIDES = 3
+    MAX_SLIDES = 15
+    # トークン数の概算誤差に備えてコンテキスト長から差し引く分
+    SAFETY_TOKENS = 256
+
+    def __init__(self, model="gpt-4", min_completion=600, max_completion=4000):
+        self.model = model
+        self.window = context_window(model)
+        self.min_completion = min_completion
+        self.max_completion = max_completion
+
+    def count(self, text: str) -> int:
+        return count_tokens(text, self.model)
+
+    def expected_slides(self, content: str) -> int:
+        """
+        見出しの数と文字数から想定スライド枚数を見積もる（タイトル・まとめを含む）
+        """
+        by_headings = len(_HEADING.findall(content)) + 2
+        by_length = len(content) // 500 + 3
+        return max(self.MIN_SLIDES, min(self.MAX_SLIDES, max(by_headings, by_length)))
+
+    def completion_tokens(self, content: str) -> int:
+        slides = self.expected_slides(content)
+        tokens = int((self.BASE_COMPLETION_TOKENS + slides * self.TOKENS_PER_SLIDE) * self.COMPLETION_MARGIN)
+        return max(self.min_completion, min(self.max_completion, tokens))
+
+    def outline_tokens(self, content: str) -> int:
+        slides = self.expected_slides(content)
+        tokens = int((self.BASE_COMPLETION_TOKENS + slides * self.OUTLINE_TOKENS_PER_SLIDE) * self.COMPLETION_MARGIN)
+        return max(self.min_completion, min(self.max_completion, tokens))
+
+    def expansion_tokens(self) -> int:
+        """
+        2段階生成でスライド1枚の補足項目とデータを展開する分（構成の分は含まない）
+        """
+        return int(self.TOKENS_PER_SLIDE * self.COMPLETION_MARGIN * 1.5)
+
+    def use_compact_prompt(self, content: str) -> bool:
+        return len(content) <= COMPACT_PROMPT_CHARS
+
+    def fit_completion(self, prompt_tokens: int, wanted: int):
+        """
+        プロンプトと合わせてコンテキスト長に収まる max_tokens を返す。最低限の出力も確保できない場合は None
+        """
+        available = self.window - prompt_tokens - self.SAFETY_TOKENS
+        if available < self.min_completion:
+            return None
+        return min(wanted, available)
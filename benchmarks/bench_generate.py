@@ -0,0 +1,101 @@
+"""
+/api/generate のエンドツーエンドベンチマーク（スタブLLMサーバーを使用、OpenAI APIは呼ばない）
+
+各同時実行数でリクエストを投げ、受付からジョブ完了までのレイテンシとスループットを計測する。
+
+使用例:
+    python -m benchmarks.bench_generate --concurrency 1 4 16 --requests 32 --latency 0.5
+    python -m benchmarks.bench_generate --concurrency 1 --slides 15 --mode outline
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import tempfile
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.report import summarize, write_report
+from benchmarks.stub_openai import spawn_stub_server
+
+SAMPLE_CONTENT = "中小企業向けAI経理システムの事業計画。市場規模500億円、年成長率8%。"
+
+
+def _request(url, payload=None):
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=300) as response:
+        return json.loads(response.read())
+
+
+def run_one(base_url: str, index: int, poll_interval: float) -> float:
+    start = time.perf_counter()
+    # キャッシュを避けるため入力を毎回変える
+    accepted = _request(f"{base_url}/api/generate", {"content": f"{SAMPLE_CONTENT} #{index}", "no_cache": True})
+    while True:
+        job = _request(f"{base_url}{accepted['status_url']}")
+        if job["stage"] == "done":
+            return time.perf_counter() - start
+        if job["stage"] == "failed":
+            raise RuntimeError(job.get("message"))
+        time.sleep(poll_interval)
+
+
+def start_app_server():
+    from werkzeug.serving import make_server
+    from app import create_app
+    server = make_server("127.0.0.1", 0, create_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-app", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="/api/generate のエンドツーエンドベンチマーク")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=32, help="同時実行数ごとのリクエスト数")
+    parser.add_argument("--latency", type=float, default=0.5, help="スタブLLMの最初のトークンまでの遅延（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=400.0)
+    parser.add_argument("--slides", type=int, default=8)
+    parser.add_argument("--mode", choices=["single", "outline"], default="single", help="生成方式（GENERATION_MODE）")
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    parser.add_argument("--output", help="レポートの出力先（既定: benchmarks/results/）")
+    args = parser.parse_args(argv)
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    stub, stub_url = spawn_stub_server(args.latency, args.tokens_per_second, slide_count=args.slides)
+    storage_dir = tempfile.TemporaryDirectory()
+    os.environ.update({
+        "OPENAI_API_KEY": "stub",
+        "OPENAI_BASE_URL": stub_url,
+        "STRUCTURE_CACHE_ENABLED": "false",
+        "STORAGE_ROOT": storage_dir.name,
+        "JOB_WORKERS": str(max(args.concurrency)),
+        "GENERATION_MODE": args.mode,
+    })
+    server, base_url = start_app_server()
+
+    results = {}
+    try:
+        for concurrency in args.concurrency:
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                latencies = list(executor.map(
+                    lambda i: run_one(base_url, i, args.poll_interval), range(args.requests)
+                ))
+            elapsed = time.perf_counter() - start
+            result = summarize(latencies)
+            result["throughput_rps"] = args.requests / elapsed
+            results[f"concurrency/{concurrency}"] = result
+            print(f"同時実行数 {concurrency:3d}: {result['throughput_rps']:.2f} req/s "
+                  f"p50={result['p50']:.2f}s p95={result['p95']:.2f}s p99={result['p99']:.2f}s")
+    finally:
+        server.shutdown()
+        stub.terminate()
+        storage_dir.cleanup()
+    name = "generate" if args.mode == "single" else f"generate_{args.mode}"
+    print(f"レポート: {write_report(name, results, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+PPTXCreator のマイクロベンチマーク（スライド種別 × デッキ枚数ごとの時間とメモリピーク）
+
+使用例:
+    python -m benchmarks.bench_render --sizes 1 10 50 --repeat 5
+    python -m benchmarks.bench_render --sizes 50 200 --stream   # ストリーミング出力（StreamingPPTXWriter）
+    python -m benchmarks.bench_render --sizes 10 --data-items 12  # data の多いデッキ（表・グラフ）
+"""
+import io
+import gc
+import time
+import argparse
+import tracemalloc
+from app.pptx_creator import PPTXCreator
+from app.pptx_stream import StreamingPPTXWriter
+from benchmarks.report import summarize, write_report
+from benchmarks.stub_openai import sample_structure
+
+SLIDE_TYPES = ("title_slide", "content_slide", "financial_slide", "implementation_slide", "chart_slide")
+
+
+def deck_of(slide_type: str, size: int, data_items: int = None) -> dict:
+    template = next(s for s in sample_structure(8)["slides"] if s["type"] != "title_slide")
+    if data_items is not None:
+        data = {f"指標{i + 1}": f"{(i + 1) * 120:,}万円" for i in range(data_items)}
+        template = dict(template, content={**template["content"], "data": data})
+    slides = [dict(template, type=slide_type, slide_number=i + 1) for i in range(size)]
+    return {"title": "ベンチマーク", "slides": slides}
+
+
+def stream_bytes(writer, structure: dict) -> bytes:
+    buffer = io.BytesIO()
+    writer.write(iter(structure["slides"]), buffer, structure["title"])
+    return buffer.getvalue()
+
+
+def measure(render, structure, repeat: int) -> dict:
+    render(structure)  # ウォームアップ（スケルトン構築を除外）
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data = render(structure)
+        timings.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    render(structure)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    result = summarize(timings)
+    result.update({"peak_bytes": peak, "file_bytes": len(data)})
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PPTXレンダリングのベンチマーク")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--data-items", type=int, help="各スライドの data の項目数（既定: サンプルのまま）")
+    parser.add_argument("--stream", action="store_true", help="1枚ずつZIPへ書き出すストリーミング出力を計測")
+    parser.add_argument("--output", help="レポートの出力先（既定: benchmarks/results/）")
+    args = parser.parse_args(argv)
+
+    creator = PPTXCreator()
+    if args.stream:
+        writer = StreamingPPTXWriter(creator)
+        render = lambda structure: stream_bytes(writer, structure)
+    else:
+        render = creator.render_bytes
+    results = {}
+    for slide_type in SLIDE_TYPES:
+        for size in args.sizes:
+            key = f"{slide_type}/{size}"
+            results[key] = measure(render, deck_of(slide_type, size, args.data_items), args.repeat)
+            r = results[key]
+            print(f"{key:32s} p50={r['p50'] * 1000:8.1f}ms p95={r['p95'] * 1000:8.1f}ms "
+                  f"peak={r['peak_bytes'] / 1024 / 1024:6.1f}MB size={r['file_bytes'] / 1024:7.1f}KB")
+    print(f"レポート: {write_report('render_stream' if args.stream else 'render', results, args.output)}")
+
+
+if __name__ == "__main__":
+    main()
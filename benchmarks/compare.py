@@ -0,0 +1,51 @@
+"""
+2つのベンチマークレポートを比較し、しきい値を超える劣化があれば終了コード1を返す
+
+使用例:
+    python -m benchmarks.compare benchmarks/results/render_abc123.json benchmarks/results/render_def456.json
+"""
+import sys
+import json
+import argparse
+
+# 値が大きいほど良い指標
+HIGHER_IS_BETTER = {"throughput_rps"}
+COMPARED_METRICS = ("p50", "p95", "p99", "peak_bytes", "file_bytes", "throughput_rps")
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    regressions = []
+    for key, base in baseline["results"].items():
+        cur = current["results"].get(key)
+        if cur is None:
+            continue
+        for metric in COMPARED_METRICS:
+            if metric not in base or metric not in cur or not base[metric]:
+                continue
+            change = (cur[metric] - base[metric]) / base[metric]
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            mark = "劣化" if worse > threshold else ""
+            print(f"{key:32s} {metric:14s} {base[metric]:14.4f} -> {cur[metric]:14.4f} ({change:+.1%}) {mark}")
+            if worse > threshold:
+                regressions.append((key, metric, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ベンチマークレポートの比較")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.10, help="劣化とみなす変化率（既定10%%）")
+    args = parser.parse_args(argv)
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        current = json.load(f)
+    print(f"基準: {baseline['commit']}  比較: {current['commit']}")
+    regressions = compare(baseline, current, args.threshold)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
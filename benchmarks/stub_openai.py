@@ -0,0 +1,215 @@
+"""
+OpenAI互換のスタブサーバー（ベンチマーク・オフライン検証用）
+
+/v1/chat/completions に対して、設定した遅延とトークン速度で定型のJSON応答を返す。
+stream=true の場合はSSEでチャンクを送信する。2段階生成（GENERATION_MODE=outline）の構成・スライド展開の
+リクエストには、それぞれ構成のみ・1枚分の補足項目とデータのみを返す。
+
+使用例:
+    python -m benchmarks.stub_openai --port 8001 --latency 0.5 --tokens-per-second 200
+"""
+import json
+import time
+import socket
+import argparse
+import threading
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 1トークンあたりの文字数（日本語混在のおおよその目安）
+CHARS_PER_TOKEN = 2
+# 2段階生成のプロンプトの見出し（app.slide_generator の _build_outline_prompt / _build_expand_prompt）
+OUTLINE_MARKER = "【構成の出力ルール】"
+EXPANSION_MARKER = "【展開するスライド】"
+
+
+def sample_structure(slide_count=8) -> dict:
+    types = ["content_slide", "financial_slide", "implementation_slide"]
+    slides = [{
+        "slide_number": 1,
+        "title": "AI経理システム導入による業務効率化",
+        "type": "title_slide",
+        "content": {"main_message": "経理業務時間を70%削減", "supporting_points": [], "data": {}},
+    }]
+    for i in range(2, slide_count + 1):
+        slides.append({
+            "slide_number": i,
+            "title": f"論点{i}: 導入効果の検証",
+            "type": types[i % len(types)],
+            "content": {
+                "main_message": f"施策{i}により年間コストを{i * 10}%削減",
+                "supporting_points": [
+                    "年間1,200時間の作業削減（従業員50名規模）",
+                    "人件費コストを年間300万円削減",
+                    "入力ミス率を従来比80%低減",
+                ],
+                "data": {"作業削減時間": 1200, "コスト削減額": "300万円", "ミス率低減": "80%"},
+            },
+        })
+    return {"title": "AI経理システム導入による業務効率化", "slides": slides}
+
+
+class StubConfig:
+    def __init__(self, latency=0.5, tokens_per_second=200.0, response_text=None, slide_count=8):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        structure = sample_structure(slide_count)
+        self.response_text = response_text or json.dumps(structure, ensure_ascii=False)
+        self.outline_text = json.dumps({**structure, "slides": [
+            {
+                "slide_number": slide["slide_number"], "title": slide["title"], "type": slide["type"],
+                "main_message": slide["content"]["main_message"],
+            }
+            for slide in structure["slides"]
+        ]}, ensure_ascii=False)
+        expanded = structure["slides"][-1]["content"]
+        self.expansion_text = json.dumps(
+            {"supporting_points": expanded["supporting_points"], "data": expanded["data"]}, ensure_ascii=False
+        )
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def count_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def response_for(self, body: dict) -> str:
+        messages = body.get("messages") or [{}]
+        prompt = messages[-1].get("content") or ""
+        if EXPANSION_MARKER in prompt:
+            return self.expansion_text
+        if OUTLINE_MARKER in prompt:
+            return self.outline_text
+        return self.response_text
+
+
+def _make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.send_error(404)
+                return
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            config.count_request()
+            text = config.response_for(body)
+            tokens = max(1, len(text) // CHARS_PER_TOKEN)
+            time.sleep(config.latency)
+            if body.get("stream"):
+                self._stream(body, text)
+            else:
+                time.sleep(tokens / config.tokens_per_second)
+                self._json(body, text, tokens)
+
+        def _json(self, body, text, tokens):
+            payload = json.dumps({
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": tokens, "total_tokens": tokens},
+            }, ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _stream(self, body, text):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            interval = 1 / config.tokens_per_second
+            for i in range(0, len(text), CHARS_PER_TOKEN):
+                self._chunk(body, {"content": text[i:i + CHARS_PER_TOKEN]}, None)
+                time.sleep(interval)
+            self._chunk(body, {}, "stop")
+            self._write(b"data: [DONE]\n\n")
+            self._write(b"")
+
+        def _chunk(self, body, delta, finish_reason):
+            event = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "stub"),
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            self._write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+        def _write(self, data: bytes):
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+def start_stub_server(config=None, host="127.0.0.1", port=0):
+    """
+    スタブサーバーをバックグラウンドスレッドで起動し、(server, base_url) を返す
+    """
+    config = config or StubConfig()
+    server = ThreadingHTTPServer((host, port), _make_handler(config))
+    server.daemon_threads = True
+    server.config = config
+    threading.Thread(target=server.serve_forever, name="stub-openai", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def _serve(host, port, latency, tokens_per_second, response_text, slide_count):
+    config = StubConfig(latency, tokens_per_second, response_text, slide_count)
+    ThreadingHTTPServer((host, port), _make_handler(config)).serve_forever()
+
+
+def spawn_stub_server(latency=0.5, tokens_per_second=200.0, response_text=None, slide_count=8, host="127.0.0.1"):
+    """
+    スタブサーバーを別プロセスで起動し、(process, base_url) を返す（計測対象とGILを共有しない）
+    """
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        port = sock.getsockname()[1]
+    process = multiprocessing.Process(
+        target=_serve,
+        args=(host, port, latency, tokens_per_second, response_text, slide_count),
+        daemon=True,
+    )
+    process.start()
+    deadline = time.time() + 10
+    while time.time() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return process, f"http://{host}:{port}/v1"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OpenAI互換のスタブサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.5, help="最初のトークンまでの遅延（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--slides", type=int, default=8, help="定型応答のスライド枚数")
+    parser.add_argument("--response-file", help="応答として返すテキスト（JSON）ファイル")
+    args = parser.parse_args(argv)
+
+    response_text = None
+    if args.response_file:
+        with open(args.response_file, encoding="utf-8") as f:
+            response_text = f.read()
+    config = StubConfig(args.latency, args.tokens_per_second, response_text, args.slides)
+    server = ThreadingHTTPServer((args.host, args.port), _make_handler(config))
+    print(f"スタブサーバー起動: http://{args.host}:{args.port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 // 定数
 const MIN_CHARS = 100;
-const MAX_CHARS = 8000;
+const MAX_CHARS = 60000; // 長文はサーバー側で分割生成
 const TIMEOUT_MS = 300000; // 5分
+const POLL_INTERVAL_MS = 2000;
 const STORAGE_KEY = 'bcg_slide_content';
 
 // DOM要素
@@ -12,9 +13,14 @@ const progressBarInner = document.getElementById('progress-bar-inner');
 const statusDiv = document.getElementById('status');
 const downloadLinkDiv = document.getElementById('download-link');
 const downloadA = document.getElementById('download-a');
+const previewOnlyCheckbox = document.getElementById('preview-only');
+const slidePreview = document.getElementById('slide-preview');
 const charCounter = document.createElement('div');
 charCounter.className = 'char-counter';
 contentTextarea.parentNode.insertBefore(charCounter, contentTextarea.nextSibling);
+const slideOutline = document.createElement('ol');
+slideOutline.className = 'slide-outline';
+statusDiv.parentNode.insertBefore(slideOutline, statusDiv.nextSibling);
 
 // 自動保存機能
 function saveToLocalStorage() {
@@ -75,6 +81,28 @@ function showDownload(url, filename) {
     downloadLinkDiv.style.display = 'block';
 }
 
+function addOutlineSlide(slide) {
+    const item = document.createElement('li');
+    item.textContent = slide.title || '（無題のスライド）';
+    slideOutline.appendChild(item);
+}
+
+function clearOutline() {
+    slideOutline.innerHTML = '';
+}
+
+// スライド構造のプレビュー（PPTXの描画を待たずに表示）
+async function showPreview(previewUrl) {
+    const response = await fetch(previewUrl);
+    if (response.ok) {
+        slidePreview.innerHTML = await response.text();
+    }
+}
+
+function clearPreview() {
+    slidePreview.innerHTML = '';
+}
+
 function hideDownload() {
     downloadA.href = '#';
     downloadLinkDiv.style.display = 'none';
@@ -98,15 +126,91 @@ function validateInput() {
     return true;
 }
 
+// ジョブ段階ごとの進捗率と表示メッセージ
+const JOB_STAGES = {
+    queued: { percent: 10, message: '順番待ちです…' },
+    llm: { percent: 40, message: 'AIがスライド構成を生成中です…' },
+    rendering: { percent: 80, message: 'PowerPointファイルを作成中です…' },
+    done: { percent: 100, message: 'スライド生成が完了しました！' }
+};
+
+function sleep(ms) {
+    return new Promise(resolve => setTimeout(resolve, ms));
+}
+
+function showJobProgress(job) {
+    const stage = JOB_STAGES[job.stage];
+    if (!stage) return;
+    showProgress(job.progress || stage.percent);
+    if (job.stage !== 'done') showStatus(stage.message, '');
+}
+
+// Server-Sent Eventsでジョブの進捗と確定したスライドを受信
+function streamJob(eventsUrl, previewUrl, signal) {
+    return new Promise((resolve, reject) => {
+        const source = new EventSource(eventsUrl);
+        const close = () => source.close();
+        signal.addEventListener('abort', () => {
+            close();
+            reject(new DOMException('Aborted', 'AbortError'));
+        });
+        source.addEventListener('slide', (e) => {
+            const data = JSON.parse(e.data);
+            addOutlineSlide(data.slide);
+            showStatus(`${data.index + 1}枚目のスライド構成を受信しました…`, '');
+        });
+        source.addEventListener('progress', (e) => {
+            const job = JSON.parse(e.data);
+            showJobProgress(job);
+            // 構成が確定してPPTXの描画に入った時点でプレビューを表示
+            if (job.stage === 'rendering') showPreview(previewUrl).catch(() => {});
+        });
+        source.addEventListener('done', (e) => {
+            close();
+            resolve(JSON.parse(e.data));
+        });
+        source.addEventListener('failed', (e) => {
+            close();
+            reject(new Error(JSON.parse(e.data).message || 'スライド生成に失敗しました。'));
+        });
+        source.onerror = () => {
+            // ブラウザは自動再接続するため、接続が閉じられた場合のみ失敗扱い
+            if (source.readyState === EventSource.CLOSED) {
+                reject(new TypeError('イベントストリームが切断されました。'));
+            }
+        };
+    });
+}
+
+// ジョブ完了までステータスをポーリング
+async function waitForJob(statusUrl, signal) {
+    while (true) {
+        const response = await fetch(statusUrl, { signal });
+        const job = await response.json();
+        if (!response.ok) {
+            throw new Error(job.message || 'ジョブの状態を取得できませんでした。');
+        }
+        if (job.stage === 'failed') {
+            throw new Error(job.message || 'スライド生成に失敗しました。');
+        }
+        showJobProgress(job);
+        if (job.stage === 'done') return job;
+        await sleep(POLL_INTERVAL_MS);
+    }
+}
+
 // スライド生成処理
 async function generateSlide() {
     if (!validateInput()) return;
 
     const content = contentTextarea.value.trim();
+    const previewOnly = previewOnlyCheckbox.checked;
     generateBtn.disabled = true;
     hideDownload();
-    showProgress(30);
-    showStatus('AIがスライド構成を生成中です…', '');
+    clearOutline();
+    clearPreview();
+    showProgress(5);
+    showStatus('リクエストを送信中です…', '');
 
     try {
         const controller = new AbortController();
@@ -115,26 +219,30 @@ async function generateSlide() {
         const response = await fetch('/api/generate', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ content }),
+            body: JSON.stringify(previewOnly ? { content, delivery: 'preview' } : { content }),
             signal: controller.signal
         });
 
-        clearTimeout(timeoutId);
-        showProgress(70);
-
         if (!response.ok) {
             const error = await response.json();
+            clearTimeout(timeoutId);
             throw new Error(error.message || 'スライド生成に失敗しました。');
         }
 
-        const result = await response.json();
-        if (result.status === 'success') {
-            showProgress(100);
-            showStatus('スライド生成が完了しました！', 'success');
+        const accepted = await response.json();
+        const result = window.EventSource
+            ? await streamJob(accepted.events_url, accepted.preview_url, controller.signal)
+            : await waitForJob(accepted.status_url, controller.signal);
+        clearTimeout(timeoutId);
+
+        await showPreview(accepted.preview_url);
+        if (previewOnly) {
+            // 同じ内容で再度生成すると、キャッシュ済みの構成からPPTXだけを作成する
+            showStatus('プレビューを表示しました。チェックを外して再度生成するとPowerPointファイルを作成します。', 'success');
+        } else {
+            showStatus(JOB_STAGES.done.message, 'success');
             showDownload(result.download_url, result.filename);
             localStorage.removeItem(STORAGE_KEY); // 成功時に保存データをクリア
-        } else {
-            throw new Error(result.message || 'スライド生成に失敗しました。');
         }
     } catch (error) {
         hideDownload();
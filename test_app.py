@@ -6,7 +6,12 @@ import psutil
 import time
 from pathlib import Path
 from datetime import datetime
-from app.slide_generator import SlideGenerator
+from unittest import mock
+from app import create_app
+import tempfile
+from app.slide_generator import SlideGenerator, SlideStreamParser, merge_structures, split_sections
+from app.structure_cache import StructureCache, make_cache_key
+from app.structure_schema import normalize_structure, parse_json_tolerant
 from app.pptx_creator import PPTXCreator
 
 # ログ設定
@@ -138,5 +143,1134 @@ class TestBCGSlideGenerator(unittest.TestCase):
         memory_usage = psutil.Process().memory_info().rss / 1024 / 1024
         self.assertLess(memory_usage, 500, "メモリ使用量が500MBを超えています")
 
+SAMPLE_STRUCTURE = {
+    'title': 'テスト',
+    'slides': [
+        {'slide_number': 1, 'title': 'テスト', 'type': 'title_slide', 'content': {'main_message': 'サブタイトル'}},
+        {'slide_number': 2, 'title': '効果', 'type': 'content_slide', 'content': {
+            'main_message': '業務時間を70%削減',
+            'supporting_points': ['年間1,200時間の削減', 'コスト300万円削減'],
+            'data': {'削減時間': 1200, '満足度': '92%'}}},
+        {'slide_number': 3, 'title': '財務', 'type': 'financial_slide', 'content': {
+            'main_message': '3年で黒字化', 'data': {'売上': '1.2億円'}}},
+        {'slide_number': 4, 'title': '計画', 'type': 'implementation_slide', 'content': {
+            'main_message': '来年4月開始', 'supporting_points': ['開発6ヶ月', 'β版3ヶ月']}},
+    ]
+}
+
+
+def use_temp_storage(test):
+    """
+    生成デッキの保存先（STORAGE_ROOT）をテスト終了時に削除される一時ディレクトリにする
+    """
+    from app import storage
+    tmpdir = tempfile.TemporaryDirectory()
+    test.addCleanup(tmpdir.cleanup)
+    for patcher in (mock.patch.dict(os.environ, {'STORAGE_ROOT': tmpdir.name}),
+                    mock.patch.object(storage, '_default_storage', None)):
+        patcher.start()
+        test.addCleanup(patcher.stop)
+    # 一時ディレクトリの削除前にクリーンアップスレッドを止める
+    test.addCleanup(lambda: storage._default_storage and storage._default_storage.stop_janitor())
+    return tmpdir.name
+
+
+class TestGenerationJobs(unittest.TestCase):
+    """非同期ジョブAPIのテスト（OpenAI APIは呼び出さない）"""
+
+    def setUp(self):
+        self.storage_root = use_temp_storage(self)
+        self.app = create_app()
+        self.client = self.app.test_client()
+
+    def _wait_for_job(self, status_url, timeout=5):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            job = self.client.get(status_url).get_json()
+            if job['stage'] in ('done', 'failed'):
+                return job
+            time.sleep(0.05)
+        self.fail("ジョブが完了しませんでした")
+
+    def test_generate_returns_job(self):
+        """202で受け付け、ジョブが完了まで進むこと"""
+        structure = {'title': 'テスト', 'slides': []}
+        with mock.patch('app.main.generate_slide_structure', return_value=structure):
+            response = self.client.post('/api/generate', json={'content': 'テスト入力'})
+            self.assertEqual(response.status_code, 202)
+            body = response.get_json()
+            self.assertEqual(response.headers['Location'], body['status_url'])
+            job = self._wait_for_job(body['status_url'])
+        self.assertEqual(job['stage'], 'done')
+        self.assertTrue(job['download_url'].endswith(job['filename']))
+        self.assertEqual(self.client.get(job['download_url']).status_code, 200)
+
+    def test_failed_generation(self):
+        """LLMエラーはfailed段階として報告されること"""
+        error = {'status': 'error', 'message': 'AI処理エラー'}
+        with mock.patch('app.main.generate_slide_structure', return_value=error):
+            body = self.client.post('/api/generate', json={'content': 'テスト入力'}).get_json()
+            job = self._wait_for_job(body['status_url'])
+        self.assertEqual(job['stage'], 'failed')
+        self.assertEqual(job['message'], 'AI処理エラー')
+
+    def test_memory_delivery(self):
+        """delivery=memory ではディスクに書かずにダウンロードできること"""
+        with mock.patch('app.main.generate_slide_structure', return_value=SAMPLE_STRUCTURE):
+            body = self.client.post('/api/generate', json={'content': 'テスト入力', 'delivery': 'memory'}).get_json()
+            job = self._wait_for_job(body['status_url'])
+        self.assertEqual(job['stage'], 'done')
+        self.assertEqual(list(Path(self.storage_root).rglob(job['filename'])), [])
+        response = self.client.get(job['download_url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data.startswith(b'PK'))
+
+    def test_oversized_memory_delivery(self):
+        """メモリ保持の上限を超えるデッキはディスクに保存され、ダウンロードできること"""
+        from app.memory_store import InMemoryDeckStore, get_memory_store
+        store = InMemoryDeckStore(max_bytes=100)
+        self.assertFalse(store.put("large.pptx", b"x" * 101))
+        self.assertIsNone(store.get("large.pptx"))
+
+        get_memory_store(self.app).max_bytes = 1000
+        with mock.patch('app.main.generate_slide_structure', return_value=SAMPLE_STRUCTURE):
+            body = self.client.post('/api/generate', json={'content': 'テスト入力', 'delivery': 'memory'}).get_json()
+            job = self._wait_for_job(body['status_url'])
+        self.assertEqual(job['stage'], 'done')
+        self.assertNotIn(job['filename'], get_memory_store(self.app))
+        response = self.client.get(job['download_url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data.startswith(b'PK'))
+
+    def test_inline_delivery(self):
+        """delivery=inline では生成レスポンスの本文としてPPTXが返ること"""
+        with mock.patch('app.main.generate_slide_structure', return_value=SAMPLE_STRUCTURE):
+            response = self.client.post('/api/generate', json={'content': 'テスト入力', 'delivery': 'inline'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('attachment', response.headers['Content-Disposition'])
+        self.assertTrue(response.data.startswith(b'PK'))
+
+    def test_patch_deck_rerenders_changed_slides(self):
+        """パッチしたスライドだけが描き直され、他のスライドは再利用されること"""
+        import io
+        from pptx import Presentation
+        with mock.patch('app.main.generate_slide_structure', return_value=SAMPLE_STRUCTURE):
+            body = self.client.post('/api/generate', json={'content': 'テスト入力', 'delivery': 'memory'}).get_json()
+            original = self._wait_for_job(body['status_url'])
+
+        regenerated = {'title': '再生成', 'type': 'content_slide', 'content': {'main_message': '新しい主張'}}
+        with mock.patch('app.main.SlideGenerator') as generator:
+            generator.return_value.regenerate_slide.return_value = regenerated
+            response = self.client.patch(f"/api/decks/{original['deck_id']}", json={'patches': [
+                {'slide_number': 2, 'title': '効果（改訂）'},
+                {'slide_number': 4, 'regenerate': True, 'instruction': '数値を追加'},
+            ]})
+            self.assertEqual(response.status_code, 202)
+            job = self._wait_for_job(response.get_json()['status_url'])
+        self.assertEqual(job['stage'], 'done')
+        self.assertNotEqual(job['deck_id'], original['deck_id'])
+
+        def slide_texts(download_url):
+            prs = Presentation(io.BytesIO(self.client.get(download_url).data))
+            return [[sh.text_frame.text for sh in s.shapes if sh.has_text_frame] for s in prs.slides]
+
+        before = slide_texts(original['download_url'])
+        after = slide_texts(job['download_url'])
+        self.assertEqual(len(after), len(before))
+        self.assertEqual(after[0], before[0])
+        self.assertEqual(after[2], before[2])
+        self.assertIn('効果（改訂）', after[1])
+        self.assertIn('再生成', after[3])
+
+    def test_metrics_endpoint(self):
+        """段階ごとの計測値がPrometheus形式で出力されること"""
+        with mock.patch('app.main.generate_slide_structure', return_value=SAMPLE_STRUCTURE):
+            body = self.client.post('/api/generate', json={'content': 'テスト入力'}).get_json()
+            job = self._wait_for_job(body['status_url'])
+        self.client.get(job['download_url'])
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        text = response.get_data(as_text=True)
+        self.assertIn('# TYPE slide_stage_seconds histogram', text)
+        for label in ('slide_type="title_slide"', 'stage="save"', 'stage="download"'):
+            self.assertIn(label, text)
+
+    def test_conditional_and_range_download(self):
+        """ETagによる304とRangeによる206を返すこと（ディスク・メモリ保持とも）"""
+        for delivery in ('file', 'memory'):
+            with mock.patch('app.main.generate_slide_structure', return_value=SAMPLE_STRUCTURE):
+                body = self.client.post('/api/generate', json={'content': 'テスト入力', 'delivery': delivery}).get_json()
+                job = self._wait_for_job(body['status_url'])
+            response = self.client.get(job['download_url'])
+            etag = response.headers['ETag']
+            self.assertIn('Last-Modified', response.headers)
+            response = self.client.get(job['download_url'], headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+            response = self.client.get(job['download_url'], headers={'Range': 'bytes=0-1'})
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response.data, b'PK')
+
+    def test_offloaded_download(self):
+        """DOWNLOAD_OFFLOAD=x-accel では本文を返さずX-Accel-Redirectを返すこと"""
+        self.app.config['DOWNLOAD_OFFLOAD'] = 'x-accel'
+        with mock.patch('app.main.generate_slide_structure', return_value=SAMPLE_STRUCTURE):
+            body = self.client.post('/api/generate', json={'content': 'テスト入力'}).get_json()
+            job = self._wait_for_job(body['status_url'])
+        response = self.client.get(job['download_url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'')
+        self.assertTrue(response.headers['X-Accel-Redirect'].startswith('/protected-decks/'))
+        self.assertTrue(response.headers['X-Accel-Redirect'].endswith('/' + job['filename']))
+        self.assertIn(job['filename'], response.headers['Content-Disposition'])
+        response = self.client.get(job['download_url'], headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn('X-Accel-Redirect', response.headers)
+
+    def test_preview_delivery(self):
+        """delivery=preview ではPPTXを作らず、スライド構造のプレビューを返すこと"""
+        with mock.patch('app.main.render_presentation_bytes') as render, \
+                mock.patch('app.main.generate_slide_structure', return_value=SAMPLE_STRUCTURE):
+            body = self.client.post('/api/generate', json={'content': 'テスト入力', 'delivery': 'preview'}).get_json()
+            job = self._wait_for_job(body['status_url'])
+        render.assert_not_called()
+        self.assertEqual(job['stage'], 'done')
+        self.assertNotIn('download_url', job)
+        response = self.client.get(job['preview_url'])
+        self.assertEqual(response.mimetype, 'text/html')
+        html = response.get_data(as_text=True)
+        self.assertEqual(html.count('<svg'), len(SAMPLE_STRUCTURE['slides']))
+        self.assertIn('効果', html)
+
+    def test_preview_structure(self):
+        """POSTしたスライド構造がPPTXと同じ配色・フォントサイズで描画されること"""
+        structure = {'title': 'デッキ', 'slides': [
+            {'title': '財務<計画>', 'type': 'financial_slide', 'content': {'data': {'売上': '1.2億円'}}},
+        ]}
+        response = self.client.post('/api/preview', json=structure)
+        self.assertEqual(response.status_code, 200)
+        html = response.get_data(as_text=True)
+        self.assertIn('財務&lt;計画&gt;', html)
+        self.assertIn(f'fill="#{PPTXCreator.ACCENT_ORANGE}"', html)
+        self.assertIn(f'font-size:{PPTXCreator.FONT_HEADER[1]}px', html)
+        self.assertIn('売上: 1.2億円', html)
+        self.assertEqual(self.client.post('/api/preview', data='x', content_type='application/json').status_code, 400)
+
+    def test_no_cache_flag(self):
+        """no_cache は真偽値のみ受け付け、"false" でキャッシュを参照すること"""
+        with mock.patch('app.main.generate_slide_structure', return_value=SAMPLE_STRUCTURE) as generate:
+            body = self.client.post('/api/generate', json={'content': 'テスト入力', 'no_cache': 'false'}).get_json()
+            self._wait_for_job(body['status_url'])
+        self.assertTrue(generate.call_args.kwargs['use_cache'])
+        response = self.client.post('/api/generate', json={'content': 'テスト入力', 'no_cache': 'no'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_patch_unknown_deck(self):
+        response = self.client.patch('/api/decks/' + '0' * 32, json={'patches': [{'slide_number': 1}]})
+        self.assertEqual(response.status_code, 404)
+
+    def test_unknown_job(self):
+        self.assertEqual(self.client.get('/api/jobs/unknown').status_code, 404)
+
+    def test_job_events_stream_slides(self):
+        """確定したスライドと完了がSSEで配信されること"""
+        slides = [{'title': 'A', 'content': {}}, {'title': 'B', 'content': {}}]
+
+        def fake_generate(content, on_slide=None, on_progress=None, **kwargs):
+            for slide in slides:
+                on_slide(slide)
+            return {'title': 'テスト', 'slides': slides}
+
+        with mock.patch('app.main.generate_slide_structure', side_effect=fake_generate):
+            body = self.client.post('/api/generate', json={'content': 'テスト入力'}).get_json()
+            response = self.client.get(body['events_url'])
+            text = response.get_data(as_text=True)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        self.assertEqual(text.count('event: slide'), 2)
+        self.assertIn('event: done', text)
+
+
+class TestAdmission(unittest.TestCase):
+    """生成・部分再生成APIの受け付け制御のテスト"""
+
+    def setUp(self):
+        use_temp_storage(self)
+
+    def test_fair_share_and_round_robin(self):
+        """待ち行列はクライアントごとに公平に割り当て、超過分は429/503、空いた枠は順番に開始すること"""
+        from app.admission import AdmissionController, AdmissionRejected
+        controller = AdmissionController(max_concurrent=1, max_queue=4)
+        started = []
+        submit = lambda client, name: controller.submit(client, lambda ticket: started.append((name, ticket)))
+        submit('a', 'a1')
+        for client, name in (('a', 'a2'), ('a', 'a3'), ('b', 'b1')):
+            submit(client, name)
+        with self.assertRaises(AdmissionRejected) as rejected:
+            submit('a', 'a4')
+        self.assertEqual(rejected.exception.status, 429)
+        submit('c', 'c1')
+        with self.assertRaises(AdmissionRejected) as rejected:
+            submit('d', 'd1')
+        self.assertEqual(rejected.exception.status, 503)
+        self.assertGreaterEqual(rejected.exception.retry_after, 1)
+        for _ in range(4):
+            controller.release(started[-1][1])
+        self.assertEqual([name for name, _ in started], ['a1', 'a2', 'b1', 'c1', 'a3'])
+
+    def test_disconnected_job_is_cancelled(self):
+        """SSE接続が切れた順番待ちのジョブは開始せずに中止すること"""
+        from app.admission import AdmissionController
+        controller = AdmissionController(max_concurrent=1)
+        running = controller.submit('a', lambda ticket: None)
+        cancelled = []
+        start = mock.Mock()
+        controller.submit('b', start, on_cancel=cancelled.append, job_id='job')
+        controller.attach('job')
+        controller.detach('job')
+        controller.release(running)
+        self.assertEqual(cancelled, ['disconnect'])
+        start.assert_not_called()
+
+    def test_generate_rejected_with_retry_after(self):
+        import threading
+        app = create_app()
+        admission = app.extensions['admission']
+        admission.max_concurrent, admission.max_queue = 1, 0
+        release = threading.Event()
+        client = app.test_client()
+        with mock.patch('app.main.generate_slide_structure', side_effect=lambda *a, **k: release.wait(5) and SAMPLE_STRUCTURE):
+            accepted = client.post('/api/generate', json={'content': 'テスト入力'})
+            self.assertEqual(accepted.status_code, 202)
+            response = client.post('/api/generate', json={'content': 'テスト入力'})
+            release.set()
+            # 一時保存先の削除前に受け付けたジョブの完了を待つ
+            deadline = time.time() + 5
+            while client.get(accepted.headers['Location']).get_json()['stage'] not in ('done', 'failed') and time.time() < deadline:
+                time.sleep(0.05)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(int(response.headers['Retry-After']), response.get_json()['retry_after'])
+
+    def test_patch_deck_goes_through_admission(self):
+        """デッキの部分再生成も新規生成と同じ受け付け制御を通ること"""
+        app = create_app()
+        client = app.test_client()
+
+        def wait_for(status_url):
+            deadline = time.time() + 5
+            while time.time() < deadline:
+                job = client.get(status_url).get_json()
+                if job['stage'] in ('done', 'failed'):
+                    return job
+                time.sleep(0.05)
+            self.fail("ジョブが完了しませんでした")
+
+        with mock.patch('app.main.generate_slide_structure', return_value=SAMPLE_STRUCTURE):
+            body = client.post('/api/generate', json={'content': 'テスト入力'}).get_json()
+            deck_id = wait_for(body['status_url'])['deck_id']
+        admission = app.extensions['admission']
+        admission.max_concurrent, admission.max_queue = 1, 0
+        patches = {'patches': [{'slide_number': 2, 'title': '効果（改訂）'}]}
+        running = admission.submit('other', lambda ticket: None)
+        response = client.patch(f"/api/decks/{deck_id}", json=patches)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(int(response.headers['Retry-After']), response.get_json()['retry_after'])
+        admission.release(running)
+        response = client.patch(f"/api/decks/{deck_id}", json=patches)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(wait_for(response.get_json()['status_url'])['stage'], 'done')
+
+
+class TestAsyncMode(unittest.TestCase):
+    """ASGI（非同期）モードのテスト"""
+
+    def setUp(self):
+        use_temp_storage(self)
+
+    def _scope(self, method, path):
+        return {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method,
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': b'',
+                'root_path': '', 'headers': [(b'content-type', b'application/json')],
+                'server': ('testserver', 80), 'client': ('127.0.0.1', 1234)}
+
+    def _call(self, application, method, path, body=b''):
+        import asyncio
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        async def run():
+            await application(self._scope(method, path), receive, send)
+            # 受け付け後に実行される生成タスクの完了を待つ
+            from app import asgi
+            if asgi._tasks:
+                await asyncio.wait(set(asgi._tasks))
+
+        asyncio.run(run())
+        start = next(m for m in sent if m['type'] == 'http.response.start')
+        body = b''.join(m.get('body', b'') for m in sent if m['type'] == 'http.response.body')
+        return start['status'], dict(start['headers']), body
+
+    def test_generate_and_download(self):
+        """非同期で生成したデッキを既存のFlaskルートから取得できること"""
+        import json
+        from app import asgi
+
+        async def fake_generate(content, on_slide=None, on_progress=None, **kwargs):
+            return SAMPLE_STRUCTURE
+
+        with mock.patch('app.asgi.agenerate_slide_structure', side_effect=fake_generate):
+            status, headers, body = self._call(asgi.application, 'POST', '/api/generate',
+                                               json.dumps({'content': 'テスト入力'}).encode())
+        self.assertEqual(status, 202)
+        job_url = headers[b'location'].decode()
+        status, _, body = self._call(asgi.application, 'GET', job_url)
+        job = json.loads(body)
+        self.assertEqual(job['stage'], 'done')
+        status, _, body = self._call(asgi.application, 'GET', job['download_url'])
+        self.assertEqual(status, 200)
+        self.assertTrue(body.startswith(b'PK'))
+        self.assertEqual(self._call(asgi.application, 'GET', '/')[0], 200)
+
+    def test_flask_routes_run_concurrently(self):
+        """SSE接続が開いている間も、他のFlaskのルート（ジョブ状況）に応答すること"""
+        import asyncio
+        from app import asgi
+        from app.jobs import get_job_queue
+        queue = get_job_queue(asgi.flask_app)
+        job_id = queue.create()
+
+        async def request(path, disconnected):
+            messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+            sent = []
+
+            async def receive():
+                if messages:
+                    return messages.pop(0)
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+
+            await asgi.application(self._scope('GET', path), receive, send)
+            return b''.join(m.get('body', b'') for m in sent if m['type'] == 'http.response.body')
+
+        async def run():
+            disconnected = asyncio.Event()
+            stream = asyncio.ensure_future(request(f'/api/jobs/{job_id}/events', disconnected))
+            await asyncio.sleep(0.2)
+            status = await asyncio.wait_for(request(f'/api/jobs/{job_id}', disconnected), 2)
+            queue.update(job_id, stage='done', progress=100)
+            events = await asyncio.wait_for(stream, 5)
+            disconnected.set()
+            return status, events
+
+        status, events = asyncio.run(run())
+        self.assertIn(b'"success"', status)
+        self.assertIn(b'event: done', events)
+
+    def test_empty_content_rejected(self):
+        from app import asgi
+        status, _, _ = self._call(asgi.application, 'POST', '/api/generate', b'{"content": " "}')
+        self.assertEqual(status, 400)
+
+    def test_agenerate_structure_streaming(self):
+        """非同期クライアントのストリーミング応答からスライドが逐次通知されること"""
+        import asyncio
+        text = '{"title": "T", "slides": [{"title": "a"}, {"title": "b"}]}'
+
+        async def stream():
+            for i in range(0, len(text), 5):
+                yield mock.Mock(choices=[mock.Mock(delta=mock.Mock(content=text[i:i + 5]))])
+
+        async_client = mock.Mock()
+        async_client.chat.completions.create = mock.AsyncMock(return_value=stream())
+        generator = SlideGenerator(client=mock.Mock(), async_client=async_client)
+        received = []
+        result = asyncio.run(generator.agenerate_structure('入力', on_slide=received.append))
+        self.assertEqual([s['title'] for s in result['slides']], ['a', 'b'])
+        self.assertEqual(received, [{'title': 'a'}, {'title': 'b'}])
+
+
+class TestSlideStreamParser(unittest.TestCase):
+    """ストリーミングJSONパーサーのテスト"""
+
+    def test_slides_emitted_when_closed(self):
+        text = '```json\n{"title": "T", "slides": [{"title": "a{b}\\"", "content": {"data": {}}}, {"title": "c"}]}\n```'
+        parser = SlideStreamParser()
+        emitted = []
+        for i in range(0, len(text), 7):
+            emitted.extend(parser.feed(text[i:i + 7]))
+        self.assertEqual([s['title'] for s in emitted], ['a{b}"', 'c'])
+
+    def test_generate_structure_streaming(self):
+        """ストリーミング呼び出しでスライドが逐次通知されること"""
+        text = '{"title": "T", "slides": [{"title": "a"}, {"title": "b"}]}'
+        chunks = [
+            mock.Mock(choices=[mock.Mock(delta=mock.Mock(content=text[i:i + 5]))])
+            for i in range(0, len(text), 5)
+        ]
+        client = mock.Mock()
+        client.chat.completions.create.return_value = iter(chunks)
+        received = []
+        result = SlideGenerator(client=client).generate_structure('入力', on_slide=received.append)
+        self.assertEqual(result['title'], 'T')
+        self.assertEqual(received, [{'title': 'a'}, {'title': 'b'}])
+        kwargs = client.chat.completions.create.call_args.kwargs
+        self.assertTrue(kwargs['stream'])
+        self.assertEqual(kwargs['timeout'], 60)
+
+    def test_incomplete_slide_not_emitted(self):
+        parser = SlideStreamParser()
+        self.assertEqual(parser.feed('{"slides": [{"title": "a"}, {"title": "b'), [{'title': 'a'}])
+
+class TestStructureRepair(unittest.TestCase):
+    """LLM出力JSONの寛容なパースとスキーマ補正のテスト"""
+
+    def test_trailing_commas_and_prose(self):
+        text = '以下が構成です。\n{"title": "T", "slides": [{"title": "a", "content": {"supporting_points": ["x",],},},],}\n以上です。'
+        data, truncated = parse_json_tolerant(text)
+        self.assertFalse(truncated)
+        self.assertEqual(data['slides'][0]['content']['supporting_points'], ['x'])
+
+    def test_truncated_output_is_closed(self):
+        data, truncated = parse_json_tolerant('{"title": "T", "slides": [{"title": "a"}, {"title": "b", "content": {"main_')
+        self.assertTrue(truncated)
+        self.assertEqual([s['title'] for s in data['slides']], ['a', 'b'])
+
+    def test_defaults_and_coercion(self):
+        structure = normalize_structure({'slides': [
+            {'title': '表紙', 'type': 'title_slide'},
+            {'title': 7, 'type': 'content_slide|chart_slide', 'main_message': 'M',
+             'content': {'supporting_points': '・一\n・二', 'data': [{'label': '売上', 'value': 10}]}},
+        ]})
+        self.assertEqual(structure['title'], '表紙')
+        self.assertEqual(structure['slides'][0]['content'], {'main_message': '', 'supporting_points': [], 'data': {}})
+        second = structure['slides'][1]
+        self.assertEqual((second['title'], second['type'], second['slide_number']), ('7', 'content_slide', 2))
+        self.assertEqual(second['content']['main_message'], 'M')
+        self.assertEqual(second['content']['supporting_points'], ['一', '二'])
+        self.assertEqual(second['content']['data'], {'売上': 10})
+
+    def test_continuation_requests_only_missing_slides(self):
+        """途中で切れた応答は確定済みスライドを残し、続きだけを追加生成すること"""
+        responses = [
+            '{"title": "T", "slides": [{"title": "a"}, {"title": "b"}, {"title": "c", "con',
+            '{"slides": [{"title": "c"}, {"title": "d"}]}',
+        ]
+        client = mock.Mock()
+        client.chat.completions.create.side_effect = [
+            mock.Mock(choices=[mock.Mock(message=mock.Mock(content=text))]) for text in responses
+        ]
+        result = SlideGenerator(client=client).generate_structure('入力')
+        self.assertEqual([s['title'] for s in result['slides']], ['a', 'b', 'c', 'd'])
+        self.assertEqual([s['slide_number'] for s in result['slides']], [1, 2, 3, 4])
+        continuation = client.chat.completions.create.call_args.kwargs['messages'][1]['content']
+        self.assertIn('スライド3以降', continuation)
+
+    def test_empty_deck_is_error(self):
+        """スライドが1枚もない応答はエラーとし、途中で切れた場合は続きを生成すること"""
+        from app.structure_schema import StructureParseError
+        with self.assertRaises(StructureParseError):
+            normalize_structure({'title': 'T', 'slides': []})
+        self.assertEqual(normalize_structure({'slides': []}, allow_empty=True)['slides'], [])
+
+        def generate(*responses):
+            client = mock.Mock()
+            client.chat.completions.create.side_effect = [
+                mock.Mock(choices=[mock.Mock(message=mock.Mock(content=text))]) for text in responses
+            ]
+            return SlideGenerator(client=client).generate_structure('入力')
+
+        self.assertEqual(generate('{"title": "T", "slides": []}')['status'], 'error')
+        result = generate('{"title": "T", "slides": [{"title": "a", "con', '{"slides": [{"title": "a"}]}')
+        self.assertEqual([s['title'] for s in result['slides']], ['a'])
+        self.assertEqual(generate('{"title": "T", "slides": [', '{"slides": []}')['status'], 'error')
+
+
+class TestTokenBudget(unittest.TestCase):
+    """トークン予算（プロンプト短縮・max_tokens配分・コンテキスト長超過時の分割）のテスト"""
+
+    def setUp(self):
+        self.client = mock.Mock()
+        self.client.chat.completions.create.return_value = mock.Mock(
+            choices=[mock.Mock(message=mock.Mock(content='{"title": "T", "slides": []}'))]
+        )
+        self.generator = SlideGenerator(client=self.client)
+
+    def test_short_input_uses_compact_prompt(self):
+        self.generator.generate_structure('AI導入で業務時間を70%削減')
+        kwargs = self.client.chat.completions.create.call_args.kwargs
+        self.assertNotIn('【例】', kwargs['messages'][1]['content'])
+        self.assertLess(kwargs['max_tokens'], SlideGenerator.DEFAULT_MAX_TOKENS)
+
+    def test_max_tokens_grows_with_expected_slides(self):
+        short = self.generator.budget.completion_tokens('概要')
+        long = self.generator.budget.completion_tokens("\n".join(f"【第{i}章】\n本文" for i in range(10)))
+        self.assertGreater(long, short)
+        self.assertLessEqual(long, self.generator.budget.max_completion)
+
+    def test_overflow_switches_to_chunking(self):
+        self.generator.budget.window = 2000
+        with mock.patch.object(self.generator, 'generate_chunked', return_value={'slides': []}) as chunked:
+            self.generator.generate_structure('本文' * 1000)
+        chunked.assert_called_once()
+        self.client.chat.completions.create.assert_not_called()
+
+
+class TestLLMScheduler(unittest.TestCase):
+    """OpenAI呼び出しスケジューラーのテスト"""
+
+    def test_retries_rate_limit(self):
+        import httpx
+        import openai
+        from app.llm_scheduler import LLMScheduler
+        response = httpx.Response(429, headers={'retry-after': '0.01'}, request=httpx.Request('POST', 'http://test'))
+        func = mock.Mock(side_effect=[openai.RateLimitError('rate limited', response=response, body=None), 'ok'])
+        scheduler = LLMScheduler(max_retries=2, backoff_base=0.01, backoff_max=0.05)
+        self.assertEqual(scheduler.call(func, tokens=100), 'ok')
+        self.assertEqual(func.call_count, 2)
+
+    def test_interactive_before_batch(self):
+        """枠待ちの間は後から来た対話リクエストがバッチより先に送信されること"""
+        import threading
+        from app.llm_scheduler import LLMScheduler, PRIORITY_BATCH, PRIORITY_INTERACTIVE
+        scheduler = LLMScheduler(rpm=600)
+        scheduler._requests.level = 0
+        order = []
+        batch = threading.Thread(target=lambda: scheduler.call(lambda: order.append('batch'), priority=PRIORITY_BATCH))
+        batch.start()
+        time.sleep(0.02)
+        scheduler.call(lambda: order.append('interactive'), priority=PRIORITY_INTERACTIVE)
+        batch.join()
+        self.assertEqual(order, ['interactive', 'batch'])
+
+    def test_async_wait_runs_on_event_loop(self):
+        """非同期版の枠待ちはスレッドを使わず、優先度順に送信されること"""
+        import asyncio
+        from app.llm_scheduler import LLMScheduler, PRIORITY_BATCH, PRIORITY_INTERACTIVE
+        scheduler = LLMScheduler(rpm=600)
+        scheduler._requests.level = 0
+        order = []
+
+        async def send(name):
+            order.append(name)
+
+        async def main():
+            batch = asyncio.ensure_future(scheduler.acall(lambda: send('batch'), priority=PRIORITY_BATCH))
+            await asyncio.sleep(0.02)
+            await scheduler.acall(lambda: send('interactive'), priority=PRIORITY_INTERACTIVE)
+            await batch
+
+        with mock.patch.object(LLMScheduler, 'acquire', side_effect=AssertionError('sync acquire')):
+            asyncio.run(main())
+        self.assertEqual(order, ['interactive', 'batch'])
+        self.assertEqual(scheduler._waiting, [])
+
+    def test_coalesces_identical_requests(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from app.llm_scheduler import LLMScheduler
+        scheduler = LLMScheduler()
+        calls = []
+
+        def upstream():
+            calls.append(1)
+            time.sleep(0.1)
+            return {'title': 'T'}
+
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            results = list(executor.map(lambda _: scheduler.call(upstream, key='same'), range(3)))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'title': 'T'}] * 3)
+
+
+class TestLLMHedge(unittest.TestCase):
+    """LLM呼び出しのヘッジ（フォールバックモデルへの並行送信）のテスト"""
+
+    def test_slow_stream_hedged_to_fallback_model(self):
+        """応答開始が遅いとフォールバックモデルで送信し、先に応答した方を採用して他方を閉じること"""
+        import threading
+        from app.llm_hedge import HedgePolicy
+        from app.metrics import metrics
+        text = '{"title": "T", "slides": [{"title": "a"}]}'
+        closed = threading.Event()
+
+        def create(**kwargs):
+            chunks = [mock.Mock(choices=[mock.Mock(delta=mock.Mock(content=text))])]
+            if kwargs['model'] == 'gpt-4':
+                time.sleep(0.3)
+            response = mock.MagicMock()
+            response.__iter__.return_value = iter(chunks)
+            response.response.close = closed.set
+            return response
+
+        client = mock.Mock()
+        client.chat.completions.create.side_effect = create
+        hedge = HedgePolicy(enabled=True, models=['fast-model'], default_delay=0.05)
+        generator = SlideGenerator(client=client, hedge=hedge)
+        started = time.perf_counter()
+        result = generator.generate_structure('入力', on_slide=lambda slide: None)
+        self.assertEqual(result['title'], 'T')
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertTrue(closed.wait(2))
+        models = [c.kwargs['model'] for c in client.chat.completions.create.call_args_list]
+        self.assertEqual(models, ['gpt-4', 'fast-model'])
+        self.assertIn('llm_hedge_wins_total{model="fast-model",winner="hedge"}', metrics.render_prometheus())
+
+    def test_slow_completion_loser_is_closed(self):
+        """ストリーミングしない呼び出しでも、採用されなかった送信の接続を閉じること"""
+        import threading
+        from app.llm_hedge import HedgePolicy
+        closed = threading.Event()
+
+        def create(**kwargs):
+            text = '{"title": "%s", "slides": [{"title": "a"}]}' % kwargs['model']
+            if kwargs['model'] == 'gpt-4':
+                time.sleep(0.3)
+            raw = mock.Mock()
+            raw.parse.return_value = mock.Mock(choices=[mock.Mock(message=mock.Mock(content=text))])
+            if kwargs['model'] == 'gpt-4':
+                raw.http_response.close = closed.set
+            return raw
+
+        client = mock.Mock()
+        client.chat.completions.with_raw_response.create.side_effect = create
+        hedge = HedgePolicy(enabled=True, models=['fast-model'], default_delay=0.05)
+        result = SlideGenerator(client=client, hedge=hedge).generate_structure('入力')
+        self.assertEqual(result['title'], 'fast-model')
+        self.assertTrue(closed.wait(2))
+        client.chat.completions.create.assert_not_called()
+
+    def test_failure_falls_back_and_rate_is_capped(self):
+        """失敗時は次のモデルで送信し、遅延によるヘッジは max_rate を超えないこと"""
+        from app.llm_hedge import HedgePolicy
+        hedge = HedgePolicy(enabled=True, models=['fallback'], max_rate=0.5, default_delay=0.01)
+
+        def fail_primary(attempt):
+            if attempt.model == 'primary':
+                raise RuntimeError('boom')
+            return attempt.model
+
+        self.assertEqual(hedge.run(fail_primary, 'primary', 'complete'), 'fallback')
+        self.assertEqual(hedge.run(lambda attempt: time.sleep(0.05) or attempt.model, 'primary', 'complete'), 'primary')
+        self.assertEqual(hedge.hedge_rate(), 0.5)
+        with self.assertRaises(RuntimeError):
+            HedgePolicy(enabled=True, models=[]).run(mock.Mock(side_effect=RuntimeError('boom')), 'primary', 'complete')
+
+    def test_async_hedge_cancels_loser(self):
+        import asyncio
+        from app.llm_hedge import HedgePolicy
+        hedge = HedgePolicy(enabled=True, models=['fast'], default_delay=0.02)
+        cancelled = []
+
+        async def send(attempt):
+            try:
+                await asyncio.sleep(1 if attempt.model == 'slow' else 0)
+            except asyncio.CancelledError:
+                cancelled.append(attempt.model)
+                raise
+            return attempt.model
+
+        self.assertEqual(asyncio.run(hedge.arun(send, 'slow', 'stream')), 'fast')
+        self.assertEqual(cancelled, ['slow'])
+
+
+class TestPPTXRendering(unittest.TestCase):
+    """PPTXレンダリングのテスト（メモリ上で生成）"""
+
+    def test_render_bytes_styles(self):
+        import io
+        from pptx import Presentation
+        data = PPTXCreator().render_bytes(SAMPLE_STRUCTURE)
+        prs = Presentation(io.BytesIO(data))
+        self.assertEqual(len(prs.slides), len(SAMPLE_STRUCTURE['slides']))
+        # 全スライドが空白レイアウトのスケルトンから生成されていること
+        self.assertEqual(len(prs.slide_layouts), 1)
+        title_run = prs.slides[1].shapes[1].text_frame.paragraphs[0].runs[0]
+        self.assertEqual(title_run.text, '効果')
+        self.assertEqual(title_run.font.size.pt, PPTXCreator.FONT_HEADER[1])
+        self.assertTrue(title_run.font.bold)
+        self.assertEqual(title_run.font.color.rgb, PPTXCreator.DARK_GRAY)
+
+    def test_memory_render_does_not_create_storage(self):
+        """メモリ上の描画では保存領域を取得せず、ファイル保存時にだけ取得すること"""
+        with mock.patch('app.pptx_creator.get_deck_storage') as get_storage:
+            PPTXCreator().render_bytes(SAMPLE_STRUCTURE)
+            get_storage.assert_not_called()
+            PPTXCreator().create_presentation(SAMPLE_STRUCTURE)
+            get_storage.return_value.write.assert_called_once()
+
+    def test_streaming_writer_matches_render_bytes(self):
+        """ストリーミング出力がメモリ上での生成と同じスライドを、イテレータの順に書き出すこと"""
+        import io
+        from lxml import etree
+        from pptx import Presentation
+        from app.pptx_stream import StreamingPPTXWriter
+        buffer = io.BytesIO()
+        count = StreamingPPTXWriter().write(iter(SAMPLE_STRUCTURE['slides']), buffer, SAMPLE_STRUCTURE['title'])
+        self.assertEqual(count, len(SAMPLE_STRUCTURE['slides']))
+        streamed = Presentation(io.BytesIO(buffer.getvalue())).slides
+        expected = Presentation(io.BytesIO(PPTXCreator().render_bytes(SAMPLE_STRUCTURE))).slides
+        self.assertEqual(len(streamed), len(expected))
+        for actual, reference in zip(streamed, expected):
+            self.assertEqual(etree.tostring(actual._element), etree.tostring(reference._element))
+
+
+class TestDataRendering(unittest.TestCase):
+    """data の数値解析と表・グラフ・分割の選択のテスト"""
+
+    def test_parse_values(self):
+        from app.data_render import parse_data
+        points = parse_data({'売上': '1.2億円', '費用': '300万円', '率': '80％', '件数': 1200, '赤字': '△5億円', '時期': '未定'})
+        self.assertEqual([p.value for p in points], [1.2e8, 3e6, 80.0, 1200.0, -5e8, None])
+        self.assertEqual([p.unit for p in points[:3]], ['円', '円', '%'])
+        self.assertEqual(points[3].text, '1,200')
+
+    def test_table_pagination_and_chart(self):
+        """多数の data は表に分割し、単位の揃った数値はネイティブグラフにすること"""
+        import io
+        from pptx import Presentation
+        many = {f'指標{i}': f'{i}件' if i % 2 else '未定' for i in range(30)}
+        trend = {'1年目': '1,200万円', '3年目': '1.2億円', '5年目': '3.6億円'}
+        structure = {'title': 'テスト', 'slides': [
+            {'title': '指標', 'type': 'financial_slide', 'content': {'main_message': 'm', 'data': many}},
+            {'title': '売上推移', 'type': 'chart_slide', 'content': {'main_message': '5年で3.6億円', 'data': trend}},
+        ]}
+        prs = Presentation(io.BytesIO(PPTXCreator().render_bytes(structure)))
+        self.assertEqual(len(prs.slides), 4)
+        tables = [sh for s in list(prs.slides)[:3] for sh in s.shapes if sh.has_table]
+        self.assertEqual(len(tables), 3)
+        self.assertEqual(sum(len(t.table.rows) - 1 for t in tables), 30)
+        self.assertEqual(prs.slides[1].shapes[1].text_frame.text, '指標（2/3）')
+        charts = [sh.chart for sh in prs.slides[3].shapes if sh.has_chart]
+        self.assertEqual(len(charts), 1)
+        self.assertEqual(charts[0].plots[0].series[0].values, (1200.0, 12000.0, 36000.0))
+        self.assertEqual(charts[0].plots[0].data_labels.number_format, '#,##0"万円"')
+
+        # ストリーミング出力・プレビューも同じ枚数に分割されること
+        from app.pptx_stream import StreamingPPTXWriter
+        from app.preview import render_preview_html
+        buffer = io.BytesIO()
+        self.assertEqual(StreamingPPTXWriter().write(iter(structure['slides']), buffer), 4)
+        self.assertEqual(len(Presentation(io.BytesIO(buffer.getvalue())).slides), 4)
+        self.assertEqual(render_preview_html(structure).count('<svg'), 4)
+
+
+class TestStubServer(unittest.TestCase):
+    """ベンチマーク用スタブLLMサーバー経由でのエンドツーエンド生成テスト"""
+
+    def test_generate_against_stub(self):
+        from app.llm_client import build_llm_client
+        from benchmarks.stub_openai import StubConfig, start_stub_server
+        server, base_url = start_stub_server(StubConfig(latency=0, tokens_per_second=100000, slide_count=3))
+        try:
+            client = build_llm_client(api_key='stub', base_url=base_url)
+            generator = SlideGenerator(client=client)
+            received = []
+            streamed = generator.generate_structure('入力', on_slide=received.append)
+            plain = generator.generate_structure('入力')
+        finally:
+            server.shutdown()
+        self.assertEqual(len(streamed['slides']), 3)
+        self.assertEqual(len(received), 3)
+        self.assertEqual(plain, streamed)
+        self.assertEqual(server.config.requests, 2)
+
+
+class TestChunkedGeneration(unittest.TestCase):
+    """長文の分割生成と統合のテスト"""
+
+    def test_split_sections_respects_limit(self):
+        content = "\n".join(f"【第{i}章】\n" + "本文" * 200 for i in range(10))
+        sections = split_sections(content, max_chars=1000)
+        self.assertGreater(len(sections), 1)
+        self.assertTrue(all(len(section) <= 1000 for section in sections))
+        self.assertTrue(sections[1].startswith("【"))
+
+    def test_merge_orders_and_deduplicates(self):
+        parts = [
+            {"title": "全体", "slides": [
+                {"type": "title_slide", "title": "全体"},
+                {"type": "content_slide", "title": "市場規模", "content": {"supporting_points": ["a"]}},
+            ]},
+            {"title": "後半", "slides": [
+                {"type": "title_slide", "title": "後半"},
+                {"type": "content_slide", "title": "市場 規模", "content": {"supporting_points": ["b"]}},
+                {"type": "conclusion_slide", "title": "まとめ"},
+                {"type": "content_slide", "title": "競合"},
+            ]},
+        ]
+        merged = merge_structures(parts)
+        self.assertEqual(merged["title"], "全体")
+        self.assertEqual([s["title"] for s in merged["slides"]], ["全体", "市場規模", "競合", "まとめ"])
+        self.assertEqual(merged["slides"][1]["content"]["supporting_points"], ["a", "b"])
+        self.assertEqual([s["slide_number"] for s in merged["slides"]], [1, 2, 3, 4])
+
+    def test_generate_chunked_calls_per_section(self):
+        client = mock.Mock()
+        message = mock.Mock(content='{"title": "T", "slides": [{"type": "content_slide", "title": "x"}]}')
+        client.chat.completions.create.return_value = mock.Mock(choices=[mock.Mock(message=message)])
+        content = "\n\n".join("段落" * 400 for _ in range(3))
+        result = SlideGenerator(client=client).generate_chunked(content, max_chars=1000)
+        self.assertEqual(client.chat.completions.create.call_count, 3)
+        self.assertEqual(len(result["slides"]), 1)
+
+
+class TestOutlineGeneration(unittest.TestCase):
+    """構成を先に生成し、スライドごとに並列展開する2段階生成のテスト"""
+
+    OUTLINE = {"title": "T", "slides": [
+        {"slide_number": 1, "title": "表紙", "type": "title_slide", "main_message": "副題"},
+        {"slide_number": 2, "title": "市場", "type": "content_slide", "main_message": "市場は500億円"},
+        {"slide_number": 3, "title": "推移", "type": "chart_slide", "main_message": "売上は倍増"},
+    ]}
+
+    def _client(self, expand):
+        import json
+
+        def create(**kwargs):
+            prompt = kwargs['messages'][-1]['content']
+            if '【展開するスライド】' in prompt:
+                text = expand(prompt)
+            else:
+                text = json.dumps(self.OUTLINE, ensure_ascii=False)
+            return mock.Mock(choices=[mock.Mock(message=mock.Mock(content=text))])
+
+        client = mock.Mock()
+        client.chat.completions.create.side_effect = create
+        return client
+
+    def test_expands_slides_in_order(self):
+        def expand(prompt):
+            if 'スライド2:' in prompt:
+                time.sleep(0.05)
+                return '{"supporting_points": ["規模500億円"], "data": {"市場規模": "500億円"}}'
+            return '{"supporting_points": ["2024年 10億円"], "data": {"2023年": "5億円", "2024年": "10億円"}}'
+
+        client = self._client(expand)
+        received = []
+        progress = []
+        result = SlideGenerator(client=client).generate_outlined(
+            '入力', on_slide=received.append, on_progress=lambda done, total: progress.append((done, total))
+        )
+        # 構成1回 + タイトル以外の2枚の展開
+        self.assertEqual(client.chat.completions.create.call_count, 3)
+        self.assertEqual([s['title'] for s in received], ['表紙', '市場', '推移'])
+        self.assertEqual(result['slides'][1]['content']['main_message'], '市場は500億円')
+        self.assertEqual(result['slides'][1]['content']['data'], {'市場規模': '500億円'})
+        self.assertEqual(result['slides'][2]['content']['supporting_points'], ['2024年 10億円'])
+        self.assertEqual(progress[-1], (3, 3))
+        chart_prompt = [c.kwargs['messages'][-1]['content'] for c in client.chat.completions.create.call_args_list
+                        if 'スライド3:' in c.kwargs['messages'][-1]['content']][0]
+        self.assertIn('単位をそろえた数値', chart_prompt)
+
+    def test_failed_expansion_keeps_outline(self):
+        import asyncio
+        client = self._client(lambda prompt: 'not json')
+        async_client = mock.Mock()
+
+        async def create(**kwargs):
+            return client.chat.completions.create(**kwargs)
+
+        async_client.chat.completions.create = create
+        generator = SlideGenerator(client=client, async_client=async_client)
+        result = asyncio.run(generator.agenerate_outlined('入力'))
+        self.assertEqual([s['title'] for s in result['slides']], ['表紙', '市場', '推移'])
+        self.assertEqual(result['slides'][2]['content']['main_message'], '売上は倍増')
+        self.assertEqual(result['slides'][2]['content']['supporting_points'], [])
+
+    def test_expansion_sends_relevant_excerpt(self):
+        """展開には元の文書全体ではなく、スライドに関連する箇所の抜粋（上限文字数以内）を添えること"""
+        from app.slide_generator import EXPAND_EXCERPT_CHARS
+        sections = [f'【{name}】' + text * 60 for name, text in (
+            ('市場', '市場規模は500億円。'), ('財務', '売上は3年で倍増。'), ('組織', '人員を50名に拡大。'))]
+        content = '\n\n'.join(sections)
+        self.assertGreater(len(content), EXPAND_EXCERPT_CHARS)
+        generator = SlideGenerator(client=mock.Mock())
+        prompt = generator._build_expand_prompt(content, normalize_structure(self.OUTLINE), 2)
+        excerpt = prompt.split('関連する箇所の抜粋）】\n', 1)[1]
+        self.assertLessEqual(len(excerpt.strip()), EXPAND_EXCERPT_CHARS)
+        self.assertIn('売上は3年で倍増', excerpt)
+        self.assertNotIn('人員を50名に拡大', excerpt)
+
+    def test_falls_back_to_single_when_over_tpm(self):
+        """展開の合計トークン数の見積もりがTPMを超える場合は1回の生成にすること"""
+        from app.llm_scheduler import LLMScheduler
+        content = '【市場】市場規模は500億円。' * 200
+        for tpm, calls in ((10000, 1), (1000000, 3)):
+            client = self._client(lambda prompt: '{"supporting_points": ["a"], "data": {}}')
+            generator = SlideGenerator(client=client, scheduler=LLMScheduler(tpm=tpm))
+            generator.generate_outlined(content)
+            self.assertEqual(client.chat.completions.create.call_count, calls)
+            first_prompt = client.chat.completions.create.call_args_list[0].kwargs['messages'][-1]['content']
+            self.assertEqual('【構成の出力ルール】' in first_prompt, tpm > 10000)
+
+
+class TestBatch(unittest.TestCase):
+    """一括生成CLIのマニフェスト処理テスト"""
+
+    def test_manifest_resume(self):
+        from app.batch import load_manifest
+        with tempfile.TemporaryDirectory() as tmpdir:
+            manifest = Path(tmpdir) / "manifest.jsonl"
+            manifest.write_text(
+                '{"id": "a", "status": "done"}\n'
+                '{"id": "b", "status": "done"}\n'
+                '{"id": "b", "status": "failed"}\n'
+                '{"id": "c", "sta',
+                encoding="utf-8",
+            )
+            self.assertEqual(set(load_manifest(manifest)), {"a"})
+
+    def test_unsafe_ids_rejected(self):
+        """出力先の外を指すIDは生成せずに失敗として記録すること"""
+        from app.batch import run_batch, valid_item_id
+        self.assertTrue(valid_item_id("brief-01_v2"))
+        for item_id in ("../../x", "a/b", "..", ".hidden", ""):
+            self.assertFalse(valid_item_id(item_id))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source = Path(tmpdir) / "briefs.jsonl"
+            source.write_text('{"id": "../../x", "content": "テスト"}\n', encoding="utf-8")
+            with mock.patch('app.batch._generate') as generate:
+                records = run_batch(source, Path(tmpdir) / "out", render_workers=1)
+            generate.assert_not_called()
+        self.assertEqual([(r["id"], r["status"], r["stage"]) for r in records], [("../../x", "failed", "input")])
+
+    def test_run_batch_completes_all_items(self):
+        """LLM・レンダリングの完了順によらず、全件がマニフェストに記録されること"""
+        from app.batch import run_batch
+        with tempfile.TemporaryDirectory() as tmpdir:
+            source = Path(tmpdir) / "briefs.jsonl"
+            source.write_text(''.join(f'{{"id": "b{i}", "content": "テスト{i}"}}\n' for i in range(5)), encoding="utf-8")
+            with mock.patch('app.batch._generate', side_effect=lambda item_id, content, use_cache: (item_id, SAMPLE_STRUCTURE, 0.0)):
+                records = run_batch(source, Path(tmpdir) / "out", render_workers=2)
+            self.assertEqual(sorted(r["id"] for r in records if r["status"] == "done"), [f"b{i}" for i in range(5)])
+            self.assertTrue(all(Path(r["output"]).exists() for r in records))
+
+
+class TestDeckStorage(unittest.TestCase):
+    """生成デッキ保存領域のテスト"""
+
+    def setUp(self):
+        from app.storage import DeckStorage
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.storage = DeckStorage(self.tmpdir.name, ttl=3600, max_bytes=250)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_sharded_paths(self):
+        pptx = self.storage.write("presentation_abc.pptx", b"x")
+        structure = self.storage.write("presentation_abc.json", b"{}")
+        self.assertEqual(pptx.parent, structure.parent)
+        self.assertEqual(pptx.parent.parent, Path(self.tmpdir.name).resolve())
+        self.assertEqual(self.storage.read("presentation_abc.pptx"), b"x")
+        with self.assertRaises(ValueError):
+            self.storage.path_for("../secret.pptx")
+
+    def test_ttl_and_lru_quota(self):
+        now = time.time()
+        for i, name in enumerate(("a.pptx", "b.pptx", "c.pptx")):
+            path = self.storage.write(name, b"0" * 100)
+            os.utime(path, (now - 100 + i, now - 100 + i))
+        old = self.storage.write("old.pptx", b"0")
+        os.utime(old, (now - 7200, now - 7200))
+        # a を参照して最終アクセスを更新 → 容量超過時は b から削除される
+        self.assertIsNotNone(self.storage.open_path("a.pptx"))
+        result = self.storage.cleanup()
+        self.assertEqual((result["expired"], result["evicted"]), (1, 1))
+        self.assertIsNone(self.storage.open_path("b.pptx"))
+        self.assertIsNotNone(self.storage.open_path("a.pptx"))
+        self.assertIsNotNone(self.storage.open_path("c.pptx"))
+
+    def test_deck_files_evicted_together(self):
+        """ダウンロードでPPTXだけが参照されたデッキも、構造JSONと一緒に保持・削除されること"""
+        now = time.time()
+        for i, deck in enumerate(("presentation_a", "presentation_b")):
+            for suffix in (".pptx", ".json"):
+                path = self.storage.write(deck + suffix, b"0" * 60)
+                os.utime(path, (now - 100 + i, now - 100 + i))
+        # a のPPTXだけを参照 → 容量超過時は b のPPTXと構造JSONが削除される
+        self.assertIsNotNone(self.storage.open_path("presentation_a.pptx"))
+        self.storage.write("presentation_c.pptx", b"0" * 60)
+        result = self.storage.cleanup()
+        self.assertEqual(result["evicted"], 2)
+        self.assertIsNotNone(self.storage.open_path("presentation_a.json"))
+        self.assertIsNone(self.storage.open_path("presentation_b.pptx"))
+        self.assertIsNone(self.storage.open_path("presentation_b.json"))
+
+    def test_cleanup_ignores_other_files(self):
+        """保存領域のデッキ以外のファイル（シャード外・他の拡張子）は削除しないこと"""
+        root = Path(self.tmpdir.name)
+        (root / "app").mkdir()
+        others = [root / "app" / "main.py", root / "app" / "presentation_x.pptx"]
+        deck = self.storage.write("presentation_x.json", b"{}")
+        others.append(deck.parent / "notes.txt")
+        for path in others + [deck]:
+            path.write_bytes(b"0")
+            os.utime(path, (0, 0))
+        self.assertEqual(self.storage.cleanup()["expired"], 1)
+        self.assertFalse(deck.exists())
+        self.assertTrue(all(path.exists() for path in others))
+
+    def test_empty_storage_root_uses_default(self):
+        from app import storage
+        with mock.patch.dict(os.environ, {'STORAGE_ROOT': ''}), \
+                mock.patch.object(storage, '_default_storage', None), \
+                mock.patch.object(storage, 'DEFAULT_STORAGE_ROOT', Path(self.tmpdir.name) / 'generated'):
+            self.assertEqual(storage.get_deck_storage().root, (Path(self.tmpdir.name) / 'generated').resolve())
+
+
+class TestStructureCache(unittest.TestCase):
+    """スライド構造キャッシュのテスト"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name) / "cache.sqlite3"
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_key_normalization(self):
+        a = make_cache_key("売上　１００億円\n\n  成長率 8% ", "gpt-4", 0.2, "1")
+        b = make_cache_key("売上 100億円\n成長率 8%", "gpt-4", 0.2, "1")
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, make_cache_key("売上 100億円\n成長率 8%", "gpt-4", 0.2, "2"))
+
+    def test_memory_and_disk_tiers(self):
+        cache = StructureCache(self.path, max_memory_entries=1)
+        cache.set("a", {"title": "A"})
+        cache.set("b", {"title": "B"})
+        self.assertEqual(cache.get("b"), {"title": "B"})
+        self.assertEqual(cache.get("a"), {"title": "A"})
+        self.assertIsNone(cache.get("c"))
+        stats = cache.stats()
+        self.assertEqual((stats["memory_hits"], stats["disk_hits"], stats["misses"]), (1, 1, 1))
+        # 再起動後もディスクから復元できること
+        self.assertEqual(StructureCache(self.path).get("a"), {"title": "A"})
+
+    def test_size_and_ttl_eviction(self):
+        cache = StructureCache(self.path, max_memory_entries=1, max_disk_entries=2)
+        for key in ("a", "b", "c"):
+            cache.set(key, {"title": key})
+        self.assertEqual(cache.stats()["disk_entries"], 2)
+        expired = StructureCache(self.path, ttl=-1)
+        self.assertIsNone(expired.get("c"))
+
+    def test_empty_result_not_cached(self):
+        """スライドのない生成結果はキャッシュしないこと"""
+        from app.slide_generator import generate_slide_structure
+        cache = StructureCache(self.path)
+        with mock.patch('app.slide_generator.get_structure_cache', return_value=cache), \
+                mock.patch('app.slide_generator.get_llm_client'), \
+                mock.patch.object(SlideGenerator, 'generate_structure', return_value={'title': '空', 'slides': []}):
+            generate_slide_structure('空の入力')
+        self.assertEqual(cache.stats()["disk_entries"], 0)
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file